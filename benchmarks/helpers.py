@@ -0,0 +1,15 @@
+"""Helpers shared by the benchmark scripts.
+"""
+from sqlalchemy import event
+
+
+class QueryCounter:
+    """Counts the statements sent to the database.
+    """
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self)
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""Micro-benchmark for matching subject IDs to dashboard records.
+
+Compares dashboard.resolver against the lookups it replaced (a study query
+through study_sites and alt_study_codes, followed by separate timepoint and
+session queries). Session IDs are sampled from the configured database and
+nothing is modified. Each ID is resolved in a fresh database session to mimic
+separate requests.
+
+Usage:
+    id_resolver.py [options]
+
+Options:
+    --count N       The number of session IDs to sample [default: 500]
+    --repeat N      The number of times to resolve each ID [default: 3]
+"""
+import time
+import statistics
+
+from docopt import docopt
+
+import dashboard
+from dashboard.models import Session, Timepoint
+from dashboard.queries import get_studies
+from dashboard.resolver import resolver
+from datman import scanid
+
+from helpers import QueryCounter
+
+db = dashboard.db_context()
+
+
+def legacy_resolve(ident):
+    studies = get_studies(tag=ident.study, site=ident.site)
+    timepoint = Timepoint.query.get(ident.get_full_subjectid_with_timepoint())
+    session = Session.query.get((ident.get_full_subjectid_with_timepoint(),
+                                 scanid.get_session_num(ident)))
+    return studies, timepoint, session
+
+
+def run(func, idents, repeat, counter):
+    timings = []
+    counter.count = 0
+    for _ in range(repeat):
+        for ident in idents:
+            db.session.remove()
+            start = time.perf_counter()
+            func(ident)
+            timings.append(time.perf_counter() - start)
+    return timings, counter.count / (len(idents) * repeat)
+
+
+def report(name, timings, queries):
+    timings = sorted(timings)
+    print("{:<10} mean {:8.3f} ms   p50 {:8.3f} ms   p95 {:8.3f} ms   "
+          "{:.2f} queries/ID".format(
+              name,
+              statistics.mean(timings) * 1000,
+              timings[len(timings) // 2] * 1000,
+              timings[int(len(timings) * 0.95)] * 1000,
+              queries))
+
+
+def main():
+    args = docopt(__doc__)
+    count = int(args['--count'])
+    repeat = int(args['--repeat'])
+
+    idents = []
+    for session in Session.query.limit(count):
+        try:
+            idents.append(scanid.parse(str(session)))
+        except scanid.ParseException:
+            continue
+    if not idents:
+        print("No sessions found in database.")
+        return
+
+    counter = QueryCounter(db.engine)
+    # Build the index once up front, as a running server would have.
+    resolver.find_studies('', '')
+
+    print("Resolving {} IDs x {}".format(len(idents), repeat))
+    report("legacy", *run(legacy_resolve, idents, repeat, counter))
+    report("resolver", *run(resolver.resolve, idents, repeat, counter))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""Report the time spent importing modules when the dashboard starts.
+
+Each scenario is run in a fresh python interpreter with '-X importtime' and
+the median import time of every module is reported, along with the slowest
+modules. Scenarios cover importing the dashboard, the database only context
+used by scripts (dashboard.db_context) and a full app (as each uwsgi worker
+makes). They're run as a scheduler client with no custom menu config, as
+most processes are.
+
+Optional integrations (XNAT, REDCap, GitHub, etc.) should only be imported
+when they're used. If a scenario imports any of them, or its total import
+time grows by more than --max-increase percent over a --baseline, the
+problem is reported and the script exits with status 1.
+
+Usage:
+    import_time.py [options]
+
+Options:
+    --repeat N          The number of times to run each scenario [default: 5]
+    --top N             The number of slowest modules to list [default: 15]
+    --only TEXT         Only run scenarios with names containing TEXT
+    --output FILE       Save the results as JSON
+    --baseline FILE     Compare the total times with an earlier --output
+    --max-increase N    The largest increase in total import time (as a
+                        percentage of --baseline) allowed [default: 20]
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+from docopt import docopt
+
+# Modules that should only be imported when the feature using them is used
+LAZY_MODULES = [
+    'xnat',
+    'redcap',
+    'github',
+    'pydantic',
+    'yaml',
+    'apscheduler',
+    'flask_apscheduler',
+    'datman.header_checks'
+]
+
+
+class Scenario:
+    """A statement to run in a fresh interpreter.
+
+    Args:
+        name (str): The name to report.
+        statement (str): The python code to run.
+        lazy (:obj:`list`, optional): The modules the statement must not
+            import.
+    """
+
+    def __init__(self, name, statement, lazy=None):
+        self.name = name
+        self.statement = statement
+        self.lazy = lazy or []
+
+
+SCENARIOS = [
+    Scenario("import dashboard", "import dashboard", LAZY_MODULES),
+    Scenario("db_context",
+             "import dashboard; dashboard.db_context()",
+             LAZY_MODULES),
+    # datman.config (needed by the views) reads its settings with yaml
+    Scenario("create_app",
+             "import dashboard; dashboard.create_app()",
+             [item for item in LAZY_MODULES if item != 'yaml'])
+]
+
+
+def get_env():
+    env = dict(os.environ)
+    env.pop('DASHBOARD_SCHEDULER', None)
+    env.pop('DASH_MENU_CONFIG', None)
+    return env
+
+
+def profile(statement):
+    """Run a statement with '-X importtime'.
+
+    Returns:
+        :obj:`list` of :obj:`tuple`: The name, nesting level, self time and
+            cumulative time (in microseconds) of each imported module, in the
+            order they finished importing.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        env=get_env(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return parse(result.stderr)
+
+
+def parse(output):
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # The header, or a line of some other output
+            continue
+        name = fields[2][1:]
+        level = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), level, int(fields[0]), int(fields[1])))
+    return modules
+
+
+def run(scenario, repeat):
+    """Profile a scenario's imports.
+
+    Returns:
+        dict: The median 'total' import time (in ms), the number of
+            'modules' imported, the median cumulative time (in ms) of each
+            of the 'slowest' modules and any 'lazy' modules imported.
+    """
+    totals = []
+    times = {}
+    for _ in range(repeat):
+        modules = profile(scenario.statement)
+        totals.append(sum(cumulative for _, level, _, cumulative in modules
+                          if level == 0))
+        for name, _, _, cumulative in modules:
+            times.setdefault(name, []).append(cumulative)
+
+    medians = {name: statistics.median(found) / 1000
+               for name, found in times.items()}
+    imported = [name for name in scenario.lazy if name in medians]
+    return {
+        "total": statistics.median(totals) / 1000,
+        "modules": len(medians),
+        "slowest": sorted(medians.items(), key=lambda x: x[1],
+                          reverse=True),
+        "lazy": imported
+    }
+
+
+def report(name, result, top, baseline=None):
+    if "error" in result:
+        print("{}: ERROR {}".format(name, result["error"]))
+        return
+    line = "{}: {:.1f} ms for {} modules".format(
+        name, result["total"], result["modules"])
+    if baseline:
+        line += " ({:+.1f}% from baseline)".format(
+            (result["total"] / baseline["total"] - 1) * 100)
+    print(line)
+    for module, elapsed in result["slowest"][:top]:
+        print("    {:>9.1f} ms   {}".format(elapsed, module))
+    if result["lazy"]:
+        print("    Imported optional modules: {}".format(
+            ", ".join(result["lazy"])))
+
+
+def check(name, result, baseline, max_increase):
+    """Get the problems found for a scenario.
+    """
+    if "error" in result:
+        return ["{} failed".format(name)]
+    problems = []
+    if result["lazy"]:
+        problems.append("{} imported {}".format(
+            name, ", ".join(result["lazy"])))
+    if baseline:
+        increase = (result["total"] / baseline["total"] - 1) * 100
+        if increase > max_increase:
+            problems.append("{} import time increased by {:.1f}%".format(
+                name, increase))
+    return problems
+
+
+def main():
+    args = docopt(__doc__)
+    baseline = {}
+    if args["--baseline"]:
+        with open(args["--baseline"]) as fh:
+            baseline = json.load(fh)
+
+    results = {}
+    problems = []
+    for scenario in SCENARIOS:
+        if args["--only"] and args["--only"] not in scenario.name:
+            continue
+        try:
+            result = run(scenario, int(args["--repeat"]))
+        except RuntimeError as e:
+            result = {"error": str(e)}
+        found = baseline.get(scenario.name)
+        if found and "total" not in found:
+            found = None
+        report(scenario.name, result, int(args["--top"]), found)
+        problems.extend(check(scenario.name, result, found,
+                              float(args["--max-increase"])))
+        results[scenario.name] = result
+
+    if args["--output"]:
+        with open(args["--output"], "w") as fh:
+            json.dump(results, fh, indent=2)
+
+    if problems:
+        print("\n".join(["", "Problems found:"] + problems))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
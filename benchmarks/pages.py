@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+"""Benchmark the dashboard's busiest pages and queries on synthetic data.
+
+The test database is filled by synthetic_data.py (with the same options it
+takes) and then each scenario is timed. Scenarios cover the study page, the
+timepoint page, the QC search and the search bar, all requested through the
+app's test client as a logged in user, along with the functions in
+dashboard.queries that they rely on. Each database session is discarded
+between calls to mimic separate requests.
+
+For each scenario the latency percentiles, the number of SQL statements per
+call and the peak memory allocated by a single call (measured in a separate,
+untimed run with tracemalloc) are reported. Results can be saved with
+--output and then given to a later run with --baseline to show how much each
+scenario has changed.
+
+Usage:
+    pages.py [options]
+
+Options:
+    --repeat N          The number of times to run each scenario [default: 20]
+    --targets N         The number of timepoints, studies, etc. to sample as
+                        targets for each scenario [default: 5]
+    --user NAME         Run views as the 'admin' or a regular 'user' with
+                        access to one site per study [default: admin]
+    --only TEXT         Only run scenarios with names containing TEXT
+    --reuse             Use the data already in the test database instead of
+                        generating it again
+    --output FILE       Save the results as JSON
+    --baseline FILE     Compare the median times with an earlier --output
+    --seed N            The random seed to use [default: 0]
+    --studies N         The number of studies [default: 3]
+    --sites N           The number of sites per study [default: 3]
+    --timepoints N      The number of timepoints per study site [default: 100]
+    --sessions N        The number of sessions per timepoint [default: 1]
+    --scans N           The number of scans per session [default: 8]
+    --reviewed F        The fraction of scans with a QC checklist entry
+                        [default: 0.7]
+    --metrics N         The number of metric values per scan [default: 4]
+    --phantoms F        The fraction of timepoints that are phantoms
+                        [default: 0.05]
+"""
+import json
+import time
+import random
+import statistics
+import tracemalloc
+
+from docopt import docopt
+from flask import current_app
+
+from dashboard import queries
+from dashboard.models import Scan, Session, User, study_timepoints_table
+
+from helpers import QueryCounter
+from synthetic_data import connect_test_db, generate
+
+
+class Scenario:
+    """A named function to time against each of a list of targets.
+    """
+
+    def __init__(self, name, func, targets):
+        self.name = name
+        self.func = func
+        self.targets = targets
+
+
+def get_scenarios(db, client, count, seed):
+    """Build the scenarios to time, with targets sampled from the database.
+    """
+    rng = random.Random(seed)
+
+    def sample(items):
+        items = sorted(items)
+        return rng.sample(items, min(count, len(items)))
+
+    study_tps = db.session.query(study_timepoints_table).all()
+    studies = sample({study for study, _ in study_tps})
+    timepoints = sample(study_tps)
+    subjects = sample({name.rsplit('_', 1)[0] for _, name in study_tps})
+    session_keys = [(item.name, item.num) for item in Session.query]
+    sessions = sample(session_keys)
+    scan_names = [item.name for item in Scan.query.with_entities(Scan.name)]
+    scans = sample(scan_names)
+    sites = sorted({name.split('_')[1] for _, name in study_tps})
+    db.session.remove()
+
+    def get(url):
+        response = client.get(url)
+        check(response, url)
+
+    def post(url, data):
+        response = client.post(url, data=data)
+        check(response, url)
+
+    return [
+        Scenario("view main.study",
+                 lambda study: get("/study/{}".format(study)),
+                 studies),
+        Scenario("view timepoints.timepoint",
+                 lambda item: get("/study/{}/timepoint/{}/".format(*item)),
+                 timepoints),
+        Scenario("view qc_search.lookup_data",
+                 lambda study: post("/qc-reviews/submit-query", {
+                     "approved": "y", "blacklisted": "y", "flagged": "y",
+                     "include_new": "y", "sort": "y", "study": [study]}),
+                 studies),
+        Scenario("view qc_search.lookup_data (all)",
+                 lambda _: post("/qc-reviews/submit-query", {
+                     "approved": "y", "blacklisted": "y", "flagged": "y",
+                     "include_new": "y", "include_phantoms": "y"}),
+                 [None]),
+        Scenario("view main.search_data (subject)",
+                 lambda name: get("/search_data/{}".format(name)),
+                 subjects),
+        Scenario("view main.search_data (prefix)",
+                 lambda study: get("/search_data/{}".format(study)),
+                 studies),
+        Scenario("get_studies",
+                 lambda _: queries.get_studies(),
+                 [None]),
+        Scenario("find_subjects",
+                 queries.find_subjects,
+                 subjects),
+        Scenario("get_timepoint",
+                 lambda item: queries.get_timepoint(item[1]),
+                 timepoints),
+        Scenario("get_timepoints",
+                 lambda _: queries.get_timepoints(
+                     [name for _, name in study_tps]),
+                 [None]),
+        Scenario("get_study_timepoints",
+                 queries.get_study_timepoints,
+                 studies),
+        Scenario("get_session",
+                 lambda key: queries.get_session(*key),
+                 sessions),
+        Scenario("get_sessions",
+                 lambda _: queries.get_sessions(session_keys),
+                 [None]),
+        Scenario("find_sessions",
+                 queries.find_sessions,
+                 subjects),
+        Scenario("get_scan",
+                 queries.get_scan,
+                 scans),
+        Scenario("get_scans",
+                 lambda _: queries.get_scans(scan_names),
+                 [None]),
+        Scenario("find_scans",
+                 queries.find_scans,
+                 scans),
+        Scenario("get_user",
+                 lambda _: queries.get_user("bench_admin"),
+                 [None]),
+        Scenario("get_scantypes",
+                 lambda _: queries.get_scantypes(),
+                 [None]),
+        Scenario("get_scan_qc",
+                 lambda study: queries.get_scan_qc(study=study,
+                                                   include_new=True),
+                 studies),
+        Scenario("get_scan_qc (user)",
+                 lambda _: queries.get_scan_qc(user_id=2, include_new=True,
+                                               sort=True),
+                 [None]),
+        Scenario("query_metric_values_byname",
+                 lambda study: queries.query_metric_values_byname(
+                     studies=[study]),
+                 studies),
+        Scenario("query_metric_values_byid",
+                 lambda study: queries.query_metric_values_byid(
+                     studies=[study]),
+                 studies),
+        Scenario("query_metric_types",
+                 lambda _: queries.query_metric_types(sites=sites),
+                 [None]),
+    ]
+
+
+def check(response, url):
+    if response.status_code >= 400:
+        raise RuntimeError("{} returned {}".format(url, response.status_code))
+
+
+def run(scenario, db, counter, repeat):
+    """Time a scenario.
+
+    Returns:
+        dict: The sorted 'timings', mean number of 'queries' per call and the
+            'peak' memory (in bytes) allocated during a single call.
+    """
+    timings = []
+    counter.count = 0
+    for _ in range(repeat):
+        for target in scenario.targets:
+            db.session.remove()
+            start = time.perf_counter()
+            scenario.func(target)
+            timings.append(time.perf_counter() - start)
+    queries = counter.count / len(timings)
+
+    peak = 0
+    for target in scenario.targets:
+        db.session.remove()
+        tracemalloc.start()
+        try:
+            scenario.func(target)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    return {"timings": sorted(timings), "queries": queries, "peak": peak}
+
+
+def percentile(timings, fraction):
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def report(name, result, baseline=None):
+    if "error" in result:
+        print("{:<34} ERROR {}".format(name, result["error"]))
+        return
+    timings = result["timings"]
+    line = ("{:<34} mean {:8.2f} ms   p50 {:8.2f} ms   p95 {:8.2f} ms   "
+            "p99 {:8.2f} ms   {:6.1f} queries   {:8.1f} KiB peak".format(
+                name,
+                statistics.mean(timings) * 1000,
+                percentile(timings, 0.5) * 1000,
+                percentile(timings, 0.95) * 1000,
+                percentile(timings, 0.99) * 1000,
+                result["queries"],
+                result["peak"] / 1024))
+    if baseline and baseline.get("p50"):
+        line += "   {:+6.1f}% p50".format(
+            (percentile(timings, 0.5) * 1000 / baseline["p50"] - 1) * 100)
+    print(line)
+
+
+def summarize(result):
+    if "error" in result:
+        return result
+    timings = result["timings"]
+    return {
+        "mean": statistics.mean(timings) * 1000,
+        "p50": percentile(timings, 0.5) * 1000,
+        "p95": percentile(timings, 0.95) * 1000,
+        "p99": percentile(timings, 0.99) * 1000,
+        "queries": result["queries"],
+        "peak": result["peak"]
+    }
+
+
+def login(client, db, user):
+    username = "bench_admin" if user == "admin" else "bench_user"
+    found = User.query.filter(User._username == username).first()
+    if not found:
+        raise RuntimeError("User {} not found. Run without --reuse to "
+                           "generate data.".format(username))
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(found.id)
+        sess["_fresh"] = True
+    db.session.remove()
+
+
+def main():
+    args = docopt(__doc__)
+    db = connect_test_db(reset=not args["--reuse"])
+    if not args["--reuse"]:
+        start = time.perf_counter()
+        counts = generate(
+            db,
+            seed=int(args["--seed"]),
+            studies=int(args["--studies"]),
+            sites=int(args["--sites"]),
+            timepoints=int(args["--timepoints"]),
+            sessions=int(args["--sessions"]),
+            scans=int(args["--scans"]),
+            reviewed=float(args["--reviewed"]),
+            metrics=int(args["--metrics"]),
+            phantoms=float(args["--phantoms"]))
+        print("Generated {} rows in {:.1f} s".format(
+            sum(counts.values()), time.perf_counter() - start))
+
+    app = current_app._get_current_object()
+    app.config["WTF_CSRF_ENABLED"] = False
+    client = app.test_client()
+    login(client, db, args["--user"])
+
+    counter = QueryCounter(db.engine)
+    baseline = {}
+    if args["--baseline"]:
+        with open(args["--baseline"]) as fh:
+            baseline = json.load(fh)
+
+    results = {}
+    scenarios = get_scenarios(db, client, int(args["--targets"]),
+                              int(args["--seed"]))
+    for scenario in scenarios:
+        if args["--only"] and args["--only"] not in scenario.name:
+            continue
+        try:
+            result = run(scenario, db, counter, int(args["--repeat"]))
+        except Exception as e:
+            db.session.rollback()
+            result = {"error": "{}: {}".format(type(e).__name__, e)}
+        report(scenario.name, result, baseline.get(scenario.name))
+        results[scenario.name] = summarize(result)
+
+    if args["--output"]:
+        with open(args["--output"], "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
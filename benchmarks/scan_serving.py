@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Micro-benchmark for serving scan files to the viewer.
+
+Times a full download of a nifti file, a repeat view that revalidates with
+If-None-Match (what a browser sends when reopening an unchanged scan), and a
+1MB range request. Requests go through a bare Flask app and its test client,
+so the numbers only cover the dashboard's own work, not the network.
+
+Usage:
+    scan_serving.py [options] <nifti>
+
+Arguments:
+    <nifti>         The full path to a nifti file to serve
+
+Options:
+    --repeat N      The number of times to make each request [default: 50]
+"""
+import os
+import time
+import statistics
+
+from docopt import docopt
+from flask import Flask
+
+from dashboard.blueprints.scans.utils import send_scan
+
+
+def make_app(path):
+    app = Flask(__name__)
+    path = os.path.abspath(path)
+    name = os.path.basename(path)
+
+    @app.route('/scan')
+    def scan():
+        return send_scan(path, name)
+
+    return app
+
+
+def run(client, repeat, headers=None):
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get('/scan', headers=headers)
+        size = len(response.get_data())
+        timings.append(time.perf_counter() - start)
+    return timings, response.status_code, size
+
+
+def report(name, timings, status, size):
+    timings = sorted(timings)
+    print("{:<12} mean {:8.3f} ms   p50 {:8.3f} ms   p95 {:8.3f} ms   "
+          "status {}   {} bytes".format(
+              name,
+              statistics.mean(timings) * 1000,
+              timings[len(timings) // 2] * 1000,
+              timings[int(len(timings) * 0.95)] * 1000,
+              status,
+              size))
+
+
+def main():
+    args = docopt(__doc__)
+    repeat = int(args['--repeat'])
+    client = make_app(args['<nifti>']).test_client()
+
+    etag = client.get('/scan').headers['ETag']
+
+    print("Serving {} x {}".format(args['<nifti>'], repeat))
+    report("full", *run(client, repeat))
+    report("repeat view", *run(client, repeat, {'If-None-Match': etag}))
+    report("range", *run(client, repeat, {'Range': 'bytes=0-1048575'}))
+
+
+if __name__ == "__main__":
+    main()
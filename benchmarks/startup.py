@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Compare the start up time of the ways scripts can connect to the database.
+
+Each method is run in a fresh python interpreter (so nothing is already
+imported) and timed from before 'import dashboard' until the app context is
+pushed. The number of modules each one leaves imported is also reported.
+
+Usage:
+    startup.py [options]
+
+Options:
+    --repeat N      The number of times to start each method [default: 10]
+"""
+import sys
+import json
+import statistics
+import subprocess
+
+from docopt import docopt
+
+METHODS = {
+    "connect_db": "dashboard.connect_db()",
+    "db_context": "dashboard.db_context()"
+}
+
+SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+import dashboard
+{}
+print(json.dumps([time.perf_counter() - start, len(sys.modules)]))
+"""
+
+
+def start(method):
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(METHODS[method])],
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True
+    ).stdout
+    # Only the last line, in case logging printed anything
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    args = docopt(__doc__)
+    repeat = int(args["--repeat"])
+
+    results = {}
+    for method in METHODS:
+        runs = [start(method) for _ in range(repeat)]
+        timings = sorted(run[0] for run in runs)
+        results[method] = statistics.median(timings)
+        print("{:<12} mean {:8.1f} ms   p50 {:8.1f} ms   min {:8.1f} ms   "
+              "{:5d} modules".format(
+                  method,
+                  statistics.mean(timings) * 1000,
+                  results[method] * 1000,
+                  timings[0] * 1000,
+                  runs[-1][1]))
+
+    saved = results["connect_db"] - results["db_context"]
+    print("db_context saves {:.1f} ms ({:.0f}%) per start".format(
+        saved * 1000, saved / results["connect_db"] * 100))
+
+
+if __name__ == "__main__":
+    main()
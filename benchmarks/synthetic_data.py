@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+"""Fill the test database with seeded synthetic data for benchmarking.
+
+Creates studies, sites, timepoints, sessions and scans (with JSON sidecar
+contents), QC checklist entries and metric values using bulk inserts. The
+same seed and counts always give the same records, so timings from
+different runs (and branches) can be compared. Two users are also added: a
+dashboard admin and a regular user with access to a single site of each
+study.
+
+Everything is written to SQLALCHEMY_TEST_DATABASE_URI, never the main
+database. Existing tables are dropped and recreated first.
+
+Usage:
+    synthetic_data.py [options]
+
+Options:
+    --seed N            The random seed to use [default: 0]
+    --studies N         The number of studies [default: 3]
+    --sites N           The number of sites per study [default: 3]
+    --timepoints N      The number of timepoints per study site [default: 100]
+    --sessions N        The number of sessions per timepoint [default: 1]
+    --scans N           The number of scans per session [default: 8]
+    --reviewed F        The fraction of scans with a QC checklist entry
+                        [default: 0.7]
+    --metrics N         The number of metric values per scan [default: 4]
+    --phantoms F        The fraction of timepoints that are phantoms
+                        [default: 0.05]
+"""
+import random
+import datetime
+
+from docopt import docopt
+from psycopg2.tz import FixedOffsetTimezone
+
+import dashboard
+from dashboard import models, TZ_OFFSET
+
+TAGS = ["T1", "T2", "FLAIR", "DTI60-1000", "RST", "FMAP-AP", "FMAP-PA",
+        "ASL", "SPRL", "MRS"]
+COMMENTS = ["Motion artifact", "Incomplete coverage", "Wrong orientation",
+            "Signal dropout", "Ghosting", "Scanner spike"]
+BATCH_SIZE = 5000
+
+# Tables that get explicit ids and need their sequences moved past them
+_SEQUENCES = ["users", "scans", "scan_checklist", "metrictypes",
+              "scan_metrics"]
+
+
+def generate(db, seed=0, studies=3, sites=3, timepoints=100, sessions=1,
+             scans=8, reviewed=0.7, metrics=4, phantoms=0.05):
+    """Add synthetic records to the database.
+
+    The tables must already exist and should be empty.
+
+    Args:
+        db (:obj:`flask_sqlalchemy.SQLAlchemy`): The database to fill.
+        seed (int, optional): The random seed to use.
+        studies (int, optional): The number of studies.
+        sites (int, optional): The number of sites per study.
+        timepoints (int, optional): The number of timepoints per study site.
+        sessions (int, optional): The number of sessions per timepoint.
+        scans (int, optional): The number of scans per session.
+        reviewed (float, optional): The fraction of scans with a QC checklist
+            entry.
+        metrics (int, optional): The number of metric values per scan.
+        phantoms (float, optional): The fraction of timepoints that are
+            phantoms.
+
+    Returns:
+        dict: The number of rows added to each table.
+    """
+    rng = random.Random(seed)
+    tz = FixedOffsetTimezone(offset=TZ_OFFSET)
+    start = datetime.datetime(2015, 1, 1, tzinfo=tz)
+    writer = _Writer(db)
+
+    admin_id, user_id = 1, 2
+    writer.add("users", [
+        {"id": admin_id, "first_name": "Bench", "last_name": "Admin",
+         "username": "bench_admin", "dashboard_admin": True,
+         "account_active": True},
+        {"id": user_id, "first_name": "Bench", "last_name": "User",
+         "username": "bench_user", "dashboard_admin": False,
+         "account_active": True}
+    ])
+
+    tags = TAGS[:max(scans, 1)]
+    writer.add("scantypes", [
+        {"tag": tag, "qc_type": "anat", "pha_type": "qa_dti"} for tag in tags
+    ])
+    metric_types = {}
+    mtype_rows = []
+    for tag in tags:
+        metric_types[tag] = []
+        for num in range(metrics):
+            mtype_rows.append({"id": len(mtype_rows) + 1,
+                               "name": "metric{}".format(num),
+                               "scantype": tag})
+            metric_types[tag].append(len(mtype_rows))
+    writer.add("metrictypes", mtype_rows)
+
+    site_names = ["S{:02d}".format(num) for num in range(sites)]
+    writer.add("sites", [{"name": site, "description": "Site " + site}
+                         for site in site_names])
+
+    study_ids = ["STU{:02d}".format(num) for num in range(studies)]
+    writer.add("studies", [
+        {"id": study, "name": "Study " + study, "description": "Synthetic",
+         "is_open": True}
+        for study in study_ids
+    ])
+    writer.add("study_sites", [
+        {"study": study, "site": site, "code": study}
+        for study in study_ids for site in site_names
+    ])
+    writer.add("expected_scans", [
+        {"study": study, "site": site, "scantype": tag, "num_expected": 1,
+         "pha_num_expected": 1}
+        for study in study_ids for site in site_names for tag in tags
+    ])
+    if site_names:
+        writer.add("study_users", [
+            {"study": study, "user_id": user_id, "site": site_names[0],
+             "does_qc": True}
+            for study in study_ids
+        ])
+
+    scan_id = checklist_id = metric_id = 0
+    for study in study_ids:
+        for site in site_names:
+            for num in range(timepoints):
+                if rng.random() < phantoms:
+                    name = "{}_{}_PHA_FBN{:04d}".format(study, site, num)
+                    is_phantom = True
+                else:
+                    name = "{}_{}_{:04d}_01".format(study, site, num)
+                    is_phantom = False
+                writer.add("timepoints", [{
+                    "name": name,
+                    "bids_name": "sub-{}{}{:04d}".format(study, site, num),
+                    "bids_sess": "01",
+                    "site": site,
+                    "is_phantom": is_phantom
+                }])
+                writer.add("study_timepoints",
+                           [{"study": study, "timepoint": name}])
+
+                for sess in range(1, sessions + 1):
+                    date = start + datetime.timedelta(
+                        days=rng.randrange(3000))
+                    writer.add("sessions", [{
+                        "name": name,
+                        "num": sess,
+                        "date": date.replace(tzinfo=None),
+                        "signed_off": rng.random() < reviewed,
+                        "reviewer": admin_id
+                    }])
+
+                    for series in range(1, scans + 1):
+                        tag = tags[(series - 1) % len(tags)]
+                        scan_id += 1
+                        scan_name = "{}_{:02d}_{}_{:02d}".format(
+                            name, sess, tag, series)
+                        writer.add("scans", [{
+                            "id": scan_id,
+                            "name": scan_name,
+                            "bids_name": "ses-{:02d}_run-{:02d}_{}".format(
+                                sess, series, tag),
+                            "timepoint": name,
+                            "session": sess,
+                            "series": series,
+                            "tag": tag,
+                            "description": tag + " series",
+                            "length": str(rng.randint(100, 400)),
+                            "json_path": "/data/{}/{}.json".format(
+                                study, scan_name),
+                            "json_contents": make_sidecar(rng, tag),
+                            "json_created": date
+                        }])
+
+                        if rng.random() < reviewed:
+                            checklist_id += 1
+                            writer.add("scan_checklist", [
+                                make_review(rng, checklist_id, scan_id,
+                                            admin_id, date)
+                            ])
+
+                        for mtype in metric_types[tag]:
+                            metric_id += 1
+                            writer.add("scan_metrics", [{
+                                "id": metric_id,
+                                "scan_id": scan_id,
+                                "metric_type": mtype,
+                                "value": "{:.4f}".format(rng.gauss(100, 15))
+                            }])
+
+    counts = writer.flush()
+    for table in _SEQUENCES:
+        db.session.execute(
+            "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+            "coalesce(max(id), 0) + 1, false) FROM {0}".format(table))
+    db.session.commit()
+
+    return counts
+
+
+def make_sidecar(rng, tag):
+    """Make the contents of a plausible BIDS JSON sidecar for a scan.
+    """
+    return {
+        "Modality": "MR",
+        "MagneticFieldStrength": 3,
+        "Manufacturer": rng.choice(["GE", "SIEMENS", "Philips"]),
+        "ManufacturersModelName": rng.choice(["Prisma", "Discovery MR750"]),
+        "SeriesDescription": tag,
+        "ProtocolName": tag,
+        "ScanningSequence": rng.choice(["GR", "SE", "EP"]),
+        "SequenceName": "*tfl3d1_16ns",
+        "ImageType": ["ORIGINAL", "PRIMARY", "M", "ND"],
+        "SliceThickness": rng.choice([1, 2, 2.5, 3]),
+        "SpacingBetweenSlices": rng.choice([1, 2, 2.5, 3]),
+        "EchoTime": round(rng.uniform(0.002, 0.1), 5),
+        "RepetitionTime": round(rng.uniform(0.5, 3), 4),
+        "InversionTime": round(rng.uniform(0.5, 1.2), 3),
+        "FlipAngle": rng.choice([8, 9, 52, 90]),
+        "PhaseEncodingDirection": rng.choice(["j-", "j", "i"]),
+        "EffectiveEchoSpacing": round(rng.uniform(0.0003, 0.0008), 7),
+        "TotalReadoutTime": round(rng.uniform(0.03, 0.06), 6),
+        "SliceTiming": [round(rng.uniform(0, 2), 4) for _ in range(48)],
+        "SoftwareVersions": "syngo MR E11",
+        "ConversionSoftware": "dcm2niix",
+        "ConversionSoftwareVersion": "v1.0.20211006"
+    }
+
+
+def make_review(rng, checklist_id, scan_id, user_id, date):
+    """Make a QC checklist entry that's approved, flagged or blacklisted.
+    """
+    outcome = rng.random()
+    if outcome < 0.8:
+        approved, comment = True, None
+    elif outcome < 0.9:
+        approved, comment = True, rng.choice(COMMENTS)
+    else:
+        approved, comment = False, rng.choice(COMMENTS)
+    return {
+        "id": checklist_id,
+        "scan_id": scan_id,
+        "user_id": user_id,
+        "review_timestamp": date + datetime.timedelta(days=1),
+        "comment": comment,
+        "signed_off": approved
+    }
+
+
+class _Writer:
+    """Buffers rows and inserts them in batches, in foreign key order.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.tables = db.metadata.tables
+        self.rows = {}
+        self.counts = {}
+
+    def add(self, table, rows):
+        self.rows.setdefault(table, []).extend(rows)
+        self.counts[table] = self.counts.get(table, 0) + len(rows)
+        if sum(len(item) for item in self.rows.values()) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        # Parents have to be written before children, so insert in the order
+        # tables were first seen.
+        for table, rows in self.rows.items():
+            if rows:
+                self.db.session.execute(self.tables[table].insert(), rows)
+                del rows[:]
+        return dict(self.counts)
+
+
+def connect_test_db(reset=True):
+    """Push an app context for the test database, creating it if needed.
+
+    Args:
+        reset (bool, optional): Whether to drop and recreate all tables.
+
+    Returns:
+        :obj:`flask_sqlalchemy.SQLAlchemy`: The test database.
+    """
+    from sqlalchemy_utils import database_exists, create_database
+
+    app = dashboard.create_app()
+    uri = app.config["SQLALCHEMY_TEST_DATABASE_URI"]
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    app.config["SQLALCHEMY_BINDS"] = {}
+    if not database_exists(uri):
+        create_database(uri)
+    app.app_context().push()
+    if reset:
+        models.db.drop_all()
+        models.db.create_all()
+    return models.db
+
+
+def main():
+    args = docopt(__doc__)
+    db = connect_test_db()
+    counts = generate(
+        db,
+        seed=int(args["--seed"]),
+        studies=int(args["--studies"]),
+        sites=int(args["--sites"]),
+        timepoints=int(args["--timepoints"]),
+        sessions=int(args["--sessions"]),
+        scans=int(args["--scans"]),
+        reviewed=float(args["--reviewed"]),
+        metrics=int(args["--metrics"]),
+        phantoms=float(args["--phantoms"]))
+    for table in sorted(counts):
+        print("{:<20} {:>10}".format(table, counts[table]))
+
+
+if __name__ == "__main__":
+    main()
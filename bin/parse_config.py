@@ -48,7 +48,7 @@ import datman.config
 from datman.xnat import get_server
 from datman.exceptions import UndefinedSetting
 
-dashboard.connect_db()
+dashboard.db_context()
 
 logging.basicConfig(level=logging.WARN,
                     format="[%(name)s] %(levelname)s: %(message)s")
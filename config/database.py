@@ -1,6 +1,9 @@
 """Configuration for the database and connections to it
 """
 import os
+from urllib.parse import urlencode, quote
+
+from .utils import read_boolean
 
 # User to connect to database with. Can be None to connect as current user
 user = os.environ.get('POSTGRES_USER')
@@ -19,14 +22,33 @@ db_name = os.environ.get('POSTGRES_DATABASE') or 'dashboard'
 port = (':' + os.environ.get('POSTGRES_PORT')
         if os.environ.get('POSTGRES_PORT') else '')
 
+# Name reported for the dashboard's connections (e.g. in pg_stat_activity)
+app_name = os.environ.get('POSTGRES_APP_NAME') or 'dashboard'
+
+# Maximum time (in milliseconds) a statement may run on the primary server
+# before it's cancelled. 0 disables the limit.
+timeout = int(os.environ.get('POSTGRES_STATEMENT_TIMEOUT') or 0)
+
+
+def get_query_string(statement_timeout):
+    """Get the connection parameters to add to a database URI.
+    """
+    params = {'application_name': app_name}
+    if statement_timeout:
+        params['options'] = f'-c statement_timeout={statement_timeout}'
+    return urlencode(params, quote_via=quote)
+
+
 DATABASE_ROOT_URI = f'postgresql://{user}:{password}@{server}{port}'
 
-SQLALCHEMY_DATABASE_URI = f'{DATABASE_ROOT_URI}/{db_name}'
+SQLALCHEMY_DATABASE_URI = (f'{DATABASE_ROOT_URI}/{db_name}'
+                           f'?{get_query_string(timeout)}')
 
 # Configure the test database to use for unit tests
 test_db_name = os.environ.get('POSTGRES_TEST_DATABASE') or 'test_dashboard'
 
-SQLALCHEMY_TEST_DATABASE_URI = f'{DATABASE_ROOT_URI}/{test_db_name}'
+SQLALCHEMY_TEST_DATABASE_URI = (f'{DATABASE_ROOT_URI}/{test_db_name}'
+                                f'?{get_query_string(timeout)}')
 
 # Timezone offset used for timezone aware timestamps. Default is Eastern time
 # Used by psycopg2.tz.FixedOffsetTimezone in the models
@@ -35,4 +57,43 @@ TZ_OFFSET = os.environ.get('TIMEZONE') or -240
 # Not needed and uses more memory. Just disable it.
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool settings, used for the primary server and the replica
+SQLALCHEMY_ENGINE_OPTIONS = {
+    # Connections kept open by each process
+    'pool_size': int(os.environ.get('POSTGRES_POOL_SIZE') or 5),
+    # Extra connections that may be opened when the pool is in use
+    'max_overflow': int(os.environ.get('POSTGRES_MAX_OVERFLOW') or 10),
+    # Check connections still work before use, so a restarted server
+    # doesn't cause errors
+    'pool_pre_ping': read_boolean('POSTGRES_POOL_PRE_PING', default=True)
+}
+
+# A read-only replica of the database. If set, views that only read (e.g.
+# searches and study pages) query it instead of the primary server.
+# Optional.
+replica_server = os.environ.get('POSTGRES_REPLICA_SRVR')
+
+replica_port = (':' + os.environ.get('POSTGRES_REPLICA_PORT')
+                if os.environ.get('POSTGRES_REPLICA_PORT') else port)
+
+# Maximum time (in milliseconds) a statement may run on the replica. 0
+# disables the limit.
+replica_timeout = int(os.environ.get('POSTGRES_REPLICA_STATEMENT_TIMEOUT')
+                      or 0)
+
+# Seconds to send all queries to the primary server after the replica can't
+# be reached
+REPLICA_RETRY = int(os.environ.get('POSTGRES_REPLICA_RETRY') or 60)
+
+# The longest (in seconds) a cached page fragment built from the replica is
+# kept, since the replica may be behind the primary server. 0 stops them
+# being cached.
+REPLICA_CACHE_TTL = int(os.environ.get('POSTGRES_REPLICA_CACHE_TTL') or 10)
+
 SQLALCHEMY_BINDS = {}
+
+if replica_server:
+    SQLALCHEMY_BINDS['replica'] = (
+        f'postgresql://{user}:{password}@{replica_server}{replica_port}/'
+        f'{db_name}?{get_query_string(replica_timeout)}'
+    )
@@ -5,7 +5,7 @@ import logging
 from logging.handlers import DEFAULT_TCP_LOGGING_PORT
 from pathlib import Path
 
-from .utils import BASE_DIR, ENV, DEBUG
+from .utils import BASE_DIR, ENV, DEBUG, read_boolean
 from .email import (LOG_MAIL_SERVER, LOG_MAIL_PORT, LOG_MAIL_USER,
                     LOG_MAIL_PASS, ADMINS, SENDER)
 from .scheduler import SCHEDULER_ENABLED
@@ -14,6 +14,45 @@ from .scheduler import SCHEDULER_ENABLED
 # Default log level to use for all dashboard logging
 LOG_LEVEL = os.environ.get('DASH_LOG_LEVEL') or 'DEBUG'
 
+# Whether to count and time the SQL queries made by each request
+SQL_STATS_ENABLED = read_boolean('DASH_SQL_STATS', default=True)
+
+# Requests that take longer than this many milliseconds are logged
+SQL_SLOW_REQUEST = int(os.environ.get('DASH_SQL_SLOW_REQUEST') or 2000)
+
+# Requests that make more than this many queries are logged
+SQL_MAX_QUERIES = int(os.environ.get('DASH_SQL_MAX_QUERIES') or 100)
+
+# The number of times a statement must repeat within a request to be reported
+# as a possible N+1 query
+SQL_REPEAT_THRESHOLD = int(os.environ.get('DASH_SQL_REPEAT_THRESHOLD') or 10)
+
+# The fraction (0-1) of requests to write to the 'dashboard.sql_stats' logger
+# as JSON
+SQL_STATS_SAMPLE = float(os.environ.get('DASH_SQL_STATS_SAMPLE') or 0)
+
+# Whether to report query counts and times in a Server-Timing header
+SERVER_TIMING = read_boolean('DASH_SERVER_TIMING', default=True)
+
+# The fraction (0-1) of requests to profile with cProfile
+PROFILE_SAMPLE = float(os.environ.get('DASH_PROFILE_SAMPLE') or 0)
+
+# Requests that take longer than this many milliseconds have their sampled
+# stacks saved. 0 disables stack sampling.
+PROFILE_SLOW_REQUEST = int(os.environ.get('DASH_PROFILE_SLOW_REQUEST') or 0)
+
+# The number of milliseconds between stack samples
+PROFILE_INTERVAL = float(os.environ.get('DASH_PROFILE_INTERVAL') or 10)
+
+# The directory to save profiles to
+PROFILE_DIR = os.environ.get('DASH_PROFILE_DIR') or str(BASE_DIR / 'profiles')
+
+# The number of profiles to keep
+PROFILE_KEEP = int(os.environ.get('DASH_PROFILE_KEEP') or 100)
+
+# The number of functions to list in each profile's summary
+PROFILE_TOP = 20
+
 LOGGING_CONFIG = {
     'version': 1,
     'formatters': {
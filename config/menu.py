@@ -3,20 +3,27 @@
 import logging
 import os
 
-from pydantic import BaseModel, ValidationError
-import yaml
-
 logger = logging.getLogger(__name__)
 
 
-class MenuItem(BaseModel):
-    """Create a MenuItem object for each button to add to dashboard menus.
+def get_menu_item_model():
+    """Create the model used to validate each button to add to dashboard menus.
+
+    pydantic is only imported (by calling this) when a menu config file is
+    given, since it's slow to load.
     """
-    menu: str
-    btn_text: str
-    url: str
-    hover_text: str = None
-    name: str = None
+    from pydantic import BaseModel
+
+    class MenuItem(BaseModel):
+        """Create a MenuItem object for each button to add to dashboard menus.
+        """
+        menu: str
+        btn_text: str
+        url: str
+        hover_text: str = None
+        name: str = None
+
+    return MenuItem
 
 
 def get_menu_config():
@@ -27,6 +34,10 @@ def get_menu_config():
     if not menu_file:
         return {}
 
+    import yaml
+    from pydantic import ValidationError
+    MenuItem = get_menu_item_model()
+
     try:
         with open(menu_file) as fh:
             contents = yaml.load(fh, Loader=yaml.SafeLoader)
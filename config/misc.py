@@ -2,7 +2,7 @@
 """
 import os
 
-from .utils import read_boolean
+from .utils import read_boolean, BASE_DIR
 
 # This should never be False
 WTF_CSRF_ENABLED = True
@@ -15,6 +15,69 @@ if not SECRET_KEY:
         "used to encrypt session information and cookies and should be a "
         "random / hard to guess string.")
 
+# Maximum number of seconds to cache the study code index used to match
+# subject IDs to studies. Changes made by this process are picked up
+# immediately, this only limits how long changes made elsewhere can go unseen.
+ID_RESOLVER_TTL = int(os.environ.get('DASH_ID_RESOLVER_TTL') or 300)
+
+# Whether to keep rendered page fragments and query results between requests
+CACHE_ENABLED = read_boolean('DASH_CACHE', default=True)
+
+# Maximum number of page fragments and query results each process keeps in
+# memory
+CACHE_SIZE = int(os.environ.get('DASH_CACHE_SIZE') or 1000)
+
+# Maximum number of seconds to keep a cached page fragment or query result.
+# Changes made through the dashboard are picked up immediately, this only
+# limits how long changes made by other processes can go unseen.
+CACHE_TTL = int(os.environ.get('DASH_CACHE_TTL') or 300)
+
+# A redis server to share cached page fragments and query results (and their
+# invalidation) between processes. Optional.
+CACHE_REDIS_URL = os.environ.get('DASH_CACHE_REDIS_URL')
+
+# Maximum number of seconds to reuse a logged in user's record and study
+# permissions between requests. Kept short because changes made by processes
+# that don't share CACHE_REDIS_URL (e.g. a user disabled elsewhere) are only
+# seen once it runs out.
+USER_CACHE_TTL = int(os.environ.get('DASH_USER_CACHE_TTL') or 60)
+
+# How often (in minutes) the scheduler server re-indexes each study's nii, qc
+# and resources folders
+FILE_INDEX_INTERVAL = int(os.environ.get('DASH_FILE_INDEX_INTERVAL') or 15)
+
+# Hand nifti downloads off to the web server with an X-Sendfile header
+USE_X_SENDFILE = read_boolean('DASH_USE_X_SENDFILE', default=False)
+
+# Hand nifti downloads off to nginx with an X-Accel-Redirect header. The
+# prefix is the internal nginx location that serves SCAN_ACCEL_ROOT (the
+# folder that holds all study data).
+SCAN_ACCEL_PREFIX = os.environ.get('DASH_X_ACCEL_PREFIX')
+SCAN_ACCEL_ROOT = os.environ.get('DASH_X_ACCEL_ROOT')
+
+# Folder to cache generated scan previews in
+SCAN_CACHE_DIR = os.environ.get('DASH_SCAN_CACHE') or str(BASE_DIR / 'cache')
+
+# Maximum in-plane size (in voxels) of the scan previews shown in the viewer
+SCAN_PREVIEW_SIZE = int(os.environ.get('DASH_PREVIEW_SIZE') or 128)
+
+# Number of processes to generate scan previews with
+SCAN_PREVIEW_WORKERS = int(os.environ.get('DASH_PREVIEW_WORKERS') or 2)
+
+# Whether to share parsed QC manifests between processes through
+# SCAN_CACHE_DIR
+MANIFEST_DISK_CACHE = read_boolean('DASH_MANIFEST_DISK_CACHE', default=False)
+
+# Maximum width or height (in pixels) of scan thumbnails
+SCAN_THUMBNAIL_SIZE = int(os.environ.get('DASH_THUMBNAIL_SIZE') or 128)
+
+# How often (in minutes) the scheduler server makes thumbnails for new scans
+THUMBNAIL_INTERVAL = int(os.environ.get('DASH_THUMBNAIL_INTERVAL') or 30)
+
+# How many days back (by scan date) the scheduler server looks for scans to
+# make thumbnails for
+THUMBNAIL_DAYS = int(os.environ.get('DASH_THUMBNAIL_DAYS') or 14)
+
 # Name of the repository on github that hosts the issues
 GITHUB_REPO = os.environ.get('GITHUB_ISSUES_REPO')
 
@@ -27,6 +90,19 @@ GITHUB_PUBLIC = read_boolean('GITHUB_ISSUES_PUBLIC', default=True)
 # The REDCap token to use when retrieving records after a data entry trigger
 REDCAP_TOKEN = os.environ.get('REDCAP_TOKEN')
 
+# Number of seconds a REDCap record must go without new data entry triggers
+# before it's retrieved. Repeat triggers within this window are only
+# processed once.
+REDCAP_DET_WINDOW = int(os.environ.get('REDCAP_DET_WINDOW') or 60)
+
+# Number of seconds to reuse a REDCap API client (and the project metadata
+# it has retrieved) before creating a new one.
+REDCAP_METADATA_TTL = int(os.environ.get('REDCAP_METADATA_TTL') or 3600)
+
+# The hour of the day (0-23) to check each REDCap project for completed
+# records that were missed (e.g. because a trigger was never received)
+REDCAP_RECONCILE_HOUR = int(os.environ.get('REDCAP_RECONCILE_HOUR') or 2)
+
 # The directory to read nightly run logs from, if any
 RUN_LOG_DIR = os.environ.get('DATMAN_RUN_LOGS', '')
 
@@ -36,6 +112,14 @@ RUN_COMPLETE_REGEX = os.environ.get('DATMAN_RUN_LOGS_DONE', ': Done.')
 # The regex to use when parsing the run log to detect errors
 RUN_ERROR_REGEX = os.environ.get('DATMAN_RUN_LOGS_ERROR', '- ERROR -')
 
+# The number of lines at the end of the run log to display. If 0, the whole
+# log is shown
+RUN_LOG_TAIL_LINES = int(os.environ.get('DATMAN_RUN_LOGS_TAIL') or 0)
+
+# How often (in seconds) an open study page should check an unfinished run
+# log for new lines. If 0, the log is only updated when the page is reloaded
+RUN_LOG_POLL_INTERVAL = int(os.environ.get('DATMAN_RUN_LOGS_POLL') or 30)
+
 # Metrics to display.
 # NOTE: The code that uses this is currently broken and might be scrapped
 # entirely
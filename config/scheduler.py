@@ -2,35 +2,40 @@
 """
 import os
 
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
-from flask_apscheduler.auth import HTTPBasicAuth
-
-from dashboard.task_scheduler import ContextThreadExecutor
 from .utils import read_boolean
 from .database import SQLALCHEMY_DATABASE_URI
-
-SCHEDULER_JOBSTORES = {
-    'default': SQLAlchemyJobStore(url=SQLALCHEMY_DATABASE_URI)
-}
+from .misc import (REDCAP_DET_WINDOW, REDCAP_RECONCILE_HOUR,
+                   THUMBNAIL_INTERVAL, FILE_INDEX_INTERVAL)
 
 SCHEDULER_JOB_DEFAULTS = {
     'coalesce': True,
     'misfire_grace_time': 3600
 }
 
-SCHEDULER_EXECUTORS = {
-    'default': ContextThreadExecutor(2)
-}
-
 # Indicates whether to start the scheduler server. Should only be set if
 # the dashboard is being run through a webserver (i.e. not just imported)
 SCHEDULER_ENABLED = read_boolean("DASHBOARD_SCHEDULER")
 
 if SCHEDULER_ENABLED:
+    # The job store and executor are only used by the scheduler server, so
+    # clients never need to import APScheduler.
+    from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+    from dashboard.task_executor import ContextThreadExecutor
+
+    SCHEDULER_JOBSTORES = {
+        'default': SQLAlchemyJobStore(url=SQLALCHEMY_DATABASE_URI)
+    }
+
+    SCHEDULER_EXECUTORS = {
+        'default': ContextThreadExecutor(2)
+    }
+
     # Controls whether to allow remote job submission (over HTTP)
     SCHEDULER_API_ENABLED = read_boolean("DASHBOARD_SCHEDULER_API")
 
     if SCHEDULER_API_ENABLED:
+        from flask_apscheduler.auth import HTTPBasicAuth
+
         # Password protect the API. This should never be used over the open
         # internet unless HTTPS is being used
         SCHEDULER_AUTH = HTTPBasicAuth()
@@ -48,3 +53,46 @@ SCHEDULER_PASS = os.environ.get('DASHBOARD_SCHEDULER_PASS')
 
 # The server URL to send scheduled jobs to. (Client/imported instances only)
 SCHEDULER_SERVER_URL = os.environ.get("DASHBOARD_URL")
+
+# The hour of the day (0-23) when queued notifications (new sessions to QC,
+# missing REDCap surveys, etc.) are emailed out as one digest per recipient.
+DIGEST_HOUR = int(os.environ.get("DASHBOARD_DIGEST_HOUR") or 8)
+
+# Recurring jobs. These are only loaded by the scheduler server.
+SCHEDULER_JOBS = [
+    {
+        'id': 'notification_digest',
+        'func': 'dashboard.monitors:send_digests',
+        'trigger': 'cron',
+        'hour': DIGEST_HOUR,
+        'replace_existing': True
+    },
+    {
+        'id': 'redcap_dets',
+        'func': 'dashboard.blueprints.redcap.monitors:process_dets',
+        'trigger': 'interval',
+        'seconds': REDCAP_DET_WINDOW,
+        'replace_existing': True
+    },
+    {
+        'id': 'redcap_reconcile',
+        'func': 'dashboard.blueprints.redcap.monitors:reconcile_redcap',
+        'trigger': 'cron',
+        'hour': REDCAP_RECONCILE_HOUR,
+        'replace_existing': True
+    },
+    {
+        'id': 'scan_thumbnails',
+        'func': 'dashboard.blueprints.scans.monitors:make_new_thumbnails',
+        'trigger': 'interval',
+        'minutes': THUMBNAIL_INTERVAL,
+        'replace_existing': True
+    },
+    {
+        'id': 'file_index',
+        'func': 'dashboard.file_index:crawl',
+        'trigger': 'interval',
+        'minutes': FILE_INDEX_INTERVAL,
+        'replace_existing': True
+    }
+]
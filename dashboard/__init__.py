@@ -5,7 +5,6 @@ import logging.config
 
 from flask import Flask
 from flask_mail import Mail
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_migrate import Migrate
 from flask_wtf import CSRFProtect
@@ -15,6 +14,7 @@ from config import (SCHEDULER_ENABLED, SCHEDULER_API_ENABLED, SCHEDULER_USER,
                     SCHEDULER_PASS, TZ_OFFSET, LOGGING_CONFIG)
 
 from .task_scheduler import disable_scheduler_csrf
+from .replica import RoutingSQLAlchemy
 if SCHEDULER_ENABLED:
     from flask_apscheduler import APScheduler as Scheduler
 else:
@@ -23,7 +23,7 @@ else:
 logging.config.dictConfig(LOGGING_CONFIG)
 logger = logging.getLogger(__name__)
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 lm = LoginManager()
 lm.login_view = 'users.login'
@@ -94,6 +94,41 @@ def connect_db():
     return db
 
 
+def db_context(config=None):
+    """Push an application context that only provides the database models.
+
+    This is a faster alternative to :py:func:`connect_db` for scripts (e.g.
+    bin/parse_config.py and datman) that only need the models. No blueprints
+    are imported and login, mail, CSRF protection and migrations aren't set
+    up. The scheduler is never started, but a client scheduler is still
+    configured so jobs can be submitted to the scheduler server.
+
+    Args:
+        config (:obj:`dict`, optional): App settings to use instead of the
+            ones in the config module.
+
+    Returns:
+        :obj:`flask_sqlalchemy.SQLAlchemy`: The database.
+    """
+    app = Flask(__name__)
+    if config is None:
+        app.config.from_object('config')
+    else:
+        app.config.from_mapping(config)
+
+    db.init_app(app)
+    if not SCHEDULER_ENABLED:
+        scheduler.init_app(app)
+
+    from . import models  # noqa: F401
+    from . import cache
+    cache.init_app(app)
+
+    context = app.app_context()
+    context.push()
+    return db
+
+
 def setup_devel_ext(app):
     """Set up extensions only used within development environments.
     """
@@ -173,6 +208,18 @@ def create_app(config=None):
 
     load_blueprints(app)
 
+    from .datman_utils import log_config_cache
+    app.after_request(log_config_cache)
+
+    from . import instrumentation
+    instrumentation.init_app(app)
+
+    from . import profiling
+    profiling.init_app(app)
+
+    from . import cache
+    cache.init_app(app)
+
     if app.debug and app.env == 'development':
         # Never run this on a production server!
         setup_devel_ext(app)
@@ -2,20 +2,291 @@ import os
 import html
 import logging
 import re
+import threading
+import datetime
+from collections import deque
 
 logger = logging.getLogger(__name__)
 
+_run_logs = {}
+_lock = threading.Lock()
 
-def get_run_log(log_dir, study, done_regex, error_regex):
+
+def get_run_log(log_dir, study, done_regex, error_regex, tail=None):
     if not log_dir:
         return {"contents": "", "header": ""}
 
+    run_log = get_run_log_reader(
+        log_dir, study, done_regex, error_regex, tail)
+    try:
+        run_log.update()
+    except OSError as e:
+        logger.error(f"Failed to read run log file {run_log.log_file}. {e}")
+        return {"contents": "", "header": ""}
+
+    return run_log.summary()
+
+
+def get_run_overview(log_dir, studies, done_regex, error_regex, tail=None):
+    """Summarize the latest nightly run for many studies at once.
+
+    The log directory is listed only once, and each log is read with its
+    cached :py:class:`RunLog` so only newly appended lines are parsed.
+
+    Args:
+        log_dir (:obj:`str`): The directory holding nightly run logs.
+        studies (:obj:`list` of :obj:`str`): The IDs of the studies to report
+            on. Studies without a log are left out.
+        done_regex (:obj:`str`): The pattern marking a finished run.
+        error_regex (:obj:`str`): The pattern marking an error line.
+        tail (int, optional): The number of lines to keep for display. Should
+            match the setting used for study pages so readers are shared.
+
+    Returns:
+        dict: The 'studies' key holds a list with the status ('done',
+            'running' or 'unreadable'), error count and last modification
+            time of each study's log, sorted by study. The 'totals' key
+            holds the number of logs with each status and the total number
+            of errors.
+    """
+    totals = {"done": 0, "running": 0, "unreadable": 0, "errors": 0}
+    overview = {"studies": [], "totals": totals}
+    if not log_dir:
+        return overview
+
+    suffix = "_latest.log"
+    try:
+        logs = {entry.name[:-len(suffix)]: entry
+                for entry in os.scandir(log_dir)
+                if entry.name.endswith(suffix)}
+    except OSError as e:
+        logger.error(f"Failed to read run log directory {log_dir}. {e}")
+        return overview
+
+    for study in sorted(set(studies) & set(logs)):
+        run_log = get_run_log_reader(
+            log_dir, study, done_regex, error_regex, tail)
+        try:
+            run_log.update(logs[study].stat())
+        except OSError as e:
+            logger.error(f"Failed to read run log file {run_log.log_file}. "
+                         f"{e}")
+            status = {"study": study, "status": "unreadable", "errors": 0,
+                      "modified": None}
+        else:
+            status = run_log.status()
+            status["study"] = study
+        totals[status["status"]] += 1
+        totals["errors"] += status["errors"]
+        overview["studies"].append(status)
+    return overview
+
+
+def get_run_log_reader(log_dir, study, done_regex, error_regex, tail=None):
+    """Get the (cached) incremental reader for a study's latest run log.
+
+    Readers are kept between requests so only the bytes appended to a log
+    since it was last viewed need to be read and parsed.
+
+    Args:
+        log_dir (:obj:`str`): The directory holding nightly run logs.
+        study (:obj:`str`): The study ID.
+        done_regex (:obj:`str`): The pattern marking a finished run.
+        error_regex (:obj:`str`): The pattern marking an error line.
+        tail (int, optional): The number of lines to keep for display. All
+            lines are kept if this isn't set.
+
+    Returns:
+        :obj:`RunLog`: The reader for the study's log.
+    """
     log_file = os.path.join(log_dir, f"{study}_latest.log")
-    output = {}
-    output["contents"] = read_log(log_file)
-    output["header"] = make_header_msg(
-        output["contents"], done_regex, error_regex)
-    return output
+    settings = (done_regex, error_regex, tail or None)
+    with _lock:
+        run_log = _run_logs.get(log_file)
+        if run_log is None or run_log.settings != settings:
+            run_log = RunLog(log_file, done_regex, error_regex, tail)
+            _run_logs[log_file] = run_log
+    return run_log
+
+
+class RunLog:
+    """Incrementally read a nightly run log.
+
+    The byte offset, inode and modification time of the file are remembered
+    after each read, so later reads only parse the bytes appended since then.
+    Error and completion status are tracked as lines arrive. If the file is
+    replaced (e.g. the 'latest' symlink is moved to a new log) or truncated
+    it's read again from the start.
+    """
+
+    def __init__(self, log_file, done_regex, error_regex, tail=None):
+        self.log_file = log_file
+        self.settings = (done_regex, error_regex, tail or None)
+        self._done_regex = re.compile(done_regex)
+        self._error_regex = re.compile(error_regex)
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything read so far.
+        """
+        self.inode = None
+        self.mtime = None
+        self.offset = 0
+        self.errors = 0
+        self.done = False
+        self.skipped = 0
+        self.first_offset = 0
+        # Each entry holds the offset just past the end of a line and the
+        # line's html-escaped text.
+        self.lines = deque(maxlen=self.settings[2])
+        self._partial = b""
+
+    def update(self, stat=None):
+        """Read any new lines from the log file.
+
+        Args:
+            stat (:obj:`os.stat_result`, optional): The result of os.stat for
+                the log file, if it's already been read.
+
+        Raises:
+            OSError: If the log file can't be read.
+
+        Returns:
+            bool: True if the log has changed since the last update.
+        """
+        with self._lock:
+            if stat is None:
+                stat = os.stat(self.log_file)
+            end = self.offset + len(self._partial)
+            if stat.st_ino != self.inode or stat.st_size < end or (
+                    stat.st_size == end and stat.st_mtime != self.mtime):
+                self.reset()
+                self.inode = stat.st_ino
+                end = 0
+            elif stat.st_size == end:
+                return False
+
+            with open(self.log_file, "rb") as fh:
+                fh.seek(end)
+                new_bytes = fh.read(stat.st_size - end)
+            self.mtime = stat.st_mtime
+            self._add_lines(new_bytes)
+            return True
+
+    def _add_lines(self, new_bytes):
+        data = self._partial + new_bytes
+        lines = data.split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self.offset += len(line) + 1
+            text = line.decode("utf-8", errors="replace")
+            self.errors += len(self._error_regex.findall(text))
+            if not self.done and self._done_regex.search(text):
+                self.done = True
+            if len(self.lines) == self.lines.maxlen:
+                self.first_offset = self.lines[0][0]
+                self.skipped += 1
+            self.lines.append(
+                (self.offset, html.escape(text + "\n").replace("\n", "<br>")))
+
+    @property
+    def partial(self):
+        """str: The unterminated last line of the log, if any.
+        """
+        return self._partial.decode("utf-8", errors="replace")
+
+    def is_done(self):
+        return self.done or bool(self._done_regex.search(self.partial))
+
+    def error_count(self):
+        return self.errors + len(self._error_regex.findall(self.partial))
+
+    def header(self):
+        if not self.is_done():
+            return "Running..."
+        error_count = self.error_count()
+        if error_count == 1:
+            return "1 error reported"
+        return f"{error_count} errors reported"
+
+    def contents(self):
+        """Get the lines kept for display, formatted like :py:func:`read_log`.
+
+        An unterminated last line is wrapped in a 'run-log-partial' span, so
+        it can be replaced when the rest of the line is polled for.
+        """
+        contents = "<br>".join(text for _, text in self.lines)
+        if self._partial:
+            contents += '<span class="run-log-partial">{}{}</span>'.format(
+                "<br>" if contents else "", html.escape(self.partial))
+        return contents
+
+    def status(self):
+        """Get the state of the run without any of the log's contents.
+
+        Returns:
+            dict: The 'status' ('done' or 'running') of the run, the number
+                of 'errors' reported and when the log was last 'modified'.
+        """
+        with self._lock:
+            return {
+                "status": "done" if self.is_done() else "running",
+                "errors": self.error_count(),
+                "modified": datetime.datetime.fromtimestamp(
+                    self.mtime).strftime("%Y-%m-%d %H:%M")
+            }
+
+    def summary(self):
+        """Get the kept lines and the header message for display.
+
+        Returns:
+            dict: The log's 'contents' and 'header', the 'offset' to poll
+                for new lines from, the 'inode' of the file and the number of
+                lines 'skipped' because they're outside the tail.
+        """
+        with self._lock:
+            return {
+                "contents": self.contents(),
+                "header": self.header(),
+                "offset": self.offset,
+                "inode": self.inode,
+                "skipped": self.skipped
+            }
+
+    def since(self, offset, inode=None):
+        """Get the status of the log and any lines after an offset.
+
+        Args:
+            offset (int): The offset returned by a previous call. If it
+                doesn't fall at the end of a kept line all kept lines are
+                returned instead.
+            inode (int, optional): The inode returned by a previous call. If
+                the log has been replaced since then all kept lines are
+                returned.
+
+        Returns:
+            dict: The log's status, the html-escaped lines after the offset,
+                the unterminated last line and the offset to poll from next.
+        """
+        with self._lock:
+            reset = (inode is not None and inode != self.inode) or not (
+                offset == self.offset or offset == self.first_offset or
+                any(end == offset for end, _ in self.lines))
+            if reset:
+                new_lines = [text for _, text in self.lines]
+            else:
+                new_lines = [text for end, text in self.lines if end > offset]
+            return {
+                "reset": reset,
+                "lines": new_lines,
+                "partial": html.escape(self.partial),
+                "offset": self.offset,
+                "inode": self.inode,
+                "done": self.is_done(),
+                "errors": self.error_count(),
+                "header": self.header()
+            }
 
 
 def read_log(log_file):
@@ -5,17 +5,22 @@ import logging
 
 from flask import session as flask_session
 from flask import (current_app, render_template, flash, url_for, redirect,
-                   request, jsonify, make_response, send_file)
+                   request, jsonify, make_response, send_file,
+                   send_from_directory, abort)
 from flask_login import current_user, login_required
 
 from dashboard import db
 from . import main_bp as main
-from .utils import get_run_log
+from .utils import get_run_log, get_run_log_reader, get_run_overview
 from ...queries import (query_metric_values_byid, query_metric_types,
                         query_metric_values_byname, find_subjects,
                         find_sessions, find_scans)
 from ...models import Study, Site, Timepoint, Analysis
 from ...forms import (SelectMetricsForm, StudyOverviewForm, AnalysisForm)
+from ...exceptions import InvalidUsage
+from ...utils import dashboard_admin_required, read_only, use_primary
+from ...cache import cache
+from ...profiling import get_profiles
 
 logger = logging.getLogger(__name__)
 
@@ -29,19 +34,76 @@ def index():
     """
     studies = current_user.get_studies()
 
-    timepoint_count = Timepoint.query.count()
-    study_count = Study.query.count()
-    site_count = Site.query.count()
+    timepoint_count, study_count, site_count = cache.get_or_set(
+        ('index_counts',),
+        lambda: (Timepoint.query.count(), Study.query.count(),
+                 Site.query.count()),
+        tags=['Timepoint', 'Study', 'Site'])
+    run_overview = get_run_overview(
+        current_app.config['RUN_LOG_DIR'],
+        [study.id for study in studies],
+        current_app.config['RUN_COMPLETE_REGEX'],
+        current_app.config['RUN_ERROR_REGEX'],
+        current_app.config['RUN_LOG_TAIL_LINES'])
     return render_template('index.html',
                            studies=studies,
                            timepoint_count=timepoint_count,
                            study_count=study_count,
-                           site_count=site_count)
+                           site_count=site_count,
+                           run_overview=run_overview)
+
+
+@main.route('/cache_stats')
+@login_required
+@dashboard_admin_required
+def cache_stats():
+    """Report the page fragment cache's hit and miss counts.
+    """
+    return jsonify(cache.get_stats())
+
+
+@main.route('/profiles')
+@login_required
+@dashboard_admin_required
+def profiles():
+    """List the most recent request profiles and their slowest functions.
+    """
+    return render_template(
+        'profiles.html',
+        profiles=get_profiles(current_app.config['PROFILE_DIR'], limit=50),
+        enabled=(current_app.config.get('PROFILE_SAMPLE') or
+                 current_app.config.get('PROFILE_SLOW_REQUEST')))
+
+
+@main.route('/profiles/<filename>')
+@login_required
+@dashboard_admin_required
+def profile_file(filename):
+    """Download a saved .pstats or .collapsed profile.
+    """
+    if not filename.endswith(('.pstats', '.collapsed')):
+        abort(404)
+    return send_from_directory(current_app.config['PROFILE_DIR'], filename,
+                               as_attachment=True)
+
+
+@main.route('/run_logs')
+@login_required
+def run_logs():
+    """Report the status of the latest nightly run for each study.
+    """
+    return jsonify(get_run_overview(
+        current_app.config['RUN_LOG_DIR'],
+        [study.id for study in current_user.get_studies()],
+        current_app.config['RUN_COMPLETE_REGEX'],
+        current_app.config['RUN_ERROR_REGEX'],
+        current_app.config['RUN_LOG_TAIL_LINES']))
 
 
 @main.route('/search_data')
 @main.route('/search_data/<string:search_string>', methods=['GET', 'POST'])
 @login_required
+@read_only
 def search_data(search_string=None):
     """
     Implements the site's search bar.
@@ -110,12 +172,17 @@ def search_data(search_string=None):
 @main.route('/study/<string:study_id>', methods=['GET', 'POST'])
 @main.route('/study/<string:study_id>/<active_tab>', methods=['GET', 'POST'])
 @login_required
+@read_only
 def study(study_id=None, active_tab=None):
     """
     This is the main view for a single study.
     The page is a tabulated view, I would have done this differently given
     another chance.
     """
+    if request.method == 'POST':
+        # The readme may be updated, so compare against the primary's copy
+        use_primary()
+
     if not current_user.has_study_access(study_id):
         flash('Not authorised')
         return redirect(url_for('main.index'))
@@ -147,18 +214,105 @@ def study(study_id=None, active_tab=None):
         current_app.config['RUN_LOG_DIR'],
         study_id,
         current_app.config['RUN_COMPLETE_REGEX'],
-        current_app.config['RUN_ERROR_REGEX'])
+        current_app.config['RUN_ERROR_REGEX'],
+        current_app.config['RUN_LOG_TAIL_LINES'])
+    log_poll = current_app.config['RUN_LOG_POLL_INTERVAL']
 
     return render_template('study.html',
                            study=study,
                            form=form,
                            active_tab=active_tab,
                            nightly_log=nightly_log,
-                           display_metrics=display_metrics)
+                           display_metrics=display_metrics,
+                           log_poll=log_poll,
+                           fragments=get_study_fragments(study))
+
+
+# The models each part of the study page is built from
+STUDY_FRAGMENT_TAGS = {
+    'timepoint_counts': ['Timepoint'],
+    'pending_qc': ['Timepoint', 'Session', 'Scan', 'ScanChecklist',
+                   'EmptySession', 'SessionRedcap', 'StudySite'],
+    'pipelines': ['StudyPipeline'],
+    'details': ['StudyUser', 'User'],
+    'session_list': ['Timepoint', 'Session']
+}
+
+
+def get_study_fragments(study):
+    """Get the cached parts of a study page, building any that are stale.
+
+    None of these depend on who's viewing the page (beyond having access to
+    the study), so they're shared by all users.
+
+    Args:
+        study (:obj:`dashboard.models.Study`): The study being viewed.
+
+    Returns:
+        dict: The number of human and phantom timepoints, the outstanding QC
+            for each timepoint, the study's pipelines and the rendered study
+            details panel and session list.
+    """
+    builders = {
+        'timepoint_counts': lambda: {
+            'human': study.num_timepoints('human'),
+            'phantom': study.num_timepoints('phantom')
+        },
+        'pending_qc': study.outstanding_issues,
+        'pipelines': lambda: [
+            {'view': item.view, 'study': item.study_id,
+             'pipeline': item.pipeline_id, 'name': item.name}
+            for item in study.get_pipelines('study')
+        ],
+        'details': lambda: render_template('snips/study_details.html',
+                                           study=study),
+        'session_list': lambda: render_template(
+            'snips/study_timepoints.html', study=study)
+    }
+    study_tag = 'Study:{}'.format(study.id)
+    return {
+        name: cache.get_or_set(
+            ('study', name, study.id),
+            builder,
+            tags=STUDY_FRAGMENT_TAGS[name] + [study_tag])
+        for name, builder in builders.items()
+    }
+
+
+@main.route('/study/<string:study_id>/run_log')
+@login_required
+def run_log(study_id):
+    """Report any lines added to a study's run log since it was last polled.
+
+    The 'offset' (and optionally 'inode') query parameters should be the
+    values returned by the last poll or given to the study page.
+    """
+    if not current_user.has_study_access(study_id):
+        raise InvalidUsage("Not authorised", status_code=403)
+
+    log_dir = current_app.config['RUN_LOG_DIR']
+    if not log_dir:
+        raise InvalidUsage("Run log reporting is disabled", status_code=404)
+
+    reader = get_run_log_reader(
+        log_dir,
+        study_id,
+        current_app.config['RUN_COMPLETE_REGEX'],
+        current_app.config['RUN_ERROR_REGEX'],
+        current_app.config['RUN_LOG_TAIL_LINES'])
+    try:
+        reader.update()
+    except OSError as e:
+        logger.error(f"Failed to read run log file {reader.log_file}. {e}")
+        raise InvalidUsage("Run log not found", status_code=404)
+
+    return jsonify(reader.since(request.args.get('offset', 0, type=int),
+                                request.args.get('inode', type=int)))
 
 
 @main.route('/metricData', methods=['GET', 'POST'])
 @login_required
+@read_only
 def metricData():
     """
     This is a generic view for querying the database and allows selection of
@@ -279,6 +433,7 @@ def downloadCSV():
 
 @main.route('/metricDataAsJson', methods=['Get', 'Post'])
 @login_required
+@read_only
 def metricDataAsJson(output='http'):
     """
     Query the database for metrics. Handles both GET (generated by client side
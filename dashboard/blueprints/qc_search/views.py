@@ -8,10 +8,13 @@ from . import checklist_bp
 from .forms import QcSearchForm, get_search_form_contents
 from ...models import ExpectedScan, StudyUser, Scantype
 from ...queries import get_scan_qc
+from ...cache import cache, permission_key
+from ...utils import read_only
 
 
 @checklist_bp.route("/", methods=["GET"])
 @login_required
+@read_only
 def qc_search():
     """Get the QC record search form.
     """
@@ -23,15 +26,18 @@ def qc_search():
     form.site.choices = [
         (site, site) for site in current_user.get_sites()
     ]
-    form.tag.choices = [
-        (tag, tag) for tag, *rest in get_tags(current_user)
-    ]
+    tags = cache.get_or_set(
+        ('qc_search_tags', permission_key(current_user)),
+        lambda: [tag for tag, *rest in get_tags(current_user)],
+        tags=['Scantype', 'ExpectedScan', 'StudyUser'])
+    form.tag.choices = [(tag, tag) for tag in tags]
 
     return render_template("qc_search.html", search_form=form)
 
 
 @checklist_bp.route("/submit-query", methods=["POST"])
 @login_required
+@read_only
 def lookup_data():
     """Use AJAX to submit search terms and get a set of QC records.
     """
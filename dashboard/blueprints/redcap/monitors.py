@@ -4,13 +4,21 @@ Any scheduler jobs that the redcap blueprint needs will require a monitor
 function and a check function here. See dashboard.monitors for more information
 on monitors and check functions.
 """
+import logging
 from datetime import datetime, timedelta
 
-from .emails import missing_session_data
+from flask import current_app
+from psycopg2.tz import FixedOffsetTimezone
+
+from dashboard import db, TZ_OFFSET
 from dashboard.monitors import add_monitor, get_emails
-from dashboard.models import Session, User
-from dashboard.exceptions import MonitorException
+from dashboard.models import (Session, User, Notification, RedcapTrigger,
+                              RedcapConfig)
+from dashboard.exceptions import MonitorException, SchedulerException
 from dashboard.queue import submit_job
+from dashboard.blueprints.scans.monitors import monitor_thumbnails
+
+logger = logging.getLogger(__name__)
 
 
 def monitor_scan_import(session, users=None):
@@ -85,11 +93,13 @@ def check_scans(name, num, recipients=None):
                                "scan data was received".format(name, num))
     if session.scans:
         return
-    # dest emails are not set until we decide we're ok with RAs receiving
-    # emails about scans not being imported in time.
-    missing_session_data(str(session),
-                         study=session.get_study().id,
-                         dest_emails=None)
+    # Recipients are not set until we decide we're ok with RAs receiving
+    # emails about scans not being imported in time, so this goes to the
+    # dashboard admins' digest.
+    Notification.queue(None,
+                       Notification.MISSING_SCANS,
+                       str(session),
+                       study=session.get_study().id)
 
 
 def monitor_scan_download(session, end_time=None):
@@ -131,6 +141,11 @@ def monitor_scan_download(session, end_time=None):
                 settings.post_download_script,
                 [study.id, str(session)]
             )
+        try:
+            monitor_thumbnails(session)
+        except SchedulerException as e:
+            logger.error("Failed to queue thumbnails for {}. Reason - "
+                         "{}".format(session, e))
         return
 
     if not end_time:
@@ -164,3 +179,77 @@ def download_session(name, num, end_time):
 
     submit_job(site_settings.download_script, args)
     monitor_scan_download(session, datetime.fromtimestamp(float(end_time)))
+
+
+def process_dets():
+    """Retrieve the REDCap records for all queued data entry triggers.
+
+    This runs periodically on the scheduler server. REDCap sends a trigger
+    every time a form is saved, so triggers are grouped by the record they
+    refer to and a record is only retrieved once it has stopped changing for
+    REDCAP_DET_WINDOW seconds. Only the most recent trigger in each group is
+    processed, the rest are marked as duplicates.
+    """
+    # Imported here because utils.py needs this module's monitors
+    from .utils import create_from_det
+
+    window = timedelta(seconds=current_app.config['REDCAP_DET_WINDOW'])
+    cutoff = datetime.now(FixedOffsetTimezone(offset=TZ_OFFSET)) - window
+
+    pending = RedcapTrigger.query \
+        .filter(RedcapTrigger.status == RedcapTrigger.PENDING) \
+        .order_by(RedcapTrigger.received, RedcapTrigger.id) \
+        .all()
+
+    groups = {}
+    for trigger in pending:
+        groups.setdefault(trigger.key, []).append(trigger)
+
+    for triggers in groups.values():
+        latest = triggers[-1]
+        if latest.received > cutoff:
+            # The record is still being edited. Wait for it to settle.
+            continue
+
+        try:
+            create_from_det(latest.contents)
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Failed processing data entry trigger {}. "
+                         "Reason: {}".format(latest.id, e))
+            latest.set_status(RedcapTrigger.FAILED, error=str(e))
+        else:
+            latest.set_status(RedcapTrigger.DONE)
+
+        for duplicate in triggers[:-1]:
+            duplicate.set_status(RedcapTrigger.DUPLICATE)
+
+        db.session.add_all(triggers)
+        db.session.commit()
+
+
+def reconcile_redcap():
+    """Add any completed REDCap records that never received a trigger.
+
+    This runs nightly on the scheduler server (see REDCAP_RECONCILE_HOUR) for
+    every redcap config that has an API token.
+    """
+    # Imported here because utils.py needs this module's monitors
+    from .utils import reconcile_records
+
+    configs = RedcapConfig.query \
+        .filter(RedcapConfig.token != None) \
+        .all()  # noqa: E711
+
+    for cfg in configs:
+        try:
+            added = reconcile_records(cfg)
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Failed to reconcile records for {} in project {} "
+                         "on server {}. Reason: {}".format(
+                             cfg.instrument, cfg.project, cfg.url, e))
+            continue
+        if added:
+            logger.info("Added {} missing REDCap records for {} in project "
+                        "{}".format(added, cfg.instrument, cfg.project))
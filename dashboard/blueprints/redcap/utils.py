@@ -1,20 +1,33 @@
 #!/usr/bin/env python
 
 import re
+import time
 import logging
+from collections import namedtuple
+from datetime import datetime
 
-from flask import url_for, flash
+from flask import url_for, flash, current_app
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import insert
 from werkzeug.routing import RequestRedirect
-import redcap as REDCAP
 
 from .monitors import monitor_scan_import, monitor_scan_download
-from dashboard.models import Session, Timepoint, RedcapRecord, RedcapConfig
-from dashboard.queries import get_studies
+from dashboard import db
+from dashboard.models import (Study, Session, RedcapRecord, RedcapConfig,
+                              RedcapTrigger, SessionRedcap,
+                              study_timepoints_table)
+from dashboard.cache import invalidate_on_commit
+from dashboard.resolver import resolver, resolve
 from dashboard.exceptions import RedcapException
 import datman.scanid
 
 logger = logging.getLogger(__name__)
 
+CachedProject = namedtuple('CachedProject', 'project url token created')
+
+# REDCap API clients, keyed by RedcapConfig ID
+_projects = {}
+
 
 def get_redcap_record(record_id, fail_url=None):
     if not fail_url:
@@ -32,17 +45,81 @@ def get_redcap_record(record_id, fail_url=None):
 
 
 def create_from_request(request):
+    return create_from_det(request.form)
+
+
+def queue_det(det):
+    """Save a data entry trigger to be processed by the scheduler.
+
+    Only the structure of the trigger is checked here, so that REDCap
+    receives a reply right away. The record itself is retrieved later
+    by :py:func:`dashboard.blueprints.redcap.monitors.process_dets`.
+
+    Args:
+        det (:obj:`dict`): The contents of a REDCap data entry trigger.
+
+    Raises:
+        :obj:`dashboard.exceptions.RedcapException`: If the trigger is
+            malformed or can't be saved.
+
+    Returns:
+        :obj:`dashboard.models.RedcapTrigger`: The saved trigger.
+    """
+    parse_det(det)
     try:
-        record = request.form['record']
-        project = request.form['project_id']
-        url = request.form['redcap_url']
-        instrument = request.form['instrument']
+        trigger = RedcapTrigger(dict(det))
+        trigger.save()
+    except Exception as e:
+        raise RedcapException("Failed to save data entry trigger for "
+                              "record {}. Reason: {}".format(
+                                  det.get('record'), e))
+    return trigger
+
+
+def parse_det(det):
+    """Get the fields that every REDCap data entry trigger must contain.
+
+    Args:
+        det (:obj:`dict`): The contents of a REDCap data entry trigger.
+
+    Raises:
+        :obj:`dashboard.exceptions.RedcapException`: If a required field is
+            missing or malformed.
+
+    Returns:
+        tuple: The record ID, project ID, server URL, instrument name and
+            REDCap version sent with the trigger.
+    """
+    try:
+        record = det['record']
+        project = det['project_id']
+        url = det['redcap_url']
+        instrument = det['instrument']
         version = re.search('redcap_v(.*)/index',
-                            request.form['project_url']).group(1)
-    except KeyError:
+                            det['project_url']).group(1)
+        int(project)
+    except (KeyError, AttributeError, TypeError, ValueError):
         raise RedcapException('Redcap data entry trigger request missing a '
                               'required key. Found keys: {}'.format(
-                                  list(request.form.keys())))
+                                  list(det.keys())))
+    return record, project, url, instrument, version
+
+
+def create_from_det(det):
+    """Retrieve and save the REDCap record a data entry trigger refers to.
+
+    Args:
+        det (:obj:`dict`): The contents of a REDCap data entry trigger.
+
+    Raises:
+        :obj:`dashboard.exceptions.RedcapException`: If the trigger is
+            malformed or the record can't be retrieved or saved.
+
+    Returns:
+        :obj:`dashboard.models.RedcapRecord`: The new (or updated) record, or
+            None if the trigger does not need to be recorded.
+    """
+    record, project, url, instrument, version = parse_det(det)
 
     try:
         cfg = RedcapConfig.get_config(
@@ -62,14 +139,14 @@ def create_from_request(request):
     else:
         completed = list(cfg.completed_value)
 
-    if (cfg.completed_field in request.form and
-            request.form[cfg.completed_field] not in completed):
+    if (cfg.completed_field in det and
+            det[cfg.completed_field] not in completed):
         # Check if complete before pulling whole record
         logger.info("Record {} not completed. Ignoring".format(record))
         return
 
-    if 'redcap_event_name' in request.form:
-        event_name = request.form['redcap_event_name']
+    if 'redcap_event_name' in det:
+        event_name = det['redcap_event_name']
         event_id = (
             cfg.event_ids.get(event_name) if cfg.event_ids else None
         )
@@ -77,7 +154,7 @@ def create_from_request(request):
         event_name = None
         event_id = None
 
-    rc = REDCAP.Project(url + 'api/', cfg.token)
+    rc = get_project(cfg)
     server_record = rc.export_records([record])
 
     if event_name:
@@ -93,7 +170,7 @@ def create_from_request(request):
 
     server_record = server_record[0]
 
-    if (cfg.completed_field not in request.form and
+    if (cfg.completed_field not in det and
             server_record[cfg.completed_field] not in completed):
         # Check when the 'completed' field wasnt present in the DET
         logger.info("Record {} not completed. Ignoring".format(record))
@@ -139,6 +216,193 @@ def create_from_request(request):
     return new_record
 
 
+def get_project(cfg):
+    """Get a REDCap API client for a redcap config.
+
+    Clients are reused between triggers so that project metadata (which the
+    client retrieves the first time it's needed) isn't requested from the
+    server over and over. A client is replaced once it's older than
+    REDCAP_METADATA_TTL seconds, or if the config's URL or token change.
+
+    Args:
+        cfg (:obj:`dashboard.models.RedcapConfig`): The config for a
+            REDCap instrument.
+
+    Returns:
+        :obj:`redcap.Project`: A client for the config's project.
+    """
+    ttl = current_app.config['REDCAP_METADATA_TTL']
+    cached = _projects.get(cfg.id)
+    if (cached and cached.url == cfg.url and cached.token == cfg.token and
+            time.monotonic() - cached.created < ttl):
+        return cached.project
+
+    # Imported here so instances that don't use REDCap never load it
+    import redcap
+
+    project = redcap.Project(cfg.url + 'api/', cfg.token)
+    _projects[cfg.id] = CachedProject(project, cfg.url, cfg.token,
+                                      time.monotonic())
+    return project
+
+
+def clear_project_cache():
+    """Discard all cached REDCap API clients.
+    """
+    _projects.clear()
+
+
+def reconcile_records(cfg):
+    """Add any completed REDCap records that the dashboard is missing.
+
+    All completed records for the config's instrument are exported in a
+    single request and then added to the database in bulk. This catches
+    records whose data entry triggers were lost (e.g. if the dashboard was
+    down when they were sent). Existing records get their comment and user
+    updated, and sessions that already have a REDCap record are not changed.
+
+    Args:
+        cfg (:obj:`dashboard.models.RedcapConfig`): The config for the
+            instrument to reconcile.
+
+    Returns:
+        int: The number of sessions that had a REDCap record added.
+    """
+    rc = get_project(cfg)
+    fields = [rc.def_field, cfg.date_field, cfg.comment_field,
+              cfg.session_id_field, cfg.user_id_field, cfg.completed_field]
+    completed = " or ".join(
+        "[{}] = '{}'".format(cfg.completed_field, value)
+        for value in cfg.completed_value
+    )
+    server_records = rc.export_records(
+        fields=[field for field in fields if field],
+        filter_logic=completed
+    )
+
+    found = {}
+    for item in server_records:
+        if item.get(cfg.completed_field) not in cfg.completed_value:
+            continue
+
+        event_name = item.get('redcap_event_name')
+        event_id = None
+        if event_name and cfg.event_ids:
+            if event_name not in cfg.event_ids:
+                continue
+            event_id = cfg.event_ids[event_name]
+
+        try:
+            ident = datman.scanid.parse(
+                item[cfg.session_id_field].strip().upper())
+            date = datetime.strptime(item[cfg.date_field][:10], '%Y-%m-%d')
+        except (KeyError, ValueError, datman.scanid.ParseException):
+            continue
+
+        try:
+            rc_user = int(item[cfg.user_id_field])
+        except (KeyError, TypeError, ValueError):
+            rc_user = None
+
+        session = (ident.get_full_subjectid_with_timepoint(),
+                   datman.scanid.get_session_num(ident))
+        found[session] = {
+            'record': str(item[rc.def_field]),
+            'config': cfg.id,
+            'entry_date': str(date.date()),
+            'redcap_user': rc_user,
+            'comment': item.get(cfg.comment_field),
+            'event_id': event_id
+        }
+
+    if not found:
+        return 0
+
+    # Add any missing sessions first. Adding a timepoint commits (and on
+    # failure, rolls back) the database session.
+    db_sessions = {
+        (item.name, item.num)
+        for item in Session.query.filter(
+            tuple_(Session.name, Session.num).in_(list(found)))
+    }
+    for name, num in list(found):
+        if (name, num) in db_sessions:
+            continue
+        try:
+            set_session("{}_{:02d}".format(name, num))
+        except Exception as e:
+            logger.error("Can't add REDCap record for session {}_{:02d}. "
+                         "Reason: {}".format(name, num, e))
+            del found[(name, num)]
+
+    def record_key(record):
+        return (record['record'], record['event_id'],
+                str(record['entry_date']))
+
+    existing = {
+        (item.record, item.event_id, str(item.date)): item
+        for item in RedcapRecord.query.filter(
+            RedcapRecord.form_config == cfg.id)
+    }
+
+    new_records = {}
+    updates = []
+    for record in found.values():
+        key = record_key(record)
+        if key not in existing:
+            new_records[key] = record
+            continue
+        db_record = existing[key]
+        if (db_record.comment != record['comment'] or
+                db_record.user != record['redcap_user']):
+            updates.append({'id': db_record.id,
+                            'comment': record['comment'],
+                            'user': record['redcap_user']})
+
+    record_ids = {key: item.id for key, item in existing.items()}
+    if new_records:
+        table = RedcapRecord.__table__
+        result = db.session.execute(
+            insert(table)
+            .values(list(new_records.values()))
+            .returning(table.c.id, table.c.record, table.c.event_id,
+                       table.c.entry_date)
+        )
+        for rec_id, record, event_id, date in result:
+            record_ids[(record, event_id, str(date))] = rec_id
+
+    if updates:
+        db.session.bulk_update_mappings(RedcapRecord, updates)
+
+    added = 0
+    if found:
+        links = [
+            {'name': name,
+             'num': num,
+             'record_id': record_ids[record_key(record)]}
+            for (name, num), record in found.items()
+        ]
+        result = db.session.execute(
+            insert(SessionRedcap.__table__)
+            .values(links)
+            .on_conflict_do_nothing()
+            .returning(SessionRedcap.__table__.c.name)
+        )
+        added = len(result.fetchall())
+
+    # The inserts above aren't seen by the ORM, so report the changes to the
+    # page cache
+    tags = {'RedcapRecord', 'SessionRedcap'}
+    if found:
+        timepoints = list({name for name, _ in found})
+        tags.update('Study:{}'.format(study) for study, in db.session.query(
+            study_timepoints_table.c.study.distinct()).filter(
+                study_timepoints_table.c.timepoint.in_(timepoints)))
+    invalidate_on_commit(db.session, tags)
+    db.session.commit()
+    return added
+
+
 def set_session(name):
     name = name.strip().upper()
     try:
@@ -146,19 +410,18 @@ def set_session(name):
     except datman.scanid.ParseException:
         raise RedcapException("Invalid session ID {}".format(name))
 
-    name = ident.get_full_subjectid_with_timepoint()
-    num = datman.scanid.get_session_num(ident)
-
-    session = Session.query.get((name, num))
-    if not session:
-        timepoint = get_timepoint(ident)
-        session = timepoint.add_session(num)
+    found = resolve(ident)
+    if found.session:
+        return found.session
 
-    return session
+    timepoint = found.timepoint or add_timepoint(ident, found.studies)
+    return timepoint.add_session(datman.scanid.get_session_num(ident))
 
 
 def find_study(ident):
-    study = get_studies(tag=ident.study, site=ident.site)
+    study = [Study.query.get(study_id) for study_id in
+             resolver.find_studies(ident.study, ident.site)]
+    study = [item for item in study if item]
     if not study:
         raise RedcapException("Invalid study/site combination: {} {}"
                               "".format(ident.study, ident.site))
@@ -166,8 +429,14 @@ def find_study(ident):
 
 
 def get_timepoint(ident):
-    timepoint = Timepoint.query.get(ident.get_full_subjectid_with_timepoint())
-    if not timepoint:
+    found = resolve(ident)
+    if found.timepoint:
+        return found.timepoint
+    return add_timepoint(ident, found.studies)
+
+
+def add_timepoint(ident, study_ids=None):
+    study = Study.query.get(study_ids[0]) if study_ids else None
+    if not study:
         study = find_study(ident)[0]
-        timepoint = study.add_timepoint(ident)
-    return timepoint
+    return study.add_timepoint(ident)
@@ -16,16 +16,18 @@ logger = logging.getLogger(__name__)
 def redcap():
     """URL endpoint to receive redcap data entry triggers.
 
-    A redcap server can send a notification to this URL when a survey is saved
-    and the record will be retrieved and saved to the database.
+    A redcap server can send a notification to this URL when a survey is
+    saved. The trigger is queued and the record will be retrieved and saved
+    to the database by the scheduler, so REDCap gets a reply immediately.
     """
     try:
-        utils.create_from_request(request)
+        utils.queue_det(request.form)
     except Exception as e:
-        logger.error('Failed creating redcap object. Reason: {}'.format(e))
+        logger.error('Failed queueing redcap data entry trigger. '
+                     'Reason: {}'.format(e))
         raise InvalidUsage(str(e), status_code=400)
 
-    return 'Record successfully added', 200
+    return 'Data entry trigger received', 200
 
 
 @rcap_bp.route('/redcap_redirect/<int:record_id>', methods=['GET'])
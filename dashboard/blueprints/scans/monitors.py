@@ -0,0 +1,114 @@
+"""Monitors used by the scans blueprint.
+
+Any scheduler jobs that the scans blueprint needs will require a monitor
+function and a check function here. See dashboard.monitors for more information
+on monitors and check functions.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from dashboard.monitors import add_monitor
+from dashboard.models import Session, Scan, ScanChecklist, Timepoint
+from dashboard.exceptions import MonitorException
+from .utils import get_nifti_path
+from .thumbnails import get_thumbnails, get_thumbnail_path
+
+logger = logging.getLogger(__name__)
+
+# The thumbnail paths (which include the scan's mtime) of scans that
+# couldn't be read
+_failed = set()
+
+
+def monitor_thumbnails(session):
+    """Add a scheduler job to make thumbnails for every scan in a session.
+
+    Args:
+        session (:obj:`dashboard.models.Session`): The session to make
+            thumbnails for.
+
+    Raises:
+        :obj:`dashboard.exceptions.MonitorException`: if a
+            :obj:`dashboard.models.Session` object is not given.
+        :obj:`dashboard.exceptions.SchedulerException`: if the job can't be
+            added to the server.
+    """
+    if not isinstance(session, Session):
+        raise MonitorException("Must provide an instance of "
+                               "dashboard.models.Session to add a thumbnail "
+                               "monitor. Received type {}".format(
+                                   type(session)))
+    add_monitor(make_session_thumbnails, [session.name, session.num])
+
+
+def make_session_thumbnails(name, num):
+    """Make and cache thumbnails for every scan in a session.
+
+    Args:
+        name (:obj:`str`): The session name
+        num (int): The repeat number
+
+    Raises:
+        :obj:`dashboard.exceptions.MonitorException`: If a matching session
+            can't be found.
+    """
+    session = Session.query.get((name, num))
+    if not session:
+        raise MonitorException("Session {}_{:02d} is no longer in database. "
+                               "Cannot make thumbnails.".format(name, num))
+    make_thumbnails(session.scans)
+
+
+def make_new_thumbnails():
+    """Make and cache thumbnails for recent scans still waiting for QC.
+
+    This runs regularly on the scheduler server so thumbnails are ready before
+    reviewers open a timepoint. Only scans from sessions in the last
+    THUMBNAIL_DAYS days are checked, phantoms are skipped and thumbnails
+    that are already cached (or that couldn't be made) are skipped.
+    """
+    since = datetime.now() - timedelta(
+        days=current_app.config['THUMBNAIL_DAYS'])
+    scans = Scan.query \
+        .join(Scan.session) \
+        .join(Session.timepoint) \
+        .outerjoin(ScanChecklist) \
+        .filter(ScanChecklist.id == None) \
+        .filter(Timepoint.is_phantom == False) \
+        .filter(Session.date >= since) \
+        .all()  # noqa: E711, E712
+    make_thumbnails(scans)
+
+
+def make_thumbnails(scans):
+    """Make (or find the cached) thumbnails for a list of scans.
+
+    Scans that fail are remembered (until their file is modified) and
+    skipped the next time.
+
+    Args:
+        scans (:obj:`list` of :obj:`dashboard.models.Scan`): The scans to
+            make thumbnails for. Scans whose files can't be read are skipped.
+
+    Returns:
+        int: The number of scans with thumbnails.
+    """
+    done = 0
+    for scan in scans:
+        key = None
+        try:
+            full_path = get_nifti_path(scan)
+            key = get_thumbnail_path(full_path, 'axial')
+            if key in _failed:
+                continue
+            get_thumbnails(full_path)
+        except Exception as e:
+            if key:
+                _failed.add(key)
+            logger.error("Failed to make thumbnails for scan {}. Reason - "
+                         "{} {}".format(scan, type(e).__name__, e))
+            continue
+        done += 1
+    return done
@@ -0,0 +1,367 @@
+"""Generate small preview copies of scans for the papaya viewer.
+
+4D series (e.g. fMRI and DWI) can be gigabytes in size, which is a lot to
+download just to look at them. A preview holds the first, middle and last
+volumes plus the mean of the series, downsampled in-plane and quantised to a
+small integer type, which is usually a tiny fraction of the original size.
+Series are memory-mapped (compressed ones are first decompressed to a
+temporary file) so they're never read into memory all at once.
+
+Previews are generated in a background process pool and cached on disk under
+SCAN_CACHE_DIR. The cached file name includes the source file's modification
+time, so a preview is regenerated whenever its scan is modified. If a preview
+can't be made it isn't tried again until the scan is modified.
+"""
+import os
+import gzip
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import nibabel as nib
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pending = {}
+# Jobs (identified by the path they write to, which includes the source
+# file's mtime) that failed
+_failed = set()
+_lock = threading.Lock()
+
+
+def get_preview_path(full_path, stat=None):
+    """Get the path a scan's preview is (or will be) cached at.
+
+    Args:
+        full_path (:obj:`str`): The full path to a nifti file.
+        stat (:obj:`os.stat_result`, optional): The result of os.stat for
+            full_path, if it's already been read.
+
+    Raises:
+        OSError: If the nifti file can't be read.
+
+    Returns:
+        str: The full path to the preview file.
+    """
+    if stat is None:
+        stat = os.stat(full_path)
+    return os.path.join(
+        get_cache_dir('previews'), "{}_{:x}.nii.gz".format(
+            get_cache_key(full_path), stat.st_mtime_ns))
+
+
+def request_preview(full_path):
+    """Find a scan's preview, starting its generation if it doesn't exist.
+
+    Args:
+        full_path (:obj:`str`): The full path to a nifti file.
+
+    Raises:
+        OSError: If the nifti file can't be read, or an earlier attempt to
+            make its preview failed.
+
+    Returns:
+        str: The full path to the preview file, or None if it isn't ready yet.
+    """
+    preview = get_preview_path(full_path)
+    if os.path.exists(preview):
+        return preview
+
+    submit(preview, make_preview, full_path, preview,
+           current_app.config['SCAN_PREVIEW_SIZE'])
+    return None
+
+
+def submit(key, func, *args):
+    """Run a function in the background process pool once.
+
+    Nothing is submitted if a job with the same key is still running. If a
+    job with the key has failed it isn't tried again (keys should change
+    when their source files do, e.g. by including the file's mtime).
+
+    Args:
+        key (:obj:`str`): A unique name for the job, usually the path of the
+            file it makes.
+        func (:obj:`function`): The function to run. It must be importable
+            by the worker processes.
+        *args: The arguments to pass to func.
+
+    Raises:
+        OSError: If an earlier job with the same key failed.
+    """
+    with _lock:
+        if key in _failed:
+            raise OSError("Failed to make {} previously".format(
+                os.path.basename(key)))
+        if key in _pending:
+            return
+        future = _get_pool().submit(func, *args)
+        future.add_done_callback(lambda result: _finish(key, result))
+        _pending[key] = future
+
+
+def get_cache_key(full_path):
+    """Get a short key that identifies a scan file in the cache.
+
+    Args:
+        full_path (:obj:`str`): The full path to a nifti file.
+
+    Returns:
+        str: A hex digest of the file's real path.
+    """
+    return hashlib.sha1(os.path.realpath(full_path).encode()).hexdigest()
+
+
+def get_cache_dir(name):
+    """Get (and create, if needed) a folder within SCAN_CACHE_DIR.
+
+    Args:
+        name (:obj:`str`): The name of the folder (e.g. 'previews').
+
+    Returns:
+        str: The full path to the folder.
+    """
+    cache_dir = os.path.join(current_app.config['SCAN_CACHE_DIR'], name)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def make_preview(full_path, dest, max_size=128, dtype=np.int16):
+    """Write a reduced copy of a nifti file.
+
+    3D images are only downsampled and quantised. For 4D images the first,
+    middle and last volumes and the mean over time are kept.
+
+    Args:
+        full_path (:obj:`str`): The full path to a nifti file.
+        dest (:obj:`str`): The full path to write the preview to. Any older
+            previews of the same file will be deleted.
+        max_size (int, optional): The maximum number of voxels along each
+            in-plane axis. Defaults to 128.
+        dtype (:obj:`numpy.dtype`, optional): The integer type to store the
+            preview as. Defaults to int16.
+
+    Returns:
+        str: The full path to the preview.
+    """
+    tmp_name = "{}.{}.tmp".format(dest[:-len(".nii.gz")], os.getpid())
+    with open_image(full_path, tmp_name + ".nii") as image:
+        factor = get_downsample_factor(image.shape, max_size)
+
+        if len(image.shape) > 3 and image.shape[3] > 1:
+            num_vols = image.shape[3]
+            volumes = [
+                downsample(read_volume(image, idx), factor)
+                for idx in sorted({0, num_vols // 2, num_vols - 1})
+            ]
+            volumes.append(downsample(mean_volume(image), factor))
+            data = np.stack(volumes, axis=-1)
+        else:
+            data = downsample(read_volume(image, 0), factor)
+
+        data, slope, inter = quantise(data, dtype)
+        preview = nib.Nifti1Image(data,
+                                  downsample_affine(image.affine, factor))
+        preview.header.set_xyzt_units(*image.header.get_xyzt_units())
+        preview.header.set_slope_inter(slope, inter)
+
+    _remove_stale(dest)
+    tmp_file = tmp_name + ".nii.gz"
+    nib.save(preview, tmp_file)
+    os.replace(tmp_file, dest)
+    return dest
+
+
+@contextmanager
+def open_image(full_path, tmp_file):
+    """Open a nifti file, reading as little of its data as possible.
+
+    Uncompressed files are memory-mapped, so only the voxels that are used
+    get read from disk. Compressed files can't be read from the middle
+    without decompressing everything before it, so they're decompressed once
+    to a temporary file which is memory-mapped instead (and deleted
+    afterwards). Neither is ever read into memory all at once.
+
+    Args:
+        full_path (:obj:`str`): The full path to a nifti file.
+        tmp_file (:obj:`str`): The full path to decompress the file to, if
+            it's compressed.
+
+    Yields:
+        :obj:`nibabel.Nifti1Image`: The image.
+    """
+    if not full_path.endswith('.gz'):
+        yield nib.load(full_path, mmap=True)
+        return
+    try:
+        with gzip.open(full_path, 'rb') as src, open(tmp_file, 'wb') as dest:
+            shutil.copyfileobj(src, dest, 1024 * 1024)
+        yield nib.load(tmp_file, mmap=True)
+    finally:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+
+def read_volume(image, index=0):
+    """Read a single 3D volume from an image.
+
+    Args:
+        image (:obj:`nibabel.Nifti1Image`): An image from
+            :py:func:`open_image`.
+        index (int, optional): The volume (time point) to read. Ignored
+            for 3D images. Defaults to 0.
+
+    Returns:
+        :obj:`numpy.ndarray`: The volume as a 3D float32 array.
+    """
+    if len(image.shape) == 3:
+        data = image.dataobj[...]
+    else:
+        data = image.dataobj[:, :, :, index]
+    data = np.asarray(data, dtype=np.float32)
+    # Any trailing dimensions past time are dropped
+    while data.ndim > 3:
+        data = data[..., 0]
+    return data
+
+
+def mean_volume(image, chunk=16):
+    """Find the mean over time of a 4D image.
+
+    Volumes are read a chunk at a time so the whole series never needs to
+    be held in memory.
+
+    Args:
+        image (:obj:`nibabel.Nifti1Image`): An image from
+            :py:func:`open_image`.
+        chunk (int, optional): The number of volumes to read at once.
+
+    Returns:
+        :obj:`numpy.ndarray`: The mean volume as a 3D float32 array.
+    """
+    num_vols = image.shape[3]
+    total = np.zeros(image.shape[:3], dtype=np.float64)
+    for start in range(0, num_vols, chunk):
+        data = np.asarray(image.dataobj[:, :, :, start:start + chunk],
+                          dtype=np.float64)
+        while data.ndim > 4:
+            data = data[..., 0]
+        total += data.sum(axis=3)
+    return (total / num_vols).astype(np.float32)
+
+
+def get_downsample_factor(shape, max_size):
+    """Find the in-plane downsampling factor needed to fit a maximum size.
+
+    Args:
+        shape (:obj:`tuple`): The shape of the image.
+        max_size (int): The maximum number of voxels along each in-plane axis.
+
+    Returns:
+        int: The factor to reduce the first two axes by (1 if no reduction
+            is needed).
+    """
+    largest = max(shape[:2])
+    return max(1, -(-largest // max_size))
+
+
+def downsample(data, factor):
+    """Reduce the in-plane resolution of a volume by averaging blocks.
+
+    Args:
+        data (:obj:`numpy.ndarray`): A 3D volume.
+        factor (int): The number of voxels along each in-plane axis to
+            average together. Edge voxels that don't fill a block are dropped.
+
+    Returns:
+        :obj:`numpy.ndarray`: The downsampled volume.
+    """
+    if factor == 1:
+        return data
+    x, y, z = data.shape
+    x, y = x - x % factor, y - y % factor
+    blocks = data[:x, :y].reshape(x // factor, factor, y // factor, factor, z)
+    return blocks.mean(axis=(1, 3))
+
+
+def downsample_affine(affine, factor):
+    """Adjust an image's affine to match a downsampled copy.
+
+    Args:
+        affine (:obj:`numpy.ndarray`): The original 4x4 affine.
+        factor (int): The in-plane downsampling factor used.
+
+    Returns:
+        :obj:`numpy.ndarray`: The affine for the downsampled image.
+    """
+    affine = np.array(affine, dtype=np.float64)
+    if factor == 1:
+        return affine
+    # Each new voxel's centre is the centre of the block it was made from
+    offset = (factor - 1) / 2
+    affine[:3, 3] = affine[:3, :3].dot([offset, offset, 0]) + affine[:3, 3]
+    affine[:3, :2] *= factor
+    return affine
+
+
+def quantise(data, dtype=np.int16):
+    """Scale an array into the range of a smaller integer type.
+
+    Args:
+        data (:obj:`numpy.ndarray`): The data to convert.
+        dtype (:obj:`numpy.dtype`, optional): An integer type (e.g. uint8 or
+            int16). Defaults to int16.
+
+    Returns:
+        tuple: The converted array, plus the slope and intercept that
+            map it back to the original values.
+    """
+    info = np.iinfo(dtype)
+    low = float(np.nanmin(data))
+    high = float(np.nanmax(data))
+    data = np.nan_to_num(data, nan=low)
+    if high == low:
+        return np.zeros(data.shape, dtype=dtype), 1.0, low
+
+    slope = (high - low) / (info.max - info.min)
+    inter = low - info.min * slope
+    scaled = np.rint((data - inter) / slope)
+    return np.clip(scaled, info.min, info.max).astype(dtype), slope, inter
+
+
+def _remove_stale(dest):
+    cache_dir = os.path.dirname(dest)
+    prefix = os.path.basename(dest).split("_")[0] + "_"
+    for entry in os.scandir(cache_dir):
+        if (entry.name.startswith(prefix) and entry.path != dest and
+                ".tmp." not in entry.name):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=current_app.config['SCAN_PREVIEW_WORKERS'])
+    return _pool
+
+
+def _finish(key, future):
+    with _lock:
+        _pending.pop(key, None)
+        if future.exception():
+            _failed.add(key)
+    if future.exception():
+        logger.error("Failed to generate {}. Reason - {}".format(
+            key, future.exception()))
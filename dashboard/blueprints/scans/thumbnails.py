@@ -0,0 +1,294 @@
+"""Make PNG thumbnails of a scan's orthogonal mid-slices.
+
+Only the requested slice is read from disk (uncompressed niftis are
+memory-mapped). Thumbnails are made in the background when first requested
+and each thumbnail is cached under SCAN_CACHE_DIR with the
+source file's modification time in its name so it's remade if the scan
+changes. Slices are flipped into neurological orientation (the subject's
+right on the right, anterior/superior at the top) and scaled to account for
+non-isotropic voxels.
+"""
+import os
+import zlib
+import struct
+
+import numpy as np
+import nibabel as nib
+from flask import current_app
+from nibabel.orientations import io_orientation
+
+from .previews import get_cache_dir, get_cache_key, submit
+
+# Maps each view to the RAS axis it cuts across, and the RAS axes shown
+# along the image's rows (top to bottom) and columns (left to right).
+VIEWS = {
+    'axial': (2, 1, 0),
+    'coronal': (1, 2, 0),
+    'sagittal': (0, 2, 1)
+}
+
+
+def get_thumbnail_path(full_path, view, time_index=None, stat=None):
+    """Get the path a thumbnail is (or will be) cached at.
+
+    Args:
+        full_path (:obj:`str`): The full path to a nifti file.
+        view (:obj:`str`): One of 'axial', 'coronal' or 'sagittal'.
+        time_index (int, optional): The volume of a 4D series to use.
+        stat (:obj:`os.stat_result`, optional): The result of os.stat for
+            full_path, if it's already been read.
+
+    Raises:
+        OSError: If the nifti file can't be read.
+
+    Returns:
+        str: The full path to the thumbnail.
+    """
+    if stat is None:
+        stat = os.stat(full_path)
+    time_index = "mid" if time_index is None else time_index
+    return os.path.join(
+        get_cache_dir('thumbnails'), "{}_{:x}_{}_{}.png".format(
+            get_cache_key(full_path), stat.st_mtime_ns, view, time_index))
+
+
+def request_thumbnail(full_path, view, time_index=None):
+    """Find a scan's thumbnail, queueing it to be made if it isn't cached.
+
+    Thumbnails are made in the background process pool used for previews
+    (see :py:func:`previews.submit`) so a page with many thumbnails doesn't
+    have to wait for every scan to be read. A request for the default
+    (middle) volume makes all three views at once.
+
+    Args:
+        full_path (:obj:`str`): The full path to a nifti file.
+        view (:obj:`str`): One of 'axial', 'coronal' or 'sagittal'.
+        time_index (int, optional): The volume of a 4D series to use. If not
+            given the middle volume is used.
+
+    Raises:
+        OSError: If the nifti file can't be read, or an earlier attempt to
+            make the thumbnail failed.
+        ValueError: If the view is invalid.
+
+    Returns:
+        str: The full path to the thumbnail, or None if it isn't ready yet.
+    """
+    if view not in VIEWS:
+        raise ValueError("Unrecognized view {}".format(view))
+    stat = os.stat(full_path)
+    dest = get_thumbnail_path(full_path, view, time_index, stat)
+    if os.path.exists(dest):
+        return dest
+
+    if time_index is None:
+        targets = {name: get_thumbnail_path(full_path, name, stat=stat)
+                   for name in VIEWS}
+        # One job makes every view, so requests for each share its key
+        key = targets['axial']
+    else:
+        targets = {view: dest}
+        key = dest
+    submit(key, write_thumbnails, full_path, targets, time_index,
+           current_app.config['SCAN_THUMBNAIL_SIZE'])
+    return None
+
+
+def get_thumbnails(full_path):
+    """Make the three mid-slice thumbnails of a scan, if they aren't cached.
+
+    Args:
+        full_path (:obj:`str`): The full path to a nifti file.
+
+    Raises:
+        OSError: If the nifti file can't be read.
+
+    Returns:
+        dict: The full path to the thumbnail for each view.
+    """
+    stat = os.stat(full_path)
+    targets = {view: get_thumbnail_path(full_path, view, stat=stat)
+               for view in VIEWS}
+    missing = {view: dest for view, dest in targets.items()
+               if not os.path.exists(dest)}
+    if missing:
+        write_thumbnails(full_path, missing,
+                         max_size=current_app.config['SCAN_THUMBNAIL_SIZE'])
+    return targets
+
+
+def write_thumbnails(full_path, targets, time_index=None, max_size=128):
+    """Make thumbnails of a scan, reading its header only once.
+
+    Args:
+        full_path (:obj:`str`): The full path to a nifti file.
+        targets (dict): The path to write the thumbnail of each view to.
+        time_index (int, optional): The volume of a 4D series to use. If not
+            given the middle volume is used.
+        max_size (int, optional): The maximum width or height of the
+            thumbnails in pixels. Defaults to 128.
+
+    Raises:
+        ValueError: If the time index is outside of the series.
+    """
+    image = nib.load(full_path, mmap=True)
+    if full_path.endswith('.gz') and len(targets) > 1:
+        # Compressed files can't be sliced without decompressing everything
+        # before the slice, so read the volume once instead of once per view
+        image = nib.Nifti1Image(read_volume(image, time_index), image.affine,
+                                image.header)
+        time_index = None
+    for view, dest in targets.items():
+        png = encode_png(get_slice(image, view, time_index, max_size))
+        tmp_file = "{}.{}.tmp".format(dest, os.getpid())
+        with open(tmp_file, "wb") as fh:
+            fh.write(png)
+        os.replace(tmp_file, dest)
+
+
+def read_volume(image, time_index=None):
+    """Read one 3D volume of an image into memory.
+
+    Args:
+        image (:obj:`nibabel.Nifti1Image`): The image to read.
+        time_index (int, optional): The volume of a 4D series to read. If
+            not given the middle volume is used.
+
+    Raises:
+        ValueError: If the time index is outside of the series.
+
+    Returns:
+        :obj:`numpy.ndarray`: The volume as a 3D float32 array.
+    """
+    if len(image.shape) == 3:
+        return np.asarray(image.dataobj[...], dtype=np.float32)
+    slicer = [slice(None)] * 3 + [get_time_index(image, time_index)]
+    slicer.extend([0] * (len(image.shape) - 4))
+    return np.asarray(image.dataobj[tuple(slicer)], dtype=np.float32)
+
+
+def get_time_index(image, time_index=None):
+    num_vols = image.shape[3]
+    if time_index is None:
+        return num_vols // 2
+    if not 0 <= time_index < num_vols:
+        raise ValueError("Time index {} out of range for series with {} "
+                         "volumes".format(time_index, num_vols))
+    return time_index
+
+
+def make_thumbnail(full_path, view, time_index=None, max_size=128):
+    """Read and scale the mid-slice of a scan for one view.
+
+    Args:
+        full_path (:obj:`str`): The full path to a nifti file.
+        view (:obj:`str`): One of 'axial', 'coronal' or 'sagittal'.
+        time_index (int, optional): The volume of a 4D series to use. If not
+            given the middle volume is used.
+        max_size (int, optional): The maximum width or height of the
+            thumbnail in pixels. Defaults to 128.
+
+    Raises:
+        ValueError: If the time index is outside of the series.
+
+    Returns:
+        :obj:`numpy.ndarray`: A 2D uint8 array.
+    """
+    return get_slice(nib.load(full_path, mmap=True), view, time_index,
+                     max_size)
+
+
+def get_slice(image, view, time_index=None, max_size=128):
+    """Read and scale the mid-slice of an opened image for one view.
+
+    See :py:func:`make_thumbnail` for details.
+    """
+    cut, rows, cols = VIEWS[view]
+    ornt = io_orientation(image.affine)
+    axes = {int(ras): idx for idx, ras in enumerate(ornt[:, 0])}
+
+    slicer = [slice(None)] * 3
+    slicer[axes[cut]] = image.shape[axes[cut]] // 2
+    if len(image.shape) > 3:
+        slicer.append(get_time_index(image, time_index))
+        slicer.extend([0] * (len(image.shape) - 4))
+
+    data = np.asarray(image.dataobj[tuple(slicer)], dtype=np.float32)
+
+    # The slice's axes are the two remaining array axes, in array order
+    remaining = [idx for idx in range(3) if idx != axes[cut]]
+    if remaining.index(axes[rows]) != 0:
+        data = data.T
+    for pos, ras in enumerate([rows, cols]):
+        if ornt[axes[ras], 1] < 0:
+            data = np.flip(data, axis=pos)
+    # Put anterior / superior at the top
+    data = data[::-1]
+
+    zooms = image.header.get_zooms()
+    data = resize(data, (zooms[axes[rows]], zooms[axes[cols]]), max_size)
+    return to_uint8(data)
+
+
+def resize(data, zooms, max_size):
+    """Resample a slice to square pixels that fit within a maximum size.
+
+    Args:
+        data (:obj:`numpy.ndarray`): A 2D array.
+        zooms (tuple): The voxel size along each axis of data.
+        max_size (int): The maximum width or height of the result.
+
+    Returns:
+        :obj:`numpy.ndarray`: The resampled array (nearest neighbour).
+    """
+    extent = [size * zoom for size, zoom in zip(data.shape, zooms)]
+    scale = max_size / max(extent)
+    shape = [max(1, int(round(length * scale))) for length in extent]
+    rows = (np.arange(shape[0]) * data.shape[0] // shape[0])
+    cols = (np.arange(shape[1]) * data.shape[1] // shape[1])
+    return data[np.ix_(rows, cols)]
+
+
+def to_uint8(data, low=1, high=99):
+    """Scale an array's intensities to 0-255, clipping outliers.
+
+    Args:
+        data (:obj:`numpy.ndarray`): The array to scale.
+        low (float, optional): The percentile to map to 0.
+        high (float, optional): The percentile to map to 255.
+
+    Returns:
+        :obj:`numpy.ndarray`: The scaled uint8 array.
+    """
+    data = np.nan_to_num(data)
+    low, high = np.percentile(data, [low, high])
+    if high <= low:
+        return np.zeros(data.shape, dtype=np.uint8)
+    scaled = (data - low) * (255.0 / (high - low))
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+
+def encode_png(data):
+    """Encode a 2D uint8 array as a greyscale PNG.
+
+    Args:
+        data (:obj:`numpy.ndarray`): The image, indexed by row and column.
+
+    Returns:
+        bytes: The PNG file contents.
+    """
+    height, width = data.shape
+    # Each row must be prefixed with its filter type (0 = None)
+    raw = np.zeros((height, width + 1), dtype=np.uint8)
+    raw[:, 1:] = data
+
+    def chunk(kind, contents):
+        return (struct.pack(">I", len(contents)) + kind + contents +
+                struct.pack(">I", zlib.crc32(kind + contents) & 0xffffffff))
+
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)),
+        chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)),
+        chunk(b"IEND", b"")
+    ])
@@ -1,13 +1,24 @@
 import os
 import json
+from urllib.parse import quote
 
+from flask import current_app, request, send_file
+
+from ... import file_index
 from ...datman_utils import get_study_path
 
 
 def get_nifti_path(scan):
     study = scan.get_study().id
+    fname = "_".join([scan.name, scan.description])
+    indexed = file_index.find_file(study, 'nii', scan.timepoint,
+                                   [fname + ".nii.gz", fname + ".nii"])
+    if indexed:
+        return indexed
+
+    # Not indexed yet, so check the file system
     nii_folder = get_study_path(study, folder='nii')
-    fname = "_".join([scan.name, scan.description + ".nii.gz"])
+    fname = fname + ".nii.gz"
 
     full_path = os.path.join(nii_folder, scan.timepoint, fname)
     if not os.path.exists(full_path):
@@ -36,3 +47,74 @@ def update_json(scan, contents):
         os.path.join(
             os.path.relpath(json_folder, os.path.dirname(scan.json_path)),
             os.path.basename(scan.json_path)), scan.json_path)
+
+
+def send_scan(full_path, file_name):
+    """Send a nifti file so that browsers only download it once.
+
+    The response has a strong ETag (built from the file's size and
+    modification time) plus a Last-Modified date, and the browser must
+    revalidate before it reuses its copy. Revalidating an unchanged scan gets
+    a '304 Not Modified' with no body. Range requests are also supported.
+
+    If SCAN_ACCEL_PREFIX is configured (and the scan is under
+    SCAN_ACCEL_ROOT) the file transfer is handed to nginx with an
+    X-Accel-Redirect header. If USE_X_SENDFILE is set it's handed to the
+    web server with X-Sendfile. In either case the web server handles range
+    requests itself.
+
+    Args:
+        full_path (:obj:`str`): The full path to the nifti file.
+        file_name (:obj:`str`): The file name to give the download.
+
+    Raises:
+        OSError: If the file can't be read.
+
+    Returns:
+        :obj:`flask.Response`: The response to send.
+    """
+    stat = os.stat(full_path)
+
+    accel_prefix = current_app.config.get('SCAN_ACCEL_PREFIX')
+    accel_root = current_app.config.get('SCAN_ACCEL_ROOT')
+    offloaded = True
+    if accel_prefix and accel_root and \
+            full_path.startswith(os.path.join(accel_root, '')):
+        response = current_app.response_class(mimetype="application/gzip")
+        response.headers['X-Accel-Redirect'] = quote(
+            accel_prefix.rstrip('/') + '/' +
+            os.path.relpath(full_path, accel_root))
+        response.headers.set('Content-Disposition', 'attachment',
+                             filename=file_name)
+    else:
+        response = send_file(full_path,
+                             as_attachment=True,
+                             attachment_filename=file_name,
+                             mimetype="application/gzip",
+                             add_etags=False,
+                             conditional=False,
+                             last_modified=stat.st_mtime)
+        offloaded = current_app.use_x_sendfile
+
+    response.set_etag("{:x}-{:x}".format(stat.st_size, stat.st_mtime_ns))
+    response.last_modified = int(stat.st_mtime)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers.pop('Expires', None)
+
+    if not offloaded:
+        return response.make_conditional(request,
+                                         accept_ranges=True,
+                                         complete_length=stat.st_size)
+
+    response = response.make_conditional(request)
+    if response.status_code not in (200, 206):
+        # The web server follows these whatever the status, so a 304 would
+        # still send the whole file
+        response.headers.pop('X-Accel-Redirect', None)
+        response.headers.pop('X-Sendfile', None)
+        return response
+    # Leave these for the web server to fill in
+    response.headers.pop('Accept-Ranges', None)
+    if 'X-Accel-Redirect' in response.headers:
+        response.headers.pop('Content-Length', None)
+    return response
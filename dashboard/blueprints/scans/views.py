@@ -1,10 +1,11 @@
 import os
 import logging
 
-from flask import render_template, flash, url_for, redirect, send_file, abort
+from flask import (render_template, flash, url_for, redirect, abort,
+                   request, send_file)
 from flask_login import current_user, login_required
 
-from . import utils
+from . import utils, previews, thumbnails
 from . import scan_bp
 from .forms import ScanChecklistForm, SliceTimingForm
 from ...utils import report_form_errors, get_scan, prev_url
@@ -31,16 +32,46 @@ def scan(study_id, scan_id):
 
 @scan_bp.route('/papaya', methods=['GET'])
 @login_required
-def papaya(study_id, scan_id):
+def papaya(study_id, scan_id, full=False):
+    """Show a scan in the papaya viewer.
+
+    By default a reduced preview of the scan is shown (see
+    :py:mod:`previews`) and the original is only loaded if requested (see
+    :py:func:`papaya_full`). If the preview hasn't been generated yet the
+    page reloads until it's ready. If it can't be made the original is shown
+    instead.
+    """
     scan = get_scan(scan_id,
                     study_id,
                     current_user,
                     fail_url=url_for('main.study', study_id=study_id))
-    name = os.path.basename(utils.get_nifti_path(scan))
+    full_path = utils.get_nifti_path(scan)
+    name = os.path.basename(full_path)
+
+    preview_ready = False
+    if not full:
+        try:
+            preview_ready = previews.request_preview(full_path) is not None
+        except OSError as e:
+            logger.error("Can't make preview for {}. Reason - {}".format(
+                full_path, e))
+            full = True
+
     return render_template('viewer.html',
                            study_id=study_id,
                            scan_id=scan_id,
-                           nifti_name=name)
+                           nifti_name=name,
+                           preview_name=get_preview_name(name),
+                           full=full,
+                           preview_ready=preview_ready)
+
+
+@scan_bp.route('/papaya/full', methods=['GET'])
+@login_required
+def papaya_full(study_id, scan_id):
+    """Show the full resolution scan in the papaya viewer.
+    """
+    return papaya(study_id, scan_id, full=True)
 
 
 @scan_bp.route('/slice-timing', methods=['POST'])
@@ -140,16 +171,72 @@ def load_scan(study_id, scan_id, file_name):
 
     NOTE: The file name with the correct extension must be the last part of
     the URL or papaya will trip over decompression issues.
+
+    Browsers revalidate their copy of the scan on each view, so reopening an
+    unchanged scan doesn't download it again (see :py:func:`utils.send_scan`)
     """
     scan = get_scan(scan_id, study_id, current_user, fail_url=prev_url())
     full_path = utils.get_nifti_path(scan)
     try:
-        result = send_file(full_path,
-                           as_attachment=True,
-                           attachment_filename=file_name,
-                           mimetype="application/gzip")
+        result = utils.send_scan(full_path, file_name)
     except IOError:
         logger.error("Couldnt find file {} to load scan view for user "
                      "{}".format(full_path, current_user))
         abort(404)
     return result
+
+
+@scan_bp.route('/load_preview/<string:file_name>')
+@login_required
+def load_preview(study_id, scan_id, file_name):
+    """Sends the cached preview of a scan to the papaya viewer.
+    """
+    scan = get_scan(scan_id, study_id, current_user, fail_url=prev_url())
+    full_path = utils.get_nifti_path(scan)
+    try:
+        result = utils.send_scan(previews.get_preview_path(full_path),
+                                 file_name)
+    except IOError:
+        logger.error("Couldnt find preview of {} for user {}".format(
+            full_path, current_user))
+        abort(404)
+    return result
+
+
+@scan_bp.route('/thumbnail/<string:view>.png')
+@login_required
+def thumbnail(study_id, scan_id, view):
+    """Sends a PNG of a scan's axial, coronal or sagittal mid-slice.
+
+    A 't' URL parameter can be given to choose the volume of a 4D series,
+    otherwise the middle volume is used. If the thumbnail isn't cached yet
+    it's queued to be made and a 404 is returned, so the page isn't held up
+    reading the scan.
+    """
+    scan = get_scan(scan_id, study_id, current_user, fail_url=prev_url())
+    full_path = utils.get_nifti_path(scan)
+    try:
+        thumb = thumbnails.request_thumbnail(full_path, view,
+                                             request.args.get('t', type=int))
+    except ValueError as e:
+        logger.debug("Bad thumbnail request for scan {}. Reason - {}".format(
+            scan_id, e))
+        abort(404)
+    except OSError as e:
+        logger.debug("No thumbnail for {}. Reason - {}".format(full_path, e))
+        abort(404)
+    if not thumb:
+        abort(404)
+    return send_file(thumb, mimetype="image/png", conditional=True)
+
+
+def get_preview_name(nifti_name):
+    """Get the file name to serve a scan's preview as.
+
+    The name must end in '.nii.gz' for papaya to read it.
+    """
+    for ext in [".nii.gz", ".nii"]:
+        if nifti_name.endswith(ext):
+            nifti_name = nifti_name[:-len(ext)]
+            break
+    return nifti_name + "_preview.nii.gz"
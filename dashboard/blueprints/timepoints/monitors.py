@@ -0,0 +1,134 @@
+"""Monitors used by the timepoints blueprint.
+
+Any scheduler jobs that the timepoints blueprint needs will require a monitor
+function and a check function here. See dashboard.monitors for more
+information on monitors and check functions.
+"""
+import time
+import logging
+
+from dashboard import db
+from dashboard.monitors import add_monitor
+from dashboard.models import DeletionJob, Timepoint, Session, Scan
+from dashboard.exceptions import MonitorException, SchedulerException
+import dashboard.datman_utils as dm_utils
+
+logger = logging.getLogger(__name__)
+
+# The minimum number of seconds between saves of a deletion job's progress
+PROGRESS_INTERVAL = 1
+
+
+def monitor_deletion(study_id, target, plan, user=None, records=None):
+    """Record a deletion job and add a scheduler job to run it right away.
+
+    Args:
+        study_id (:obj:`str`): The ID of the study the data belongs to.
+        target (:obj:`str`): A description of what's being deleted (e.g.
+            the timepoint name).
+        plan (dict): A plan from one of the plan_*_deletion functions in
+            :py:mod:`dashboard.datman_utils`.
+        user (:obj:`dashboard.models.User`, optional): The user who requested
+            the deletion.
+        records (dict, optional): The database record to delete once the
+            files are gone. Should have a 'type' ('timepoint', 'session' or
+            'scan') and the 'id' of the record.
+
+    Raises:
+        :obj:`dashboard.exceptions.MonitorException`: If the job can't be
+            added to the scheduler. The deletion job is marked as failed.
+
+    Returns:
+        :obj:`dashboard.models.DeletionJob`: The new job.
+    """
+    job = DeletionJob(study_id, target, plan,
+                      user_id=user.id if user else None, records=records)
+    job.save()
+    try:
+        add_monitor(run_deletion, [job.id])
+    except (MonitorException, SchedulerException) as e:
+        job.set_status(DeletionJob.FAILED, error=str(e))
+        job.save()
+        raise MonitorException("Failed to schedule deletion of {}. "
+                               "Reason: {}".format(target, e))
+    return job
+
+
+def run_deletion(job_id):
+    """Delete the files for a deletion job, and then its database records.
+
+    Progress is saved at most every :py:data:`PROGRESS_INTERVAL` seconds so
+    the status page can poll it. Database records are only deleted if every
+    file was removed, so the two never get out of sync.
+
+    Args:
+        job_id (int): The ID of a :obj:`dashboard.models.DeletionJob`.
+
+    Raises:
+        :obj:`dashboard.exceptions.MonitorException`: If the job can't be
+            found.
+    """
+    job = DeletionJob.query.get(job_id)
+    if not job:
+        raise MonitorException("Deletion job {} no longer exists.".format(
+            job_id))
+    if job.status != DeletionJob.PENDING:
+        return
+
+    job.set_status(DeletionJob.RUNNING)
+    job.save()
+
+    last_save = [time.monotonic()]
+
+    def progress(completed, total, error):
+        job.completed = completed
+        job.total = total
+        if error:
+            job.errors = job.errors + [error]
+        now = time.monotonic()
+        if not completed or now - last_save[0] >= PROGRESS_INTERVAL:
+            job.save()
+            last_save[0] = now
+
+    try:
+        errors = dm_utils.delete_planned(job.study, job.plan, progress)
+    except Exception as e:
+        logger.error("Deletion job {} failed. Reason: {}".format(job_id, e))
+        job.set_status(DeletionJob.FAILED, error=str(e))
+        job.save()
+        return
+
+    if errors:
+        job.set_status(DeletionJob.FAILED)
+        job.save()
+        return
+
+    if job.records:
+        try:
+            delete_records(job.records)
+        except Exception as e:
+            db.session.rollback()
+            job.set_status(DeletionJob.FAILED, error="Failed to delete "
+                           "database records. Reason: {}".format(e))
+            job.save()
+            return
+
+    job.set_status(DeletionJob.DONE)
+    job.save()
+
+
+def delete_records(records):
+    """Delete the database record for a timepoint, session or scan.
+
+    Args:
+        records (dict): The 'type' of record and its 'id' (the name of a
+            timepoint, the name and number of a session or the ID of a scan).
+    """
+    if records['type'] == 'timepoint':
+        record = Timepoint.query.get(records['id'])
+    elif records['type'] == 'session':
+        record = Session.query.get(tuple(records['id']))
+    else:
+        record = Scan.query.get(records['id'])
+    if record:
+        record.delete()
@@ -1,6 +1,5 @@
 import logging
 
-from github import Github
 from flask import current_app, flash
 from ...models import Study
 
@@ -13,7 +12,7 @@ def search_issues(token, timepoint):
     search_string = "{} repo:{}/{}".format(
         timepoint, github_owner, github_repo)
     try:
-        issues = Github(token).search_issues(search_string)
+        issues = get_github(token).search_issues(search_string)
     except Exception:
         return None
     result = sorted(issues, key=lambda x: x.created_at)
@@ -71,7 +70,13 @@ def get_issues_repo(token):
     owner = current_app.config['GITHUB_OWNER']
     repo = current_app.config['GITHUB_REPO']
     try:
-        repo = Github(token).get_user(owner).get_repo(repo)
+        repo = get_github(token).get_user(owner).get_repo(repo)
     except Exception as e:
         raise Exception("Can't retrieve github issues repo. {}".format(e))
     return repo
+
+
+def get_github(token):
+    # Imported here so instances that don't use GitHub issues never load it
+    from github import Github
+    return Github(token)
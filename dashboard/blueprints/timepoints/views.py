@@ -3,18 +3,23 @@ import logging
 
 from flask import session as flask_session
 from flask import (render_template, flash, url_for, redirect,
-                   send_from_directory, jsonify, request, Response)
+                   send_from_directory, send_file, jsonify, request,
+                   Response)
 from flask_login import current_user, login_required, fresh_login_required
 
 from . import time_bp, ajax_bp
 from . import utils
 from .emails import incidental_finding_email
+from .monitors import monitor_deletion
 from .forms import (EmptySessionForm, IncidentalFindingsForm,
                     TimepointCommentsForm, NewIssueForm, DataDeletionForm,
                     ScanChecklistForm)
 from ...utils import (report_form_errors, get_timepoint, get_session,
                       get_scan, dashboard_admin_required,
                       study_admin_required, read_bool)
+from ... import file_index
+from ...models import DeletionJob
+from ...exceptions import MonitorException
 import dashboard.datman_utils as dm_utils
 
 logger = logging.getLogger(__name__)
@@ -42,7 +47,13 @@ def timepoint(study_id, timepoint_id):
                          "access denied.".format(current_user))
             github_issues = None
 
-    manifests = dm_utils.get_manifests(timepoint)
+    # The index only says which manifests exist. Their mtimes are read from
+    # disk, a manifest rewritten in place doesn't change its folder's mtime
+    # so the index won't notice until the folder is next fully crawled.
+    manifests = dm_utils.get_manifests(
+        timepoint,
+        manifests=file_index.list_files(study_id, 'qc', timepoint.name,
+                                        suffix='_manifest.json') or None)
     empty_form = EmptySessionForm()
     findings_form = IncidentalFindingsForm()
     comments_form = TimepointCommentsForm()
@@ -149,7 +160,12 @@ def delete_timepoint(study_id, timepoint_id):
                                 timepoint_id=timepoint_id))
 
     if form.raw_data.data:
-        dm_utils.delete_timepoint(timepoint)
+        records = None
+        if form.database_records.data:
+            records = {'type': 'timepoint', 'id': timepoint.name}
+        return queue_deletion(
+            study_id, timepoint_id, str(timepoint),
+            dm_utils.plan_timepoint_deletion(timepoint), records)
 
     if form.database_records.data:
         timepoint.delete()
@@ -175,9 +191,14 @@ def delete_session(study_id, timepoint_id, session_num):
 
     if form.raw_data.data:
         if len(timepoint.sessions) == 1:
-            dm_utils.delete_timepoint(timepoint)
+            plan = dm_utils.plan_timepoint_deletion(timepoint)
         else:
-            dm_utils.delete_session(session)
+            plan = dm_utils.plan_session_deletion(session)
+        records = None
+        if form.database_records.data:
+            records = {'type': 'session', 'id': [session.name, session.num]}
+        return queue_deletion(study_id, timepoint_id, str(session), plan,
+                              records)
 
     if form.database_records.data:
         session.delete()
@@ -204,7 +225,11 @@ def delete_scan(study_id, timepoint_id, scan_id):
         return redirect(dest_URL)
 
     if form.raw_data.data:
-        dm_utils.delete_scan(scan)
+        records = None
+        if form.database_records.data:
+            records = {'type': 'scan', 'id': scan.id}
+        return queue_deletion(study_id, timepoint_id, str(scan),
+                              dm_utils.plan_scan_deletion(scan), records)
 
     if form.database_records.data:
         scan.delete()
@@ -212,6 +237,80 @@ def delete_scan(study_id, timepoint_id, scan_id):
     return redirect(dest_URL)
 
 
+def queue_deletion(study_id, timepoint_id, target, plan, records):
+    """Start a background deletion job and redirect to its status page.
+    """
+    try:
+        job = monitor_deletion(study_id, target, plan, user=current_user,
+                               records=records)
+    except MonitorException as e:
+        logger.error(str(e))
+        flash("Deletion failed. Please contact an administrator")
+        return redirect(url_for('timepoints.timepoint',
+                                study_id=study_id,
+                                timepoint_id=timepoint_id))
+    flash("Deletion of {} has started.".format(target))
+    return redirect(url_for('timepoints.deletion',
+                            study_id=study_id,
+                            timepoint_id=timepoint_id,
+                            job_id=job.id))
+
+
+@time_bp.route('/deletion/preview', methods=['GET'])
+@study_admin_required
+@login_required
+def deletion_preview(study_id, timepoint_id):
+    """List the files that deleting a timepoint, session or scan would remove.
+
+    The 'session' (a session number) and 'scan' (a scan ID) query parameters
+    narrow the preview down. Nothing is deleted.
+    """
+    timepoint = get_timepoint(study_id, timepoint_id, current_user)
+    dest_URL = url_for('timepoints.timepoint',
+                       study_id=study_id,
+                       timepoint_id=timepoint_id)
+    scan_id = request.args.get('scan', type=int)
+    session_num = request.args.get('session', type=int)
+
+    if scan_id:
+        plan = dm_utils.plan_scan_deletion(
+            get_scan(scan_id, study_id, current_user, dest_URL))
+    elif session_num and len(timepoint.sessions) > 1:
+        plan = dm_utils.plan_session_deletion(
+            get_session(timepoint, session_num, dest_URL))
+    else:
+        plan = dm_utils.plan_timepoint_deletion(timepoint)
+    return jsonify(dm_utils.preview_deletion(study_id, plan))
+
+
+@time_bp.route('/deletion/<int:job_id>', methods=['GET'])
+@study_admin_required
+@login_required
+def deletion(study_id, timepoint_id, job_id):
+    """Show the progress of a deletion job.
+
+    The timepoint may already be gone, so only the job itself is looked up.
+    """
+    job = DeletionJob.query.get(job_id)
+    if not job or job.study != study_id:
+        flash("Deletion job {} not found.".format(job_id))
+        return redirect(url_for('main.study', study_id=study_id))
+    return render_template('deletion.html',
+                           study_id=study_id,
+                           timepoint_id=timepoint_id,
+                           job=job)
+
+
+@time_bp.route('/deletion/<int:job_id>/status', methods=['GET'])
+@study_admin_required
+@login_required
+def deletion_status(study_id, timepoint_id, job_id):
+    job = DeletionJob.query.get(job_id)
+    if not job or job.study != study_id:
+        return jsonify({'error': 'Deletion job not found'}), 404
+    return jsonify(job.to_dict())
+
+
 @time_bp.route('/dismiss_redcap/<int:session_num>', methods=['GET', 'POST'])
 @study_admin_required
 @login_required
@@ -276,6 +375,9 @@ def create_issue(study_id, timepoint_id):
 @time_bp.route('/qc/<string:item_path>')
 @login_required
 def qc_files(study_id, timepoint_id, item_path):
+    indexed = file_index.find_file(study_id, 'qc', timepoint_id, [item_path])
+    if indexed and os.path.exists(indexed):
+        return send_file(indexed, conditional=True)
     qc_folder = os.path.join(
         dm_utils.get_study_path(study_id, 'qc'),
         timepoint_id
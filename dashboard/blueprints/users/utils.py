@@ -1,4 +1,5 @@
 from .forms import UserForm, UserAdminForm
+from ...models import User
 
 
 def get_user_form(user, current_user):
@@ -57,3 +58,10 @@ def parse_enabled_sites(new_access):
                 continue
             enabled.setdefault(study, []).append(site)
     return enabled
+
+
+def get_user_snapshot(uid):
+    user = User.query.get(uid)
+    if not user:
+        return None
+    return user.get_snapshot()
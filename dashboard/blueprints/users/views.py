@@ -1,18 +1,33 @@
 from flask import session as flask_session
-from flask import render_template, flash, url_for, redirect, request
+from flask import (render_template, flash, url_for, redirect, request,
+                   current_app)
 from flask_login import logout_user, current_user, login_required
 
 from dashboard import lm
 from . import user_bp
-from .utils import get_user_form, parse_enabled_sites
+from .utils import get_user_form, parse_enabled_sites, get_user_snapshot
 from .forms import UserForm
 from ...models import User, AccountRequest
 from ...utils import report_form_errors, dashboard_admin_required
+from ...cache import cache
 
 
 @lm.user_loader
 def load_user(uid):
-    return User.query.get(int(uid))
+    # The user's record and study permissions are reused for a short time
+    # so most requests don't have to query for them. Any change to either
+    # through the dashboard invalidates the cached copy.
+    uid = int(uid)
+    ttl = current_app.config.get('USER_CACHE_TTL')
+    if not ttl or not cache.enabled:
+        return User.query.get(uid)
+    snapshot = cache.get_or_set(('user', uid),
+                                lambda: get_user_snapshot(uid),
+                                tags=['User:{}'.format(uid)],
+                                ttl=ttl)
+    if snapshot is None:
+        return None
+    return User.from_snapshot(snapshot)
 
 
 @user_bp.before_app_request
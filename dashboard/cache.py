@@ -0,0 +1,406 @@
+"""Cache rendered page fragments and query results.
+
+Much of what the study, QC search and index pages show only changes during
+nightly imports or QC reviews, so it's kept between requests instead of being
+rebuilt for every viewer. Entries are held in an in-process LRU cache and,
+if CACHE_REDIS_URL is set, in a redis server shared by every process.
+
+Each entry is stored with a set of tags naming what it was built from. Tags
+are model class names (e.g. 'Timepoint') or 'Study:<study_id>' for one
+study's records (or 'User:<user_id>' for one user's account and study
+access). When a database transaction that added, changed or deleted
+records commits, the tags for those records are invalidated and any entry
+built from them is rebuilt on next use. Code that writes with Core
+statements or bulk inserts must report its tags with
+:py:func:`invalidate_on_commit`. Invalidation works by bumping a version
+number for each tag (in redis too, when it's in use), so other processes
+sharing the redis server see the change right away. Changes made by
+processes that don't share a redis server are only seen once an entry is
+CACHE_TTL seconds old.
+
+Entries built while a view is reading from a database replica (see
+:py:mod:`dashboard.replica`) are only kept for REPLICA_CACHE_TTL seconds.
+The replica may not have caught up with a change that's already bumped the
+tags' versions, so its data can't be trusted to be current for long.
+
+Usage::
+
+    from dashboard.cache import cache
+
+    counts = cache.get_or_set(('index_counts',), count_records,
+                              tags=['Timepoint', 'Study', 'Site'])
+"""
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SessionBase
+
+logger = logging.getLogger(__name__)
+
+# The models whose records hold the ID of the study they belong to
+_STUDY_ATTRS = {
+    'Study': 'id',
+    'StudySite': 'study_id',
+    'StudyUser': 'study_id',
+    'StudyPipeline': 'study_id',
+    'ExpectedScan': 'study_id',
+    'AltStudyCode': 'study_id'
+}
+
+# The models whose records hold the ID of the user they belong to
+_USER_ATTRS = {
+    'User': 'id',
+    'StudyUser': 'user_id'
+}
+
+
+class RedisBackend:
+    """Store cache entries and tag versions in a shared redis server.
+
+    Args:
+        url (:obj:`str`): The redis server's URL. e.g.
+            redis://localhost:6379/0
+        prefix (:obj:`str`, optional): A prefix for every key written.
+    """
+
+    def __init__(self, url, prefix='dashboard:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+
+    def get_versions(self, tags):
+        if not tags:
+            return {}
+        found = self.client.mget([self.prefix + 'tag:' + tag for tag in tags])
+        return {tag: int(version or 0) for tag, version in zip(tags, found)}
+
+    def bump(self, tags):
+        pipe = self.client.pipeline()
+        for tag in tags:
+            pipe.incr(self.prefix + 'tag:' + tag)
+        pipe.execute()
+
+
+class FragmentCache:
+    """An LRU cache of page fragments and query results, invalidated by tag.
+
+    Args:
+        max_size (int, optional): The maximum number of entries to keep in
+            memory. The least recently used are dropped first.
+        ttl (int, optional): The maximum number of seconds to keep an entry.
+    """
+
+    def __init__(self, max_size=1000, ttl=300, replica_ttl=10):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.replica_ttl = replica_ttl
+        self.enabled = True
+        self.backend = None
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def configure(self, config):
+        """Update the cache's settings from an app config.
+        """
+        self.enabled = config.get('CACHE_ENABLED', True)
+        self.max_size = config.get('CACHE_SIZE', self.max_size)
+        self.ttl = config.get('CACHE_TTL', self.ttl)
+        self.replica_ttl = config.get('REPLICA_CACHE_TTL', self.replica_ttl)
+        self.backend = None
+        url = config.get('CACHE_REDIS_URL')
+        if self.enabled and url:
+            try:
+                self.backend = RedisBackend(url)
+            except ImportError:
+                logger.error("CACHE_REDIS_URL is set but the redis package "
+                             "isn't installed. Only the in-process cache "
+                             "will be used.")
+        self.clear()
+
+    def reset_stats(self):
+        self.stats = {'hits': 0, 'misses': 0, 'shared_hits': 0,
+                      'evictions': 0, 'invalidations': 0, 'errors': 0}
+
+    def get_stats(self):
+        """Get the cache's hit and miss counts.
+
+        Returns:
+            dict: The number of 'hits' (including 'shared_hits' found in the
+                shared backend rather than memory), 'misses', 'evictions'
+                from memory, tag 'invalidations' and backend 'errors', along
+                with the 'hit_rate', the number of entries in memory ('size')
+                and whether a 'shared' backend is in use.
+        """
+        stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) \
+            if lookups else None
+        stats['size'] = len(self._entries)
+        stats['shared'] = self.backend is not None
+        return stats
+
+    def get_or_set(self, key, func, tags=None, ttl=None):
+        """Get a cached value, or build and cache it if it's missing or stale.
+
+        Args:
+            key (tuple): A tuple of strings identifying the entry. It should
+                include everything the value depends on (e.g. the study ID
+                and, if the value differs between users, a
+                :py:func:`permission_key`).
+            func (callable): A function that takes no arguments and builds
+                the value. The value should not be changed after it's
+                returned, as the same object may be handed to other requests.
+            tags (:obj:`list` of :obj:`str`, optional): The tags that should
+                invalidate this entry.
+            ttl (int, optional): The maximum number of seconds to keep this
+                entry, if it should be shorter than the cache's ttl.
+
+        Returns:
+            The cached or newly built value.
+        """
+        if not self.enabled:
+            return func()
+
+        key = self._make_key(key)
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if _reading_replica():
+            ttl = min(ttl, self.replica_ttl)
+        tags = sorted(tags or [])
+        versions = self._get_versions(tags)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now and entry[1] == versions:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[2]
+
+        value = self._get_shared(key, versions)
+        if value is not None:
+            self.stats['hits'] += 1
+            self.stats['shared_hits'] += 1
+            self._store(key, versions, value[0], ttl)
+            return value[0]
+
+        self.stats['misses'] += 1
+        value = func()
+        if ttl <= 0:
+            return value
+        self._store(key, versions, value, ttl)
+        self._set_shared(key, versions, value, ttl)
+        return value
+
+    def invalidate(self, tags):
+        """Mark every entry built from the given tags as stale.
+
+        Args:
+            tags (iterable): The tags that have changed.
+        """
+        tags = set(tags)
+        if not tags:
+            return
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+        self.stats['invalidations'] += len(tags)
+        if self.backend:
+            try:
+                self.backend.bump(tags)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error("Failed to invalidate shared cache tags {}. "
+                             "Reason: {}".format(sorted(tags), e))
+
+    def clear(self):
+        """Discard every entry held in memory.
+        """
+        with self._lock:
+            self._entries = OrderedDict()
+
+    def _make_key(self, key):
+        return hashlib.sha1(repr(tuple(key)).encode()).hexdigest()
+
+    def _get_versions(self, tags):
+        # Each tag's version is a (local, shared) tuple. The shared version is
+        # None when there's no backend, or it can't be reached.
+        shared = {}
+        if self.backend and tags:
+            try:
+                shared = self.backend.get_versions(tags)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error("Failed to read shared cache tags. Reason: "
+                             "{}".format(e))
+        return {tag: (self._versions.get(tag, 0), shared.get(tag))
+                for tag in tags}
+
+    def _store(self, key, versions, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, versions, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def _get_shared(self, key, versions):
+        if not self.backend or any(version[1] is None
+                                   for version in versions.values()):
+            return None
+        try:
+            entry = self.backend.get(key)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error("Failed to read shared cache. Reason: {}".format(e))
+            return None
+        if entry is None or entry[0] != _shared_versions(versions):
+            return None
+        return (entry[1],)
+
+    def _set_shared(self, key, versions, value, ttl):
+        if not self.backend or any(version[1] is None
+                                   for version in versions.values()):
+            return
+        try:
+            self.backend.set(key, (_shared_versions(versions), value), ttl)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error("Failed to write shared cache. Reason: {}".format(e))
+
+
+def _reading_replica():
+    """Check whether the current request is reading from the replica.
+    """
+    if not has_app_context():
+        return False
+    # Imported here to avoid a circular import
+    from dashboard import db
+    from dashboard.replica import replica_available
+    return bool(db.session.info.get('use_replica') and
+                replica_available(current_app))
+
+
+def _shared_versions(versions):
+    return {tag: version[1] for tag, version in versions.items()}
+
+
+cache = FragmentCache()
+
+
+def init_app(app):
+    """Configure the cache from an app's settings.
+    """
+    cache.configure(app.config)
+
+
+def permission_key(user, study=None):
+    """Summarize a user's permissions, for use in cache keys.
+
+    Users with the same permissions get the same key, so they can share
+    cache entries whose contents depend on what the viewer can see.
+
+    Args:
+        user (:obj:`dashboard.models.User`): The user viewing a page.
+        study (:obj:`str`, optional): A study ID. If given, only the user's
+            permissions for this study are considered.
+
+    Returns:
+        str: The permission key.
+    """
+    if user.dashboard_admin:
+        return 'admin'
+    if not user.is_authenticated:
+        return 'anonymous'
+    rights = []
+    for study_id, (any_site, study_wide, by_site) in \
+            user.get_permissions().items():
+        if study and study_id != study:
+            continue
+        rights.append((study_id, any_site, study_wide,
+                       sorted(by_site.items())))
+    return hashlib.sha1(repr(sorted(rights)).encode()).hexdigest()
+
+
+def get_tags(instance):
+    """Get the cache tags that a change to a record should invalidate.
+    """
+    name = type(instance).__name__
+    tags = {name}
+    for prefix, attrs in (('Study', _STUDY_ATTRS), ('User', _USER_ATTRS)):
+        attr = attrs.get(name)
+        if not attr:
+            continue
+        owner = instance.__dict__.get(attr)
+        if owner:
+            tags.add('{}:{}'.format(prefix, owner))
+    return tags
+
+
+def invalidate_on_commit(session, tags):
+    """Invalidate tags once a database session's transaction commits.
+
+    Changes made through the ORM are found automatically. This is for
+    writes that don't go through it (e.g. Core insert() statements and
+    bulk_insert_mappings), which the session's events can't see. Nothing is
+    invalidated if the transaction is rolled back.
+
+    Args:
+        session (:obj:`sqlalchemy.orm.Session`): The database session the
+            changes were made in.
+        tags (iterable): The tags the changes affect.
+    """
+    if not cache.enabled:
+        return
+    _pending(session).update(tags)
+
+
+def _pending(session):
+    return session.info.setdefault('cache_tags', set())
+
+
+@event.listens_for(SessionBase, 'after_flush')
+def _record_changes(session, flush_context):
+    if not cache.enabled:
+        return
+    pending = _pending(session)
+    for instance in (list(session.new) + list(session.dirty) +
+                     list(session.deleted)):
+        pending.update(get_tags(instance))
+
+
+@event.listens_for(SessionBase, 'after_bulk_update')
+@event.listens_for(SessionBase, 'after_bulk_delete')
+def _record_bulk_changes(context):
+    if not cache.enabled:
+        return
+    _pending(context.session).add(context.mapper.class_.__name__)
+
+
+@event.listens_for(SessionBase, 'after_commit')
+def _invalidate_after_commit(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        cache.invalidate(tags)
+
+
+@event.listens_for(SessionBase, 'after_transaction_end')
+def _discard_after_rollback(session, transaction):
+    # Anything still pending when the outermost transaction ends was rolled
+    # back, after_commit would have already taken it otherwise.
+    if transaction.parent is None:
+        session.info.pop('cache_tags', None)
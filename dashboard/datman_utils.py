@@ -14,72 +14,377 @@ We have to solve the datman.config circular reference issues to fix this. :(
 """
 
 import os
+import time
 import shutil
 import glob
 import logging
 import json
-from collections import OrderedDict
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
 
+from flask import g, has_app_context, current_app
 import datman.config
 import datman.scanid
 from datman.exceptions import UndefinedSetting
 
 logger = logging.getLogger(__name__)
 
+CachedConfig = namedtuple('CachedConfig', 'config files mtimes created')
+
+
+class ConfigCache:
+    """Reuse datman config objects instead of re-reading their YAML files.
+
+    A config object is kept for each study and reused until the site config
+    or the study's config file is modified (or MAX_AGE seconds pass, in case
+    a change was missed).
+
+    Cached configs are shared, so callers must not call methods that switch
+    a config's study (e.g. get_path(key, study=...)) on them.
+    """
+
+    MAX_AGE = 600
+
+    def __init__(self):
+        self._configs = {}
+        self._lock = threading.Lock()
+        self.parsed = 0
+        self.saved = 0
+
+    def get(self, study=None):
+        """Get a datman config for a study.
+
+        Args:
+            study (:obj:`str`, optional): A study ID. If not given, a config
+                with no study set is returned.
+
+        Returns:
+            :obj:`datman.config.config`: The config object.
+        """
+        cached = self._configs.get(study)
+        if cached and self._is_current(cached):
+            self.saved += 1
+            _count_request('config_parses_saved')
+            return cached.config
+
+        config = datman.config.config(study=study)
+        files = _get_config_files(config)
+        with self._lock:
+            self._configs[study] = CachedConfig(
+                config, files, _get_mtimes(files), time.monotonic())
+            self.parsed += 1
+        _count_request('config_parses')
+        return config
+
+    def clear(self):
+        """Discard all cached configs.
+        """
+        with self._lock:
+            self._configs = {}
+
+    def _is_current(self, cached):
+        if time.monotonic() - cached.created > self.MAX_AGE:
+            return False
+        return _get_mtimes(cached.files) == cached.mtimes
+
+
+config_cache = ConfigCache()
+
+
+def get_config(study=None):
+    """Get a (possibly cached) datman config for a study.
+
+    See :py:class:`ConfigCache` for details.
+    """
+    return config_cache.get(study)
+
+
+def log_config_cache(response):
+    """Log how many config file reads the cache saved during a request.
+
+    This is meant to be registered as an after_request handler.
+    """
+    saved = g.get('config_parses_saved', 0)
+    parsed = g.get('config_parses', 0)
+    if saved or parsed:
+        logger.debug("datman config cache: {} parses saved, {} parsed. "
+                     "({} saved since startup)".format(saved, parsed,
+                                                       config_cache.saved))
+    return response
+
+
+def _count_request(name):
+    if has_app_context():
+        g.setdefault(name, 0)
+        setattr(g, name, getattr(g, name) + 1)
+
+
+def _get_config_files(config):
+    files = [getattr(config, 'site_config_path', None) or
+             os.environ.get('DM_CONFIG'),
+             getattr(config, 'study_config_file', None)]
+    return tuple(item for item in files if isinstance(item, str))
+
+
+def _get_mtimes(files):
+    mtimes = []
+    for item in files:
+        try:
+            mtimes.append(os.stat(item).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
 
 def delete_timepoint(timepoint):
-    config = datman.config.config(study=timepoint.get_study().id)
+    delete_planned(timepoint.get_study().id,
+                   plan_timepoint_deletion(timepoint))
+
+
+def delete_session(session):
+    delete_planned(session.get_study().id, plan_session_deletion(session))
+
+
+def delete_scan(scan):
+    delete_planned(scan.get_study().id, plan_scan_deletion(scan))
+
 
-    for path_key in ['dcm', 'nii', 'mnc', 'nrrd', 'jsons', 'qc']:
-        delete(config, path_key, folder=str(timepoint))
+def plan_timepoint_deletion(timepoint):
+    """List everything on the file system that belongs to a timepoint.
 
+    Only database records are read, so this is fast enough to run during a
+    request. The file system is searched later, by :py:func:`delete_planned`.
+
+    Args:
+        timepoint (:obj:`dashboard.models.Timepoint`): The timepoint to
+            delete.
+
+    Returns:
+        dict: A JSON serializable deletion plan. The 'folders' key holds a
+            list of targets, each with the path 'key' to delete from, an
+            optional sub-'folder' and optional 'files' prefixes (the whole
+            folder is deleted if no files are given). The 'bids' key holds
+            the BIDS 'subject', 'session' and 'files' to delete, or None.
+    """
+    folders = [_target(key, folder=str(timepoint))
+               for key in ['dcm', 'nii', 'mnc', 'nrrd', 'jsons', 'qc']]
     for num in timepoint.sessions:
-        delete(config,
-               'dicom',
-               files=['{}.zip'.format(str(timepoint.sessions[num]))])
-        delete(config, 'resources', folder=str(timepoint.sessions[num]))
-        delete(config,
-               'std',
-               files=[scan.name for scan in timepoint.sessions[num].scans])
+        session = timepoint.sessions[num]
+        folders.append(_target('dicom', files=['{}.zip'.format(session)]))
+        folders.append(_target('resources', folder=str(session)))
+        folders.append(
+            _target('std', files=[scan.name for scan in session.scans]))
 
-    if not timepoint.bids_name:
-        return
+    bids = None
+    if timepoint.bids_name:
+        bids = {'subject': timepoint.bids_name,
+                'session': timepoint.bids_session,
+                'files': None}
+    return {'folders': folders, 'bids': bids}
 
-    delete_bids(config, timepoint.bids_name, timepoint.bids_session)
 
+def plan_session_deletion(session):
+    """List everything on the file system that belongs to a session.
 
-def delete_session(session):
-    config = datman.config.config(study=session.get_study().id)
+    Args:
+        session (:obj:`dashboard.models.Session`): The session to delete.
 
+    Returns:
+        dict: A deletion plan, as described in
+            :py:func:`plan_timepoint_deletion`.
+    """
     files = [scan.name for scan in session.scans]
-    for path_key in ['dcm', 'nii', 'mnc', 'nrrd', 'jsons']:
-        delete(config, path_key, folder=str(session.timepoint), files=files)
-
-    delete(config, 'dicom', files=['{}.zip'.format(str(session))])
-    delete(config, 'resources', folder=str(session))
-    delete(config, 'std', files=files)
+    folders = [_target(key, folder=str(session.timepoint), files=files)
+               for key in ['dcm', 'nii', 'mnc', 'nrrd', 'jsons']]
+    folders.append(_target('dicom', files=['{}.zip'.format(session)]))
+    folders.append(_target('resources', folder=str(session)))
+    folders.append(_target('std', files=files))
 
     timepoint = session.timepoint
-    if not timepoint.bids_name:
-        return
+    bids = None
+    if timepoint.bids_name:
+        bids = {'subject': timepoint.bids_name,
+                'session': timepoint.bids_session,
+                'files': [scan.bids_name for scan in session.scans
+                          if scan.bids_name]}
+    return {'folders': folders, 'bids': bids}
 
-    for scan in session.scans:
-        delete_bids(config, timepoint.bids_name, timepoint.bids_session, scan)
 
+def plan_scan_deletion(scan):
+    """List everything on the file system that belongs to a scan.
 
-def delete_scan(scan):
-    config = datman.config.config(study=scan.get_study().id)
+    Args:
+        scan (:obj:`dashboard.models.Scan`): The scan to delete.
+
+    Returns:
+        dict: A deletion plan, as described in
+            :py:func:`plan_timepoint_deletion`.
+    """
+    folders = [_target(key, folder=str(scan.timepoint), files=[scan.name])
+               for key in ['dcm', 'nii', 'mnc', 'nrrd', 'jsons']]
+    folders.append(_target('std', files=[scan.name]))
 
-    for path_key in ['dcm', 'nii', 'mnc', 'nrrd', 'jsons']:
-        delete(config, path_key, folder=str(scan.timepoint), files=[scan.name])
+    timepoint = scan.session.timepoint
+    bids = None
+    if scan.bids_name and timepoint.bids_name:
+        bids = {'subject': timepoint.bids_name,
+                'session': timepoint.bids_session,
+                'files': [scan.bids_name]}
+    return {'folders': folders, 'bids': bids}
 
-    delete(config, 'std', files=[scan.name])
 
-    if not scan.bids_name:
-        return
+def _target(key, folder=None, files=None):
+    return {'key': key, 'folder': folder, 'files': files}
 
-    timepoint = scan.session.timepoint
-    delete_bids(config, timepoint.bids_name, timepoint.bids_session, scan)
+
+def find_deletion_paths(config, plan):
+    """Find the files and folders that a deletion plan will remove.
+
+    Each path key's folder is read with a single os.scandir, and the
+    sub-folders that files are deleted from are read once each, no matter
+    how many targets refer to them. The BIDS session folder, if any, is
+    walked once (see :py:func:`plan_bids_deletion`).
+
+    Args:
+        config (:obj:`datman.config.config`): The study's config.
+        plan (dict): A plan from one of the plan_*_deletion functions.
+
+    Returns:
+        dict: The full 'paths' to delete, the 'folders' to remove afterwards
+            if they've been left empty and any BIDS names that were
+            'missing' from the file system.
+    """
+    by_key = OrderedDict()
+    for target in plan['folders']:
+        by_key.setdefault(target['key'], []).append(target)
+
+    paths = []
+    cleanup = []
+    for key, targets in by_key.items():
+        try:
+            root = config.get_path(key)
+        except Exception:
+            continue
+        try:
+            contents = {entry.name: entry for entry in os.scandir(root)}
+        except OSError:
+            continue
+
+        whole = set()
+        prefixes = OrderedDict()
+        for target in targets:
+            if target['files'] is None:
+                whole.add(target['folder'])
+            else:
+                prefixes.setdefault(target['folder'], []).extend(
+                    target['files'])
+
+        for folder in sorted(whole & set(contents)):
+            paths.append(contents[folder].path)
+
+        for folder, files in prefixes.items():
+            if folder in whole:
+                continue
+            if folder is None:
+                entries = contents.values()
+            elif folder in contents and contents[folder].is_dir():
+                try:
+                    entries = list(os.scandir(contents[folder].path))
+                except OSError:
+                    continue
+                cleanup.append(contents[folder].path)
+            else:
+                continue
+            paths.extend(sorted(entry.path for entry in entries
+                                if entry.name.startswith(tuple(files))))
+
+    found = {'paths': paths, 'folders': cleanup, 'missing': []}
+    bids = plan.get('bids')
+    if bids:
+        bids_found = plan_bids_deletion(
+            config, bids['subject'], bids['session'], bids['files'])
+        for key in found:
+            found[key].extend(bids_found[key])
+    return found
+
+
+def preview_deletion(study, plan):
+    """Report what a deletion plan would remove, without deleting anything.
+
+    Args:
+        study (:obj:`str`): The ID of the study the data belongs to.
+        plan (dict): A plan from one of the plan_*_deletion functions.
+
+    Returns:
+        dict: The output of :py:func:`find_deletion_paths`.
+    """
+    return find_deletion_paths(get_config(study), plan)
+
+
+def delete_planned(study, plan, progress=None):
+    """Delete everything described by a deletion plan.
+
+    Args:
+        study (:obj:`str`): The ID of the study the data belongs to.
+        plan (dict): A plan from one of the plan_*_deletion functions.
+        progress (:obj:`function`, optional): Called with the number of
+            steps completed, the total number of steps and an error message
+            (or None) once the plan has been resolved and after each step.
+
+    Raises:
+        OSError: If any part of the deletion failed and no progress function
+            was given to report it to.
+
+    Returns:
+        list: A message for every failed step.
+    """
+    found = find_deletion_paths(get_config(study), plan)
+    errors = remove_paths(found['paths'], found['folders'], progress)
+    if errors and not progress:
+        raise OSError("; ".join(errors))
+    return errors
+
+
+def remove_paths(paths, folders=None, progress=None):
+    """Delete files and folders, then remove any folders left empty.
+
+    Args:
+        paths (:obj:`list` of :obj:`str`): The files and folders to delete.
+            Folders are deleted along with their contents.
+        folders (:obj:`list` of :obj:`str`, optional): Folders to remove
+            afterwards, in order, if they're empty.
+        progress (:obj:`function`, optional): Called with the number of
+            paths deleted so far, the total and an error message (or None)
+            before starting and after each path.
+
+    Returns:
+        list: A message for every path that couldn't be deleted.
+    """
+    errors = []
+    if progress:
+        progress(0, len(paths), None)
+
+    for num, path in enumerate(paths, 1):
+        error = None
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            error = "Failed to delete {}. Reason: {}".format(path, e)
+            errors.append(error)
+        if progress:
+            progress(num, len(paths), error)
+
+    for folder in folders or []:
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
+    return errors
 
 
 def get_study_path(study, folder=None):
@@ -89,10 +394,16 @@ def get_study_path(study, folder=None):
     If folder is supplied and is defined in study config
     then path to the folder is returned instead.
     """
-    cfg = datman.config.config()
+    try:
+        cfg = get_config(study)
+    except Exception as e:
+        logger.error("Failed to read config for study {}. Reason: {}".format(
+            study, e))
+        return None
+
     if folder:
         try:
-            path = cfg.get_path(folder, study)
+            path = cfg.get_path(folder)
         except Exception as e:
             logger.error("Failed to find folder {} for study {}. Reason: {}"
                          "".format(folder, study, e))
@@ -100,84 +411,125 @@ def get_study_path(study, folder=None):
         return path
 
     try:
-        path = cfg.get_study_base(study=study)
+        path = cfg.get_study_base()
     except Exception as e:
         logger.error("Failed to find path for {}. Reason: {}".format(study, e))
         path = None
     return path
 
 
-def delete(config, key, folder=None, files=None):
-    if files and not isinstance(files, list):
-        files = [files]
+def get_study_folders(study, folders):
+    """Find the paths for several of a study's folders at once.
+
+    Unlike :py:func:`get_study_path` folders that aren't defined for the
+    study are silently skipped.
 
+    Args:
+        study (:obj:`str`): A study ID.
+        folders (:obj:`list` of :obj:`str`): The path keys (e.g. 'nii', 'qc')
+            to look up.
+
+    Returns:
+        dict: A dictionary mapping each defined path key to its full path.
+    """
+    found = {}
     try:
-        path = config.get_path(key)
-    except Exception:
-        return
+        cfg = get_config(study)
+    except Exception as e:
+        logger.error("Failed to read config for {}. Reason: {}".format(
+            study, e))
+        return found
 
-    if folder:
-        path = os.path.join(path, folder)
+    for folder in folders:
+        try:
+            found[folder] = cfg.get_path(folder)
+        except Exception as e:
+            logger.debug("Folder {} not defined for study {}. Reason: {}"
+                         "".format(folder, study, e))
+    return found
 
-    if not os.path.exists(path):
-        return
 
-    if files is None:
-        shutil.rmtree(path)
-        return
+def delete_bids(config, subject, session, scan=None, bids_name=None):
+    if scan:
+        bids_name = scan.bids_name
+        if not bids_name:
+            return
 
-    for item in files:
-        matches = glob.glob(os.path.join(path, item + "*"))
-        for match in matches:
-            os.remove(match)
+    found = plan_bids_deletion(
+        config, subject, session, [bids_name] if bids_name else None)
+    errors = remove_paths(found['paths'], found['folders'])
+    if errors:
+        raise OSError("; ".join(errors))
 
-    if not os.listdir(path):
-        os.rmdir(path)
 
+def plan_bids_deletion(config, subject, session, bids_names=None):
+    """Find the BIDS files to delete for a session with a single walk.
+
+    The session folder is walked once to index every file by its name
+    without extensions, and each BIDS name is then looked up in the index,
+    so the cost doesn't grow with the number of scans being deleted.
+
+    Args:
+        config (:obj:`datman.config.config`): The study's config.
+        subject (:obj:`str`): The BIDS subject name.
+        session (:obj:`str`): The BIDS session name.
+        bids_names (:obj:`list` of :obj:`str`, optional): The bids_name of
+            each scan to delete. If not given, the whole session folder is
+            deleted. If empty, nothing is deleted.
+
+    Returns:
+        dict: The full 'paths' to delete, the 'folders' to remove afterwards
+            (deepest first) if they've been left empty and any BIDS names
+            that were 'missing' from the session folder.
+    """
+    found = {'paths': [], 'folders': [], 'missing': []}
+    if bids_names is not None and not bids_names:
+        return found
 
-def delete_bids(config, subject, session, scan=None):
     try:
         bids = config.get_path('bids')
     except Exception:
-        return
+        return found
 
     subject_folder = os.path.join(bids, 'sub-{}'.format(subject))
     session_folder = os.path.join(subject_folder, 'ses-{}'.format(session))
 
-    if not scan:
+    if bids_names is None:
         if os.path.exists(session_folder):
-            shutil.rmtree(session_folder)
-            if not os.listdir(subject_folder):
-                os.rmdir(subject_folder)
-        return
-
-    if not scan.bids_name:
-        return
+            found['paths'].append(session_folder)
+            found['folders'].append(subject_folder)
+        return found
 
-    bids_file = datman.scanid.parse_bids_filename(scan.bids_name)
+    index = {}
     sub_dirs = []
-    sub_dirs.append(subject_folder)
-    sub_dirs.append(session_folder)
     for path, dirs, files in os.walk(session_folder):
-        for sub_dir in dirs:
-            sub_dirs.append(os.path.join(path, sub_dir))
-
+        sub_dirs.extend(os.path.join(path, sub_dir) for sub_dir in dirs)
         for item in files:
-            if bids_file == item:
-                full_path = os.path.join(path, item)
-                os.remove(full_path)
+            index.setdefault(_strip_extensions(item), []).append(
+                os.path.join(path, item))
+
+    for bids_name in OrderedDict.fromkeys(bids_names):
+        matches = index.pop(_strip_extensions(bids_name), None)
+        if not matches:
+            found['missing'].append(bids_name)
+            continue
+        found['paths'].extend(sorted(matches))
 
     # Clean up any folders that may now be empty
-    for sub_dir in reversed(sub_dirs):
-        try:
-            os.rmdir(sub_dir)
-        except OSError:
-            pass
+    found['folders'] = list(reversed(
+        [subject_folder, session_folder] + sub_dirs))
+    return found
+
+
+def _strip_extensions(file_name):
+    """Remove all extensions (e.g. '.nii.gz') from a BIDS file name.
+    """
+    return file_name.split('.', 1)[0]
 
 
 def update_header_diffs(scan):
     site = scan.session.timepoint.site_id
-    config = datman.config.config(study=scan.get_study().id)
+    config = get_config(scan.get_study().id)
 
     try:
         tolerance = config.get_key("HeaderFieldTolerance", site=site)
@@ -192,12 +544,16 @@ def update_header_diffs(scan):
                              tolerance=tolerance)
 
 
-def get_manifests(timepoint):
+def get_manifests(timepoint, manifests=None):
     """Collects and organizes all QC manifest files for a timepoint.
 
     Args:
         timepoint (:obj:`dashboard.models.Timepoint`): A timepoint from the
             database.
+        manifests (:obj:`list` or :obj:`dict`, optional): The full paths to
+            every manifest file for the timepoint. May also be a dictionary
+            mapping each path to its modification time (e.g. from the file
+            index). If not given the timepoint's QC folder is searched.
 
     Returns:
         A dictionary mapping session numbers to a dictionary of input nifti
@@ -210,41 +566,178 @@ def get_manifests(timepoint):
             2: {nifti_3: nifti_3_manifest}
          }
     """
-    study = timepoint.get_study().id
-    config = datman.config.config(study=study)
-    try:
-        qc_dir = config.get_path("qc")
-    except UndefinedSetting:
-        logger.error("No QC path defined for study {}".format(study))
-        return {}
+    if manifests is None:
+        study = timepoint.get_study().id
+        config = get_config(study)
+        try:
+            qc_dir = config.get_path("qc")
+        except UndefinedSetting:
+            logger.error("No QC path defined for study {}".format(study))
+            return {}
+        manifests = glob.glob(
+            os.path.join(qc_dir, str(timepoint), "*_manifest.json")
+        )
+
+    if not isinstance(manifests, dict):
+        manifests = {manifest: None for manifest in manifests}
 
-    qc_path = os.path.join(qc_dir, str(timepoint))
     found = {}
     for num in timepoint.sessions:
         session = timepoint.sessions[num]
         found[num] = {}
 
-        manifests = glob.glob(
-            os.path.join(qc_path, f"{session}_*_manifest.json")
-        )
+        prefix = f"{session}_"
+        for manifest, mtime in manifests.items():
+            if not os.path.basename(manifest).startswith(prefix):
+                continue
+            entry = manifest_cache.get(manifest, mtime)
+            if entry is None:
+                continue
+            scan_name, ordered_contents = entry
+            found[num][scan_name] = ordered_contents
 
-        for manifest in manifests:
-            contents = read_json(manifest)
+    return found
 
-            _, _, _, description = datman.scanid.parse_filename(manifest)
-            scan_name = os.path.basename(manifest).replace(
-                f"{description}.json",
-                ""
-            ).strip("_")
 
-            # Needed to ensure ordering respected
-            ordered_contents = OrderedDict(
-                sorted(contents.items(), key=lambda x: x[1].get("order", 999))
-            )
+def parse_manifest(manifest):
+    """Read a QC manifest file and order its contents.
 
-            found[num][scan_name] = ordered_contents
+    Args:
+        manifest (:obj:`str`): The full path to a manifest file.
 
-    return found
+    Returns:
+        tuple: The name of the scan the manifest is for, and an
+            :obj:`collections.OrderedDict` of its contents, sorted by
+            each entry's 'order' field.
+    """
+    contents = read_json(manifest)
+
+    _, _, _, description = datman.scanid.parse_filename(manifest)
+    scan_name = os.path.basename(manifest).replace(
+        f"{description}.json",
+        ""
+    ).strip("_")
+
+    # Needed to ensure ordering respected
+    ordered_contents = OrderedDict(
+        sorted(contents.items(), key=lambda x: x[1].get("order", 999))
+    )
+    return scan_name, ordered_contents
+
+
+class ManifestCache:
+    """Keep parsed QC manifests until the manifest file is modified.
+
+    Parsed manifests are kept in memory, keyed by path and modification time.
+    If MANIFEST_DISK_CACHE is enabled they're also pickled to SCAN_CACHE_DIR
+    so that other processes (e.g. the scheduler server, after QC is
+    generated) can do the parsing for every web worker.
+
+    At most MAX_SIZE manifests are kept in memory, the least recently
+    read are dropped first.
+    """
+
+    MAX_SIZE = 10000
+
+    def __init__(self):
+        self._manifests = OrderedDict()
+        self._lock = threading.Lock()
+        self.parsed = 0
+        self.saved = 0
+
+    def get(self, manifest, mtime=None):
+        """Get the parsed contents of a manifest file.
+
+        Args:
+            manifest (:obj:`str`): The full path to a manifest file.
+            mtime (float, optional): The file's modification time, if already
+                known (e.g. from the file index). The file will be stat-ed if
+                not given.
+
+        Returns:
+            tuple: The output of :py:func:`parse_manifest`, or None if the
+                file can't be read.
+        """
+        if mtime is None:
+            try:
+                mtime = os.stat(manifest).st_mtime
+            except OSError as e:
+                logger.error("Can't read manifest {}. Reason: {}".format(
+                    manifest, e))
+                return None
+
+        cached = self._manifests.get(manifest)
+        if cached and cached[0] == mtime:
+            self.saved += 1
+            with self._lock:
+                if manifest in self._manifests:
+                    self._manifests.move_to_end(manifest)
+            return cached[1]
+
+        disk_cache = self._get_disk_path(manifest, mtime)
+        entry = self._read_disk(disk_cache)
+        if entry is None:
+            try:
+                entry = parse_manifest(manifest)
+            except OSError as e:
+                logger.error("Can't read manifest {}. Reason: {}".format(
+                    manifest, e))
+                return None
+            self.parsed += 1
+            self._write_disk(disk_cache, entry)
+        else:
+            self.saved += 1
+
+        with self._lock:
+            self._manifests[manifest] = (mtime, entry)
+            self._manifests.move_to_end(manifest)
+            while len(self._manifests) > self.MAX_SIZE:
+                self._manifests.popitem(last=False)
+        return entry
+
+    def clear(self):
+        """Discard all manifests cached in memory.
+        """
+        with self._lock:
+            self._manifests = OrderedDict()
+
+    def _get_disk_path(self, manifest, mtime):
+        if not has_app_context() or \
+                not current_app.config.get('MANIFEST_DISK_CACHE'):
+            return None
+        cache_dir = os.path.join(current_app.config['SCAN_CACHE_DIR'],
+                                 'manifests')
+        key = hashlib.sha1("{}:{}".format(manifest, mtime).encode())
+        return os.path.join(cache_dir, key.hexdigest() + ".pickle")
+
+    def _read_disk(self, path):
+        if not path:
+            return None
+        try:
+            with open(path, "rb") as fh:
+                return pickle.load(fh)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.debug("Ignoring unreadable manifest cache {}. Reason: {}"
+                         "".format(path, e))
+            return None
+
+    def _write_disk(self, path, entry):
+        if not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_file = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp_file, "wb") as fh:
+                pickle.dump(entry, fh)
+            os.replace(tmp_file, path)
+        except OSError as e:
+            logger.debug("Can't write manifest cache {}. Reason: {}".format(
+                path, e))
+
+
+manifest_cache = ManifestCache()
 
 
 def read_json(in_file):
@@ -74,19 +74,49 @@ def send_email(subject, body, html_body=None, recipient=None):
     send_async_email(current_app._get_current_object(), email)
 
 
-def missing_redcap_email(session, study=None, dest_emails=None):
-    """Notify that a session that requires a REDCap survey did not receive one.
+def notification_digest(dest_email, events, remaining=None):
+    """Summarize all of a recipient's queued notifications in one email.
 
     Args:
-        session (str): A session ID.
-        study (str, optional): The study that the session belongs to.
-        dest_emails (str or :obj:`list` of str, optional): Email address(es) to
-            relay the notification to.
+        dest_email (str): The email address to contact.
+        events (:obj:`list` of :obj:`tuple`): A list of
+            (category, study, subjects) tuples, where category is one of the
+            categories defined on :obj:`dashboard.models.Notification` and
+            subjects is a list of the timepoint or session names involved.
+        remaining (:obj:`dict`, optional): A dictionary mapping study IDs
+            to a list of timepoints still awaiting quality control.
     """
-    subject = "Missing REDCap Survey"
-    if study:
-        subject = study + "- " + subject
-    body = "A 'Scan Completed' survey is expected for session '{}' but a " \
-           "survey has not been received. Please remember to fill out the " \
-           "survey or let us know if this email is in error.".format(session)
-    send_email(subject, body, recipient=dest_emails)
+    headings = {
+        'qc_needed': "New scans needing QC",
+        'missing_redcap': "'Scan Completed' surveys expected but not "
+                          "received",
+        'missing_scans': "Scan completed surveys received over 48hrs ago "
+                         "without scan data"
+    }
+    if not remaining:
+        remaining = {}
+
+    studies = sorted({study for _, study, _ in events if study})
+    subject = "QC Dashboard notifications"
+    if len(studies) == 1:
+        subject = studies[0] + " - " + subject
+
+    body = "The following events have occurred since your last update."
+    for category, study, subjects in events:
+        heading = headings.get(category, category)
+        if study:
+            heading = "{} - {}".format(study, heading)
+        body += "\n\n{}:\n".format(heading)
+        body += "\n".join(subjects)
+
+    qc_studies = sorted({study for category, study, _ in events
+                         if category == 'qc_needed' and study})
+    for study in qc_studies:
+        if not remaining.get(study):
+            continue
+        body += "\n\n{} - Scans still needing QC:\n".format(study)
+        body += "\n".join(sorted(remaining[study]))
+
+    body += "\n\nIf you wrongly received this email, please contact " \
+            "staff at the Kimel Lab"
+    send_email(subject, body, recipient=dest_email)
@@ -0,0 +1,284 @@
+"""Index the files in each study's nii, qc and resources folders.
+
+Finding a scan or QC file normally means building a datman config to locate
+the study's folder and then stat-ing (or globbing) the file system, which is
+slow on network file systems. Instead, :py:func:`crawl` regularly walks each
+study's folders with os.scandir and records every file in the file_index
+table, so views can find files with a single primary key lookup.
+
+The index can be out of date by up to FILE_INDEX_INTERVAL minutes, so callers
+should fall back to searching the file system when a file isn't found.
+
+To keep regular crawls cheap, the modification time (and sub-folders) of
+every folder read is remembered, and folders that haven't changed since the
+last crawl aren't read again. A folder's modification time only changes when
+files are added, removed or renamed in it, so files changed in place are
+picked up when they're next indexed individually (see crawl's 'subdir') or
+when the folder is fully re-read, which happens at least every
+RESCAN_AFTER seconds.
+"""
+import os
+import time
+import logging
+from collections import OrderedDict
+
+from sqlalchemy import tuple_
+
+from dashboard import db
+from .models import Study, IndexedFile
+from .cache import invalidate_on_commit
+from .datman_utils import get_study_folders
+from .queries import chunked
+
+logger = logging.getLogger(__name__)
+
+# The folders to index. Files are recorded under the name of the first
+# sub-folder they're found in (i.e. the timepoint for 'nii' and 'qc', the
+# session for 'resources'). Only 'resources' is searched recursively.
+FOLDERS = ['nii', 'qc', 'resources']
+RECURSIVE = ['resources']
+
+# The longest (in seconds) to go without re-reading an unchanged folder
+RESCAN_AFTER = 24 * 60 * 60
+
+# Maps (study, folder) to the state of each folder found by the last crawl,
+# as a dictionary of paths to (mtime_ns, time last read, sub-folders)
+_known = {}
+
+
+def find_file(study, folder, subdir, names):
+    """Find the path to an indexed file.
+
+    Args:
+        study (:obj:`str`): A study ID.
+        folder (:obj:`str`): The path key of the folder (e.g. 'nii').
+        subdir (:obj:`str`): The sub-folder the file is in (e.g. a timepoint
+            name).
+        names (:obj:`list` of :obj:`str`): Acceptable file names, in order of
+            preference (e.g. ['scan.nii.gz', 'scan.nii']).
+
+    Returns:
+        str: The full path to the first name found, or None if none are
+            indexed.
+    """
+    if not isinstance(names, list):
+        names = [names]
+    found = dict(
+        db.session.query(IndexedFile.name, IndexedFile.path).filter(
+            IndexedFile.study == study,
+            IndexedFile.folder == folder,
+            IndexedFile.subdir == subdir,
+            IndexedFile.name.in_(names)))
+    for name in names:
+        if name in found:
+            return found[name]
+    return None
+
+
+def list_files(study, folder, subdir, suffix=None, with_mtimes=False):
+    """List the indexed files in a sub-folder.
+
+    Args:
+        study (:obj:`str`): A study ID.
+        folder (:obj:`str`): The path key of the folder (e.g. 'qc').
+        subdir (:obj:`str`): The sub-folder to list (e.g. a timepoint name).
+        suffix (:obj:`str`, optional): Only list files whose names end with
+            this.
+        with_mtimes (bool, optional): Whether to return each file's
+            modification time (as of the last crawl) too.
+
+    Returns:
+        list: The full path of each matching file, sorted by name. If
+            with_mtimes is set, a dictionary mapping each path to its
+            modification time is returned instead.
+    """
+    query = db.session.query(IndexedFile.path, IndexedFile.mtime).filter(
+        IndexedFile.study == study,
+        IndexedFile.folder == folder,
+        IndexedFile.subdir == subdir)
+    if suffix:
+        query = query.filter(
+            IndexedFile.name.endswith(suffix, autoescape=True))
+    query = query.order_by(IndexedFile.name)
+    if with_mtimes:
+        return OrderedDict((path, mtime) for path, mtime in query)
+    return [path for path, _ in query]
+
+
+def crawl(studies=None, folders=None, subdir=None):
+    """Refresh the file index.
+
+    Args:
+        studies (:obj:`list` of :obj:`str`, optional): The IDs of the studies
+            to crawl. Defaults to all studies.
+        folders (:obj:`list` of :obj:`str`, optional): The folders to crawl.
+            Defaults to all of :py:data:`FOLDERS`.
+        subdir (:obj:`str`, optional): Only refresh a single sub-folder (e.g.
+            a newly processed timepoint) instead of the whole folder. The
+            sub-folder is always fully re-read.
+
+    Returns:
+        dict: The number of files added, removed and updated.
+    """
+    if studies is None:
+        studies = [study_id for study_id, in db.session.query(Study.id)]
+    totals = {'added': 0, 'removed': 0, 'updated': 0}
+    for study in studies:
+        paths = get_study_folders(study, folders or FOLDERS)
+        for folder, root in paths.items():
+            known = None if subdir else _known.setdefault((study, folder), {})
+            skipped = set()
+            try:
+                found = scan_folder(root, folder in RECURSIVE, subdir, known,
+                                    skipped)
+            except OSError as e:
+                logger.error("Can't index folder {} for study {}. Reason: "
+                             "{}".format(folder, study, e))
+                continue
+            for key, count in sync(study, folder, found, subdir,
+                                   skipped).items():
+                totals[key] += count
+    logger.info("Updated file index: {}".format(totals))
+    return totals
+
+
+def scan_folder(root, recursive=False, subdir=None, known=None,
+                skipped=None):
+    """Find all files in a study folder.
+
+    Args:
+        root (:obj:`str`): The full path to the folder.
+        recursive (bool, optional): Whether to search within the sub-folders
+            of each sub-folder.
+        subdir (:obj:`str`, optional): Only search this sub-folder.
+        known (dict, optional): The state of each folder from the last
+            search (see :py:data:`_known`). Folders that haven't changed
+            since aren't read, and the dictionary is updated to match the
+            file system.
+        skipped (set, optional): A set to add the path of every folder that
+            wasn't read to. Required if known is given.
+
+    Raises:
+        OSError: If the folder can't be read.
+
+    Returns:
+        dict: A dictionary mapping each (subdir, name) tuple to the file's
+            full path and modification time. For recursive searches the name
+            is the file's path relative to its top-level sub-folder. Files in
+            skipped folders aren't included.
+    """
+    if subdir:
+        entries = [os.path.join(root, subdir)]
+        if not os.path.isdir(entries[0]):
+            return {}
+    else:
+        entries = [entry.path for entry in os.scandir(root)
+                   if entry.is_dir()]
+
+    found = {}
+    now = time.time()
+    visited = {}
+    for top in entries:
+        top_name = os.path.basename(top)
+        pending = [top]
+        while pending:
+            current = pending.pop()
+            if known is not None:
+                try:
+                    mtime = os.stat(current).st_mtime_ns
+                except OSError as e:
+                    logger.debug("Can't read {}. Reason: {}".format(
+                        current, e))
+                    continue
+                previous = known.get(current)
+                if (previous and previous[0] == mtime and
+                        now - previous[1] < RESCAN_AFTER):
+                    skipped.add(current)
+                    visited[current] = previous
+                    pending.extend(previous[2])
+                    continue
+            try:
+                contents = list(os.scandir(current))
+            except OSError as e:
+                logger.debug("Can't read {}. Reason: {}".format(current, e))
+                continue
+            sub_dirs = []
+            for entry in contents:
+                if entry.is_dir():
+                    if recursive:
+                        sub_dirs.append(entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
+                name = os.path.relpath(entry.path, top)
+                found[(top_name, name)] = (entry.path, entry.stat().st_mtime)
+            pending.extend(sub_dirs)
+            if known is not None:
+                visited[current] = (mtime, now, sub_dirs)
+
+    if known is not None:
+        # Forget folders that no longer exist
+        known.clear()
+        known.update(visited)
+    return found
+
+
+def sync(study, folder, found, subdir=None, skipped=None):
+    """Update a folder's index entries to match the file system.
+
+    Args:
+        study (:obj:`str`): A study ID.
+        folder (:obj:`str`): The path key of the folder that was searched.
+        found (dict): The output of :py:func:`scan_folder`.
+        subdir (:obj:`str`, optional): The sub-folder that was searched, if
+            only one was.
+        skipped (set, optional): Folders that weren't read. Entries for
+            files in them are left as they are.
+
+    Returns:
+        dict: The number of files added, removed and updated.
+    """
+    query = db.session.query(
+        IndexedFile.subdir, IndexedFile.name, IndexedFile.path,
+        IndexedFile.mtime
+    ).filter(IndexedFile.study == study, IndexedFile.folder == folder)
+    if subdir:
+        query = query.filter(IndexedFile.subdir == subdir)
+    existing = {(row.subdir, row.name): (row.path, row.mtime)
+                for row in query}
+
+    def mapping(key):
+        path, mtime = found[key]
+        return {'study': study, 'folder': folder, 'subdir': key[0],
+                'name': key[1], 'path': path, 'mtime': mtime}
+
+    added = [mapping(key) for key in found if key not in existing]
+    updated = [mapping(key) for key in found
+               if key in existing and existing[key] != found[key]]
+    skipped = skipped or set()
+    removed = [key for key, (path, _) in existing.items()
+               if key not in found and os.path.dirname(path) not in skipped]
+
+    if added or updated or removed:
+        # Bulk changes aren't seen by the ORM, so report them to the page
+        # cache
+        invalidate_on_commit(db.session,
+                             ['IndexedFile', 'Study:{}'.format(study)])
+    try:
+        db.session.bulk_insert_mappings(IndexedFile, added)
+        db.session.bulk_update_mappings(IndexedFile, updated)
+        for chunk in chunked(removed):
+            IndexedFile.query.filter(
+                IndexedFile.study == study,
+                IndexedFile.folder == folder,
+                tuple_(IndexedFile.subdir, IndexedFile.name).in_(chunk)
+            ).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Failed to update file index for {} folder {}. Reason: "
+                     "{}".format(study, folder, e))
+        return {'added': 0, 'removed': 0, 'updated': 0}
+
+    return {'added': len(added), 'removed': len(removed),
+            'updated': len(updated)}
@@ -0,0 +1,199 @@
+"""Count and time the SQL queries made while handling each request.
+
+SQLAlchemy's before_cursor_execute and after_cursor_execute events are used
+to record every statement sent to the database during a request. Once the
+response is ready:
+
+    * A Server-Timing header with the total SQL time and query count is
+      added, so it can be seen in the browser's developer tools.
+    * Requests that take longer than SQL_SLOW_REQUEST milliseconds or make
+      more than SQL_MAX_QUERIES queries are logged as warnings.
+    * Statements with the same shape (i.e. the same SQL with different
+      parameters) that repeat at least SQL_REPEAT_THRESHOLD times are
+      reported as likely N+1 query patterns.
+    * A SQL_STATS_SAMPLE fraction of requests are written as a single line
+      of JSON to the 'dashboard.sql_stats' logger for later analysis.
+
+The overhead is a timer and a dictionary update per query, so it's safe to
+leave on in production.
+"""
+import re
+import json
+import time
+import random
+import logging
+from collections import OrderedDict
+
+from flask import g, request, current_app, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+stats_logger = logging.getLogger('dashboard.sql_stats')
+
+_SHAPE_PATTERNS = [
+    (re.compile(r"%\(\w+\)s|%s"), "?"),
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?)"),
+    (re.compile(r"\s+"), " ")
+]
+
+_listening = False
+
+
+def init_app(app):
+    """Start recording SQL statistics for an app's requests.
+
+    Does nothing if SQL_STATS_ENABLED is False.
+    """
+    if not app.config.get('SQL_STATS_ENABLED', True):
+        return
+    _listen()
+    app.before_request(start_request)
+    app.after_request(finish_request)
+
+
+def _listen():
+    global _listening
+    if _listening:
+        return
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    _listening = True
+
+
+class RequestStats:
+    """The queries made while handling a single request.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.count = 0
+        self.duration = 0.0
+        # Maps each statement's shape to its count and total duration
+        self.shapes = OrderedDict()
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        shape = get_shape(statement)
+        count, total = self.shapes.get(shape, (0, 0.0))
+        self.shapes[shape] = (count + 1, total + duration)
+
+    def repeated(self, threshold):
+        """Find statement shapes that ran at least threshold times.
+
+        Returns:
+            list: A dictionary with the 'statement' shape, its 'count' and
+                total duration ('ms') for each repeated shape, most frequent
+                first.
+        """
+        found = [{'statement': shape, 'count': count,
+                  'ms': round(total * 1000, 2)}
+                 for shape, (count, total) in self.shapes.items()
+                 if count >= threshold]
+        return sorted(found, key=lambda item: item['count'], reverse=True)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+def get_shape(statement):
+    """Reduce a SQL statement to its shape.
+
+    Parameters, literals and the length of IN lists are replaced with
+    placeholders so that the same query run for different records has the
+    same shape.
+
+    Args:
+        statement (:obj:`str`): A SQL statement.
+
+    Returns:
+        str: The normalized statement.
+    """
+    for pattern, replacement in _SHAPE_PATTERNS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def get_stats():
+    """Get the statistics for the current request, if any are being kept.
+
+    Returns:
+        :obj:`RequestStats`: The current request's statistics, or None.
+    """
+    if not has_request_context():
+        return None
+    return g.get('sql_stats')
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if get_stats() is None or context is None:
+        return
+    # Kept on the statement's execution context rather than the connection,
+    # so a statement that raises can't leave its start time behind for the
+    # connection's later queries
+    context._sql_stats_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    stats = get_stats()
+    start = getattr(context, '_sql_stats_start', None)
+    if stats is None or start is None:
+        return
+    del context._sql_stats_start
+    stats.add(statement, time.perf_counter() - start)
+
+
+def start_request():
+    g.sql_stats = RequestStats()
+
+
+def finish_request(response):
+    """Report a request's SQL statistics.
+
+    This is meant to be registered as an after_request handler.
+    """
+    stats = g.pop('sql_stats', None)
+    if stats is None:
+        return response
+
+    config = current_app.config
+    elapsed = stats.elapsed()
+
+    if config.get('SERVER_TIMING', True):
+        response.headers.add(
+            'Server-Timing',
+            'db;dur={:.1f};desc="{} queries", app;dur={:.1f}'.format(
+                stats.duration * 1000, stats.count, elapsed * 1000))
+
+    repeated = stats.repeated(config.get('SQL_REPEAT_THRESHOLD', 10))
+    for item in repeated:
+        logger.warning("Possible N+1 query on {} {}: statement ran {} times "
+                       "({} ms) - {}".format(request.method, request.path,
+                                             item['count'], item['ms'],
+                                             item['statement'][:500]))
+
+    if (elapsed * 1000 > config.get('SQL_SLOW_REQUEST', 2000) or
+            stats.count > config.get('SQL_MAX_QUERIES', 100)):
+        logger.warning("Slow request {} {}: {:.0f} ms total, {} queries "
+                       "taking {:.0f} ms".format(
+                           request.method, request.path, elapsed * 1000,
+                           stats.count, stats.duration * 1000))
+
+    sample = config.get('SQL_STATS_SAMPLE', 0)
+    if sample and random.random() < sample:
+        stats_logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'ms': round(elapsed * 1000, 2),
+            'queries': stats.count,
+            'sql_ms': round(stats.duration * 1000, 2),
+            'repeated': repeated
+        }))
+    return response
@@ -80,30 +80,3 @@ def account_rejection_email(user_id, user_email):
            "questions you may have please contact us " \
            "at {}".format(current_app.config['DASH_SUPPORT'])
     send_email(subject, body, recipient=user_email)
-
-
-def qc_notification_email(user_name, dest_email, study, current_tp,
-                          remain_tp=None):
-    """Notify QCers that there is a new session to review.
-
-    Args:
-        user_name (:obj:`str`): A user's real name.
-        dest_email (:obj:`str`): Email address to contact.
-        study (:obj:`str`): The name of the study that has received data.
-        current_tp (:obj:`str`): The name of the timepoint that needs review.
-        remain_tp (:obj:`list` of :obj:`str`): A list of names of timepoints
-            from this study that are still awaiting quality control.
-    """
-    subject = "{} - New scan, QC needed".format(study)
-    body = "Hi {}, you have been tagged as a QCer for {}".format(
-        user_name, study)
-    body += "\n\nNew scan: {}".format(current_tp)
-
-    if remain_tp:
-        body += "\n\nScans still needing QC:\n"
-        body += "\n".join(remain_tp)
-
-    body += "\n\nIf you wrongly recieved this email, " \
-            "please contact staff at the Kimel Lab"
-
-    send_email(subject, body, recipient=dest_email)
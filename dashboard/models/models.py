@@ -8,9 +8,9 @@ from random import randint
 
 from flask import current_app
 from flask_login import UserMixin, AnonymousUserMixin
-from sqlalchemy import and_, or_, exists, func
+from sqlalchemy import and_, or_, exists, func, event, inspect, DDL
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.orm import deferred, backref
+from sqlalchemy.orm import deferred, backref, make_transient_to_detached
 from sqlalchemy.schema import UniqueConstraint, ForeignKeyConstraint
 from sqlalchemy.orm.exc import FlushError
 from sqlalchemy.exc import IntegrityError
@@ -18,15 +18,32 @@ from sqlalchemy.ext.associationproxy import association_proxy
 from psycopg2.tz import FixedOffsetTimezone
 from sqlalchemy.orm.collections import attribute_mapped_collection
 
-from datman import scanid, header_checks
+from datman import scanid
 from dashboard import db, TZ_OFFSET
 from dashboard.exceptions import InvalidDataException
 from dashboard.models import utils
 from .emails import (account_request_email, account_activation_email,
-                     account_rejection_email, qc_notification_email)
+                     account_rejection_email)
 
 logger = logging.getLogger(__name__)
 
+# The trigram indexes used for substring searches (e.g. from the search bar)
+# need the pg_trgm extension.
+event.listen(db.metadata, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+# The bit used for each StudyUser permission in User.get_permissions().
+# Every StudyUser record sets ACCESS, so a mask is only ever zero when the
+# user has no access at all.
+ACCESS = 1
+PERMISSIONS = {
+    'is_admin': 2,
+    'primary_contact': 4,
+    'kimel_contact': 8,
+    'study_RA': 16,
+    'does_qc': 32
+}
+
 
 class TableMixin:
     """Adds simple methods commonly needed for tables.
@@ -102,7 +119,8 @@ study_timepoints_table = db.Table(
     db.Column('timepoint',
               db.String(64),
               db.ForeignKey('timepoints.name'),
-              nullable=False), UniqueConstraint('study', 'timepoint'))
+              nullable=False), UniqueConstraint('study', 'timepoint'),
+    db.Index('study_timepoints_timepoint_idx', 'timepoint'))
 
 ###############################################################################
 # Plain entities
@@ -143,6 +161,10 @@ class User(PermissionMixin, UserMixin, TableMixin, db.Model):
 
     __table_args__ = (UniqueConstraint(_username),)
 
+    # Built from the user's StudyUser records the first time it's needed.
+    # Since users are loaded fresh for each request this lasts one request.
+    _permissions = None
+
     def __init__(self,
                  first,
                  last,
@@ -272,6 +294,8 @@ class User(PermissionMixin, UserMixin, TableMixin, db.Model):
             raise InvalidDataException("Failed to update user {}'s study "
                                        "access. Reason - {}"
                                        "".format(self.id, e._message()))
+        finally:
+            self.reset_permissions()
 
     def remove_studies(self, study_ids):
         """Disable study access for this user.
@@ -324,6 +348,8 @@ class User(PermissionMixin, UserMixin, TableMixin, db.Model):
             raise InvalidDataException("Failed to restrict study access for "
                                        "user {}. Reason - {}".format(
                                            self.id, e))
+        finally:
+            self.reset_permissions()
 
     def get_studies(self):
         """Get a list of studies that user has even partial access to
@@ -333,13 +359,14 @@ class User(PermissionMixin, UserMixin, TableMixin, db.Model):
             has at least partial (site based) access.
         """
         if self.dashboard_admin:
-            studies = Study.query.order_by(Study.id).all()
-        else:
-            studies = sorted(
-                [su[0].study for su in self.studies.values()],
-                key=lambda x: x.id
-            )
-        return studies
+            return Study.query.order_by(Study.id).all()
+        permissions = self.get_permissions()
+        if not permissions:
+            return []
+        return Study.query \
+            .filter(Study.id.in_(list(permissions))) \
+            .order_by(Study.id) \
+            .all()
 
     def get_sites(self):
         """Get a list of sites the user has even partial access to.
@@ -355,13 +382,18 @@ class User(PermissionMixin, UserMixin, TableMixin, db.Model):
                      for item in Site.query.with_entities(Site.name).all()]
         else:
             sites = set()
-            for study in self.studies:
-                for study_site in self.studies[study]:
-                    if not study_site.site_id:
-                        # All sites are enabled
-                        sites = sites.union(study_site.study.sites)
-                    else:
-                        sites.add(study_site.site_id)
+            all_sites = []
+            for study, (_, study_wide, by_site) in \
+                    self.get_permissions().items():
+                if study_wide:
+                    all_sites.append(study)
+                sites.update(by_site)
+            if all_sites:
+                sites.update(
+                    item[0] for item in StudySite.query
+                    .with_entities(StudySite.site_id)
+                    .filter(StudySite.study_id.in_(all_sites))
+                )
         return list(sorted(sites))
 
     def get_disabled_sites(self):
@@ -389,11 +421,14 @@ class User(PermissionMixin, UserMixin, TableMixin, db.Model):
     def _get_permissions(self, study, site=None, perm=None):
         """Check if a user has general access rights or a specific permission
 
-        Checks StudyUser records for this user.
+        Checks StudyUser records for this user (as summarized by
+        :py:meth:`get_permissions`, so repeated checks don't query the
+        database).
             - If only study is set, it will check if the user has any access
             to the study at all
             - If study and perm are set, it will check if the user
-            has the named permission for that entire study
+            has been given the named permission for the whole study (i.e.
+            by a record that isn't restricted to one site)
 
         Use the 'site' flag to restrict checks to specific sites instead of
         the study as a whole.
@@ -422,21 +457,118 @@ class User(PermissionMixin, UserMixin, TableMixin, db.Model):
             site = site.name
 
         try:
-            access_rights = self.studies[study]
+            any_site, study_wide, by_site = self.get_permissions()[study]
         except KeyError:
             return False
 
         if site:
-            access_rights = [su for su in access_rights
-                             if su.site_id is None or su.site_id == site]
-            if not access_rights:
-                return False
+            mask = by_site.get(site, study_wide)
+        elif perm:
+            # A permission for the whole study needs a study-wide record,
+            # permissions for some of its sites aren't enough
+            mask = study_wide
+        else:
+            mask = any_site
+
+        if not mask:
+            return False
 
         if perm:
-            return getattr(access_rights[0], perm)
+            return bool(mask & PERMISSIONS[perm])
 
         return True
 
+    def get_permissions(self):
+        """Get this user's permissions for each study they can access.
+
+        The permissions are read from the user's StudyUser records with a
+        single query the first time they're needed and then kept until
+        :py:meth:`reset_permissions` is called.
+
+        Each permission is stored as a bit mask made from ACCESS and the
+        values in PERMISSIONS. Where a user has more than one record that
+        applies (e.g. a study-wide record and one for a single site) the
+        permissions granted by each are combined.
+
+        Returns:
+            dict: A dictionary mapping each study ID to a tuple of three
+            items: the permissions granted by any record for the study, the
+            permissions granted for every site in the study (zero if
+            there's no study-wide record) and a dictionary mapping each
+            site with its own record to the permissions for that site.
+        """
+        if self._permissions is not None:
+            return self._permissions
+
+        records = db.session.query(
+            StudyUser.study_id,
+            StudyUser.site_id,
+            *[getattr(StudyUser, perm) for perm in PERMISSIONS]
+        ).filter(StudyUser.user_id == self.id)
+
+        found = {}
+        for study, site, *flags in records:
+            mask = ACCESS
+            for bit, flag in zip(PERMISSIONS.values(), flags):
+                if flag:
+                    mask |= bit
+            found.setdefault(study, {})[site] = mask
+
+        permissions = {}
+        for study, masks in found.items():
+            study_wide = masks.pop(None, 0)
+            any_site = study_wide
+            for mask in masks.values():
+                any_site |= mask
+            permissions[study] = (
+                any_site,
+                study_wide,
+                {site: mask | study_wide for site, mask in masks.items()}
+            )
+
+        self._permissions = permissions
+        return permissions
+
+    def reset_permissions(self):
+        """Discard the permissions read by :py:meth:`get_permissions`.
+
+        This must be called when the user's StudyUser records change.
+        """
+        self._permissions = None
+
+    def get_snapshot(self):
+        """Get a copy of this user's record and permissions that can be cached.
+
+        Returns:
+            tuple: A dictionary of the user's column values and the output of
+            :py:meth:`get_permissions`. Neither should be modified.
+        """
+        columns = {attr.key: getattr(self, attr.key)
+                   for attr in inspect(User).column_attrs}
+        return (columns, self.get_permissions())
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Restore a user from the output of :py:meth:`get_snapshot`.
+
+        The user is added to the current database session without querying
+        the database. Relationships are still loaded when first accessed.
+
+        Args:
+            snapshot (tuple): The output of :py:meth:`get_snapshot`.
+
+        Returns:
+            :obj:`dashboard.models.User`: The user.
+        """
+        columns, permissions = snapshot
+        user = cls.__mapper__.class_manager.new_instance()
+        for key, value in columns.items():
+            setattr(user, key, value)
+        make_transient_to_detached(user)
+        user = db.session.merge(user, load=False)
+        user._permissions = permissions
+        return user
+
     def __repr__(self):
         return "<User {}: {} {}>".format(self.id, self.first_name,
                                          self.last_name)
@@ -528,6 +660,85 @@ class AccountRequest(TableMixin, db.Model):
         return result
 
 
+class Notification(TableMixin, db.Model):
+    """An event waiting to be reported in a recipient's next email digest.
+    """
+    __tablename__ = 'notifications'
+
+    QC_NEEDED = 'qc_needed'
+    MISSING_REDCAP = 'missing_redcap'
+    MISSING_SCANS = 'missing_scans'
+
+    id = db.Column('id', db.Integer, primary_key=True)
+    recipient = db.Column('recipient', db.String(256), nullable=False)
+    category = db.Column('category', db.String(32), nullable=False)
+    study = db.Column('study',
+                      db.String(32),
+                      db.ForeignKey('studies.id', ondelete='CASCADE'))
+    subject = db.Column('subject', db.String(128), nullable=False)
+    _timestamp = db.Column('created',
+                           db.DateTime(timezone=True),
+                           nullable=False)
+    sent = db.Column('sent', db.DateTime(timezone=True))
+
+    __table_args__ = (db.Index('notifications_pending_idx',
+                               'recipient',
+                               postgresql_where=db.text('sent IS NULL')), )
+
+    def __init__(self, recipient, category, subject, study=None):
+        self.recipient = recipient
+        self.category = category
+        self.subject = subject
+        self.study = study
+        self._timestamp = datetime.datetime.now(
+            FixedOffsetTimezone(offset=TZ_OFFSET))
+
+    @classmethod
+    def queue(cls, recipients, category, subject, study=None):
+        """Record an event for each recipient's next notification digest.
+
+        Args:
+            recipients (:obj:`list` of :obj:`str`): Email addresses to notify.
+                If empty, the dashboard admins will be notified.
+            category (:obj:`str`): The type of event (e.g.
+                Notification.QC_NEEDED).
+            subject (:obj:`str`): The name of the timepoint or session the
+                event is about.
+            study (:obj:`str`, optional): The ID of the study the event
+                belongs to.
+
+        Raises:
+            :obj:`dashboard.exceptions.InvalidDataException`: If the events
+                can't be saved.
+        """
+        if not recipients:
+            recipients = current_app.config['ADMINS']
+        if not isinstance(recipients, list):
+            recipients = [recipients]
+
+        recipients = {address for address in recipients if address}
+        if not recipients:
+            logger.error("No recipients available for {} notification about "
+                         "{}".format(category, subject))
+            return
+
+        db.session.add_all([
+            cls(address, category, subject, study=study)
+            for address in sorted(recipients)
+        ])
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise InvalidDataException("Failed to queue {} notification for "
+                                       "{}. Reason - {}".format(
+                                           category, subject, e))
+
+    def __repr__(self):
+        return "<Notification {} for {}: {}>".format(
+            self.category, self.recipient, self.subject)
+
+
 class Study(TableMixin, db.Model):
     __tablename__ = 'studies'
 
@@ -614,12 +825,15 @@ class Study(TableMixin, db.Model):
             raise
 
         if self.email_qc:
-            not_qcd = [t.name for t in self.timepoints.all() if not
-                       t.is_qcd()]
-            _ = [utils.schedule_email(qc_notification_email,
-                                      [str(u), u.email, self.id,
-                                       timepoint.name, not_qcd])
-                 for u in self.get_QCers()]
+            # QCers are told about the new timepoint (and anything else still
+            # awaiting review) in their next notification digest. Nothing is
+            # queued for a study without QCers, queue() would tell the admins.
+            qcers = [u.email for u in self.get_QCers() if u.email]
+            if qcers:
+                Notification.queue(qcers,
+                                   Notification.QC_NEEDED,
+                                   timepoint.name,
+                                   study=self.id)
 
         return timepoint
 
@@ -1117,6 +1331,14 @@ class Timepoint(TableMixin, db.Model):
     incidental_findings = db.relationship('IncidentalFinding',
                                           cascade='all, delete')
 
+    __table_args__ = (
+        db.Index('timepoints_site_idx', 'site'),
+        db.Index('timepoints_bids_idx', 'bids_name', 'bids_sess'),
+        db.Index('timepoints_name_trgm_idx',
+                 db.text('upper(name) gin_trgm_ops'),
+                 postgresql_using='gin'),
+    )
+
     def __init__(self, name, site, is_phantom=False):
         self.name = name
         self.site_id = site
@@ -1385,6 +1607,13 @@ class Session(TableMixin, db.Model):
                                     cascade='all, delete')
     task_files = db.relationship('TaskFile', cascade='all, delete')
 
+    __table_args__ = (
+        db.Index('sessions_name_upper_idx', func.upper(name)),
+        db.Index('sessions_name_trgm_idx',
+                 db.text('upper(name) gin_trgm_ops'),
+                 postgresql_using='gin'),
+    )
+
     def __init__(self,
                  name,
                  num,
@@ -1696,9 +1925,25 @@ class Scan(TableMixin, db.Model):
         order_by='desc(ScanGoldStandard.date_added)',
         back_populates='scan')
 
-    __table_args__ = (ForeignKeyConstraint(['timepoint', 'session'],
-                                           ['sessions.name', 'sessions.num']),
-                      UniqueConstraint(name))
+    __table_args__ = (
+        ForeignKeyConstraint(['timepoint', 'session'],
+                             ['sessions.name', 'sessions.num']),
+        UniqueConstraint(name),
+        db.Index('scans_session_idx', 'timepoint', 'session'),
+        db.Index('scans_timepoint_upper_idx', func.upper(timepoint)),
+        db.Index('scans_name_trgm_idx',
+                 db.text('upper(name) gin_trgm_ops'),
+                 postgresql_using='gin'),
+        db.Index('scans_timepoint_trgm_idx',
+                 db.text('upper(timepoint) gin_trgm_ops'),
+                 postgresql_using='gin'),
+        db.Index('scans_tag_trgm_idx',
+                 db.text('upper(tag) gin_trgm_ops'),
+                 postgresql_using='gin'),
+        db.Index('scans_description_trgm_idx',
+                 db.text('upper(description) gin_trgm_ops'),
+                 postgresql_using='gin'),
+    )
 
     def __init__(self,
                  name,
@@ -1822,6 +2067,9 @@ class Scan(TableMixin, db.Model):
             raise InvalidDataException("No gold standard available for "
                                        "comparison")
 
+        # Imported here because it's slow to load and rarely needed
+        from datman import header_checks
+
         diffs = header_checks.compare_headers(self.json_contents,
                                               gs.json_contents,
                                               ignore=ignore,
@@ -2071,7 +2319,9 @@ class GoldStandard(db.Model):
              'expected_scans.scantype'],
             name='gold_standards_expected_scan_fkey',
         ),
-        UniqueConstraint(json_path, json_contents)
+        UniqueConstraint(json_path, json_contents),
+        db.Index('gold_standards_expected_scan_idx',
+                 'study', 'site', 'scantype')
     )
 
     def __init__(self, study, gs_json):
@@ -2231,6 +2481,174 @@ class RedcapConfig(TableMixin, db.Model):
         return "<RedcapConfig {}>".format(self.id)
 
 
+class RedcapTrigger(TableMixin, db.Model):
+    """A REDCap data entry trigger waiting to be (or already) processed.
+    """
+    __tablename__ = 'redcap_triggers'
+
+    PENDING = 'pending'
+    DONE = 'done'
+    DUPLICATE = 'duplicate'
+    FAILED = 'failed'
+
+    id = db.Column('id', db.Integer, primary_key=True)
+    url = db.Column('url', db.String(1024), nullable=False)
+    project = db.Column('project_id', db.Integer, nullable=False)
+    instrument = db.Column('instrument', db.String(1024), nullable=False)
+    record = db.Column('record', db.String(256), nullable=False)
+    event_name = db.Column('event_name', db.String(256))
+    contents = db.Column('contents', JSONB, nullable=False)
+    status = db.Column('status', db.String(16), nullable=False,
+                       default=PENDING)
+    error = db.Column('error', db.Text)
+    received = db.Column('received',
+                         db.DateTime(timezone=True),
+                         nullable=False)
+    processed = db.Column('processed', db.DateTime(timezone=True))
+
+    __table_args__ = (db.Index('redcap_triggers_pending_idx',
+                               'received',
+                               postgresql_where=db.text(
+                                   "status = 'pending'")), )
+
+    def __init__(self, contents):
+        self.url = contents['redcap_url']
+        self.project = int(contents['project_id'])
+        self.instrument = contents['instrument']
+        self.record = contents['record']
+        self.event_name = contents.get('redcap_event_name')
+        self.contents = contents
+        self.status = self.PENDING
+        self.received = datetime.datetime.now(
+            FixedOffsetTimezone(offset=TZ_OFFSET))
+
+    @property
+    def key(self):
+        """A tuple identifying the REDCap record this trigger is for.
+        """
+        return (self.url, self.project, self.instrument, self.record,
+                self.event_name)
+
+    def set_status(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.processed = datetime.datetime.now(
+            FixedOffsetTimezone(offset=TZ_OFFSET))
+
+    def __repr__(self):
+        return "<RedcapTrigger {} for record {} ({})>".format(
+            self.id, self.record, self.status)
+
+
+class IndexedFile(db.Model):
+    """A file found in a study's nii, qc or resources folder.
+
+    These are refreshed regularly by :py:func:`dashboard.file_index.crawl`
+    so that views can find files without touching the file system.
+    """
+    __tablename__ = 'file_index'
+
+    study = db.Column('study',
+                      db.String(32),
+                      db.ForeignKey('studies.id', ondelete='CASCADE'),
+                      primary_key=True)
+    folder = db.Column('folder', db.String(32), primary_key=True)
+    subdir = db.Column('subdir', db.String(256), primary_key=True)
+    name = db.Column('name', db.String(1024), primary_key=True)
+    path = db.Column('path', db.Text, nullable=False)
+    mtime = db.Column('mtime', db.Float, nullable=False)
+
+    def __init__(self, study, folder, subdir, name, path, mtime):
+        self.study = study
+        self.folder = folder
+        self.subdir = subdir
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+
+    def __repr__(self):
+        return "<IndexedFile {}>".format(self.path)
+
+
+class DeletionJob(TableMixin, db.Model):
+    """A request to delete data from the file system in the background.
+
+    Deleting a large timepoint can take longer than a web request is allowed
+    to run, so the files are deleted by a scheduler job instead (see
+    :py:func:`dashboard.blueprints.timepoints.monitors.run_deletion`) and its
+    progress and errors are recorded here.
+    """
+    __tablename__ = 'deletion_jobs'
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = db.Column('id', db.Integer, primary_key=True)
+    study = db.Column('study',
+                      db.String(32),
+                      db.ForeignKey('studies.id', ondelete='CASCADE'),
+                      nullable=False)
+    target = db.Column('target', db.String(256), nullable=False)
+    user_id = db.Column('user_id',
+                        db.Integer,
+                        db.ForeignKey('users.id', ondelete='SET NULL'))
+    plan = db.Column('plan', JSONB, nullable=False)
+    records = db.Column('records', JSONB)
+    status = db.Column('status', db.String(16), nullable=False,
+                       default=PENDING)
+    total = db.Column('total', db.Integer)
+    completed = db.Column('completed', db.Integer, nullable=False, default=0)
+    errors = db.Column('errors', JSONB, nullable=False, default=list)
+    created = db.Column('created', db.DateTime(timezone=True), nullable=False)
+    finished = db.Column('finished', db.DateTime(timezone=True))
+
+    user = db.relationship('User', uselist=False)
+
+    __table_args__ = (db.Index('deletion_jobs_study_idx', 'study',
+                               'created'), )
+
+    def __init__(self, study, target, plan, user_id=None, records=None):
+        self.study = study
+        self.target = target
+        self.plan = plan
+        self.user_id = user_id
+        self.records = records
+        self.status = self.PENDING
+        self.completed = 0
+        self.errors = []
+        self.created = datetime.datetime.now(
+            FixedOffsetTimezone(offset=TZ_OFFSET))
+
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def set_status(self, status, error=None):
+        self.status = status
+        if error:
+            self.errors = self.errors + [error]
+        if self.is_finished():
+            self.finished = datetime.datetime.now(
+                FixedOffsetTimezone(offset=TZ_OFFSET))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'target': self.target,
+            'status': self.status,
+            'total': self.total,
+            'completed': self.completed,
+            'errors': self.errors,
+            'created': self.created.isoformat(),
+            'finished': self.finished.isoformat() if self.finished else None
+        }
+
+    def __repr__(self):
+        return "<DeletionJob {} for {} ({})>".format(
+            self.id, self.target, self.status)
+
+
 class Analysis(db.Model):
     __tablename__ = 'analyses'
 
@@ -2613,6 +3031,11 @@ class MetricValue(db.Model):
     scan = db.relationship('Scan', back_populates="metric_values")
     metrictype = db.relationship('Metrictype', back_populates="metric_values")
 
+    __table_args__ = (
+        db.Index('scan_metrics_scan_idx', 'scan_id'),
+        db.Index('scan_metrics_metric_type_idx', 'metric_type'),
+    )
+
     @property
     def value(self):
         """Returns the value field from the database.
@@ -10,11 +10,10 @@ from urllib.parse import quote, unquote
 from uuid import uuid4
 from datetime import datetime
 
-import xnat
 from sqlalchemy.orm.collections import MappedCollection, collection
-import flask_apscheduler
 
 from dashboard import scheduler
+from dashboard.task_scheduler import RemoteScheduler
 from dashboard.emails import async_exec
 
 logger = logging.getLogger(__name__)
@@ -77,7 +76,7 @@ def schedule_email(email_func, input_args, input_kwargs=None):
     dashboard.monitors.add_monitor because monitors often need classes from
     the models and using add_monitor would introduce circular dependencies.
     """
-    if isinstance(scheduler, flask_apscheduler.APScheduler):
+    if not isinstance(scheduler, RemoteScheduler):
         # You're already executing on the server side so just send the email
         email_func(*input_args)
         return
@@ -186,6 +185,9 @@ def async_xnat_update(xnat_url, user, password, xnat_archive, exp_name,
         quality (str): The quality label to apply based on whether data
             has been flagged, blacklisted or approved.
     """
+    # Imported here so only instances with XNAT_ENABLED load it
+    import xnat
+
     with xnat.connect(xnat_url, user=user, password=password) as xcon:
         project = xcon.projects[xnat_archive]
         xnat_exp = project.experiments[exp_name]
@@ -22,9 +22,13 @@ import logging
 from uuid import uuid4
 from datetime import datetime, timedelta
 
-from dashboard import scheduler
-from .models import Session
-from .emails import missing_redcap_email
+from sqlalchemy import func, distinct
+from psycopg2.tz import FixedOffsetTimezone
+
+from dashboard import db, scheduler, TZ_OFFSET
+from .models import (Session, Timepoint, Notification,
+                     study_timepoints_table)
+from .emails import notification_digest
 from .exceptions import MonitorException, SchedulerException
 
 logger = logging.getLogger(__name__)
@@ -109,6 +113,54 @@ def get_emails(users):
     return recipients
 
 
+def monitor_qc_update(timepoint):
+    """Add a scheduler job to run :py:func:`refresh_qc` right away.
+
+    Args:
+        timepoint (:obj:`dashboard.models.Timepoint`): The timepoint whose
+            QC outputs were just generated.
+
+    Raises:
+        :obj:`dashboard.exceptions.SchedulerException`: If the job cannot
+            be added to the server
+    """
+    add_monitor(refresh_qc, [timepoint.get_study().id, timepoint.name])
+
+
+def refresh_qc(study_id, name):
+    """Index a timepoint's QC folder and parse its manifests ahead of time.
+
+    This should run right after QC outputs are generated for a timepoint, so
+    the timepoint page finds them without searching the file system or
+    parsing any JSON. Clients that can't import the dashboard (e.g. datman's
+    QC scripts) can submit it through the scheduler API as
+    'dashboard.monitors:refresh_qc'.
+
+    Parsed manifests are only shared with the web server processes if
+    MANIFEST_DISK_CACHE is enabled.
+
+    Args:
+        study_id (:obj:`str`): The ID of the study the timepoint belongs to.
+        name (:obj:`str`): The name of the timepoint.
+
+    Raises:
+        :obj:`dashboard.exceptions.MonitorException`: If the timepoint
+            can't be found.
+    """
+    from .file_index import crawl, list_files
+    from .datman_utils import manifest_cache
+
+    if not Timepoint.query.get(name):
+        raise MonitorException("Timepoint {} is no longer in the database. "
+                               "Cannot refresh its QC files.".format(name))
+
+    crawl([study_id], folders=['qc'], subdir=name)
+    manifests = list_files(study_id, 'qc', name, suffix='_manifest.json',
+                           with_mtimes=True)
+    for manifest, mtime in manifests.items():
+        manifest_cache.get(manifest, mtime)
+
+
 def monitor_redcap_import(name, num, users=None, study=None):
     """Add a scheduled job to run :py:func:`check_redcap`.
 
@@ -182,6 +234,72 @@ def check_redcap(name, num, recipients=None):
     if session.redcap_record:
         return
 
-    missing_redcap_email(str(session),
-                         session.get_study().id,
-                         dest_emails=recipients)
+    Notification.queue(recipients,
+                       Notification.MISSING_REDCAP,
+                       str(session),
+                       study=session.get_study().id)
+
+
+def send_digests():
+    """Email each recipient a single summary of their queued notifications.
+
+    This runs periodically on the scheduler server (see
+    :py:data:`config.scheduler.DIGEST_HOUR`). All pending events are collected
+    with one aggregate query and each recipient receives at most one email,
+    no matter how many sessions arrived or went missing since the last digest.
+    """
+    pending = (
+        db.session.query(Notification.recipient,
+                         Notification.category,
+                         Notification.study,
+                         func.array_agg(distinct(Notification.subject)),
+                         func.array_agg(Notification.id))
+        .filter(Notification.sent == None)  # noqa: E711
+        .group_by(Notification.recipient,
+                  Notification.category,
+                  Notification.study)
+        .order_by(Notification.recipient,
+                  Notification.study,
+                  Notification.category)
+        .all()
+    )
+
+    if not pending:
+        return
+
+    digests = {}
+    qc_studies = set()
+    event_ids = []
+    for recipient, category, study, subjects, ids in pending:
+        digests.setdefault(recipient, []).append(
+            (category, study, sorted(subjects)))
+        if category == Notification.QC_NEEDED and study:
+            qc_studies.add(study)
+        event_ids.extend(ids)
+
+    remaining = {}
+    if qc_studies:
+        remaining = dict(
+            db.session.query(
+                study_timepoints_table.c.study,
+                func.array_agg(distinct(Timepoint.name))
+            ).join(Timepoint,
+                   Timepoint.name == study_timepoints_table.c.timepoint)
+            .join(Session, Session.name == Timepoint.name)
+            .filter(study_timepoints_table.c.study.in_(qc_studies))
+            .filter(Session.signed_off == False)  # noqa: E712
+            .filter(Timepoint.is_phantom == False)  # noqa: E712
+            .group_by(study_timepoints_table.c.study)
+            .all()
+        )
+
+    # Mark events sent before emailing, so a failure can't lead to the same
+    # events being reported over and over again.
+    sent = datetime.now(FixedOffsetTimezone(offset=TZ_OFFSET))
+    Notification.query\
+        .filter(Notification.id.in_(event_ids))\
+        .update({Notification.sent: sent}, synchronize_session=False)
+    db.session.commit()
+
+    for recipient, events in digests.items():
+        notification_digest(recipient, events, remaining)
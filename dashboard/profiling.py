@@ -0,0 +1,330 @@
+"""Profile a sample of requests to find out where slow pages spend their time.
+
+Two kinds of profile can be taken, and both are off by default:
+
+    * A PROFILE_SAMPLE fraction of requests are run under cProfile, which
+      records every function call made while handling the request.
+    * If PROFILE_SLOW_REQUEST is set, the stack of each request's thread is
+      sampled every PROFILE_INTERVAL milliseconds by a background thread,
+      and the samples are kept for any request that takes longer than
+      PROFILE_SLOW_REQUEST milliseconds. The overhead is small enough to
+      leave on in production, unlike cProfile's.
+
+Each profile is saved in PROFILE_DIR with a name made from the time, the
+request's endpoint and the process ID. The files saved are:
+
+    * <name>.pstats: cProfile's results, which can be read with the pstats
+      module or tools like snakeviz.
+    * <name>.collapsed: The stack samples, as one 'frame;frame;frame count'
+      line per stack. This is the format used by flamegraph.pl and
+      speedscope.
+    * <name>.json: A summary of the request and its slowest functions, shown
+      to admins on the /profiles page.
+
+Only the newest PROFILE_KEEP profiles are kept.
+"""
+import os
+import re
+import sys
+import json
+import time
+import pstats
+import random
+import cProfile
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime
+from collections import Counter
+
+from flask import g, request, current_app
+
+logger = logging.getLogger(__name__)
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def init_app(app):
+    """Start profiling an app's requests.
+
+    Does nothing unless PROFILE_SAMPLE or PROFILE_SLOW_REQUEST is set.
+    """
+    if not (app.config.get('PROFILE_SAMPLE') or
+            app.config.get('PROFILE_SLOW_REQUEST')):
+        return
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(cancel_profile)
+
+
+class StackSampler:
+    """Periodically records the stacks of threads handling requests.
+
+    Args:
+        interval (float): The number of seconds between samples.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        # Maps each watched thread's ID to the stacks seen for it
+        self._stacks = {}
+        self._thread = None
+
+    def start(self, thread_id):
+        """Begin sampling a thread's stack.
+        """
+        with self._lock:
+            self._stacks[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='dashboard-profiler', daemon=True)
+                self._thread.start()
+
+    def stop(self, thread_id):
+        """Stop sampling a thread's stack.
+
+        Returns:
+            :obj:`collections.Counter`: The number of times each collapsed
+                stack was seen.
+        """
+        with self._lock:
+            return self._stacks.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                watched = list(self._stacks)
+            if not watched:
+                continue
+            frames = sys._current_frames()
+            for thread_id in watched:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = collapse(frame)
+                with self._lock:
+                    if thread_id in self._stacks:
+                        self._stacks[thread_id][stack] += 1
+
+
+def get_sampler(interval):
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = StackSampler(interval)
+        return _sampler
+
+
+def collapse(frame):
+    """Convert a stack to the 'collapsed' format, outermost frame first.
+    """
+    names = []
+    while frame is not None:
+        names.append(get_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def get_frame_name(frame):
+    module = frame.f_globals.get('__name__', '?')
+    return '{}:{}:{}'.format(module, frame.f_code.co_name,
+                             frame.f_code.co_firstlineno)
+
+
+def start_profile():
+    config = current_app.config
+    g.profile_start = time.perf_counter()
+    sample = config.get('PROFILE_SAMPLE', 0)
+    if sample and random.random() < sample:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Newer pythons only allow one cProfile profiler at a time
+            return
+        g.profiler = profiler
+    elif config.get('PROFILE_SLOW_REQUEST'):
+        interval = config.get('PROFILE_INTERVAL', 10) / 1000
+        get_sampler(interval).start(threading.get_ident())
+        g.profile_sampled = True
+
+
+def finish_profile(response):
+    """Save the current request's profile, if it should be kept.
+
+    This is meant to be registered as an after_request handler.
+    """
+    start = g.pop('profile_start', None)
+    if start is None:
+        return response
+    elapsed = (time.perf_counter() - start) * 1000
+
+    config = current_app.config
+    profiler = g.pop('profiler', None)
+    stacks = None
+    if profiler is not None:
+        profiler.disable()
+        trigger = 'sample'
+    elif g.pop('profile_sampled', False):
+        stacks = _sampler.stop(threading.get_ident())
+        if not stacks or elapsed < config['PROFILE_SLOW_REQUEST']:
+            return response
+        trigger = 'slow'
+    else:
+        return response
+
+    summary = {
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'ms': round(elapsed, 2),
+        'trigger': trigger
+    }
+    try:
+        save_profile(config.get('PROFILE_DIR', 'profiles'), summary,
+                     profiler=profiler, stacks=stacks,
+                     interval=config.get('PROFILE_INTERVAL', 10),
+                     top=config.get('PROFILE_TOP', 20),
+                     keep=config.get('PROFILE_KEEP', 100))
+    except OSError as e:
+        logger.error("Failed to save profile for {} {} - {}".format(
+            request.method, request.path, e))
+    return response
+
+
+def cancel_profile(exc=None):
+    """Stop profiling a request that ended without a response.
+
+    This is meant to be registered as a teardown_request handler.
+    """
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+    if g.pop('profile_sampled', False):
+        _sampler.stop(threading.get_ident())
+
+
+def save_profile(folder, summary, profiler=None, stacks=None, interval=10,
+                 top=20, keep=100):
+    """Write a request's profile to disk.
+
+    Args:
+        folder (:obj:`str`): The directory to save the profile in.
+        summary (dict): Details of the request to save with the profile.
+        profiler (:obj:`cProfile.Profile`, optional): A finished cProfile
+            profiler.
+        stacks (:obj:`collections.Counter`, optional): The number of times
+            each collapsed stack was sampled.
+        interval (float, optional): The milliseconds between stack samples.
+        top (int, optional): The number of functions to list in the summary.
+        keep (int, optional): The number of profiles to keep in the folder.
+
+    Returns:
+        str: The name the profile was saved under.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    name = '{}_{}_{}'.format(
+        datetime.now().strftime('%Y%m%d-%H%M%S-%f'),
+        re.sub(r'[^\w.-]', '_', summary.get('endpoint') or 'unknown'),
+        os.getpid())
+
+    summary = dict(summary, name=name, time=datetime.now().isoformat(),
+                   files=[])
+    if profiler is not None:
+        profiler.dump_stats(str(folder / (name + '.pstats')))
+        summary['files'].append(name + '.pstats')
+        summary['top'] = get_top_functions(profiler, top)
+    if stacks:
+        with open(folder / (name + '.collapsed'), 'w') as fh:
+            for stack, count in stacks.most_common():
+                fh.write('{} {}\n'.format(stack, count))
+        summary['files'].append(name + '.collapsed')
+        summary['samples'] = sum(stacks.values())
+        summary['top'] = get_top_frames(stacks, interval, top)
+
+    with open(folder / (name + '.json'), 'w') as fh:
+        json.dump(summary, fh)
+    prune(folder, keep)
+    return name
+
+
+def get_top_functions(profiler, top=20):
+    """List the functions a cProfile profile spent the most time in.
+
+    Returns:
+        list: A dictionary with the 'function', number of 'calls', time
+            spent in the function itself ('self_ms') and time including the
+            functions it called ('total_ms') for each of the top functions,
+            ordered by self time.
+    """
+    stats = pstats.Stats(profiler).stats
+    found = []
+    for (filename, line, func), (_, calls, self_time, total_time, _) in \
+            stats.items():
+        found.append({
+            'function': '{}:{}({})'.format(filename, line, func),
+            'calls': calls,
+            'self_ms': round(self_time * 1000, 2),
+            'total_ms': round(total_time * 1000, 2)
+        })
+    found.sort(key=lambda item: item['self_ms'], reverse=True)
+    return found[:top]
+
+
+def get_top_frames(stacks, interval, top=20):
+    """List the frames most often seen in a set of stack samples.
+
+    Returns:
+        list: A dictionary with the 'function', the estimated time spent in
+            the function itself ('self_ms') and the estimated time including
+            the functions it called ('total_ms') for each of the top frames,
+            ordered by self time.
+    """
+    own = Counter()
+    total = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return [{'function': frame,
+             'self_ms': round(count * interval, 2),
+             'total_ms': round(total[frame] * interval, 2)}
+            for frame, count in own.most_common(top)]
+
+
+def prune(folder, keep):
+    """Delete all but the newest 'keep' profiles in a folder.
+    """
+    found = sorted(Path(folder).glob('*.json'), reverse=True)
+    for summary in found[keep:]:
+        for item in Path(folder).glob(summary.stem + '.*'):
+            item.unlink()
+
+
+def get_profiles(folder, limit=None):
+    """Read the summaries of the profiles saved in a folder.
+
+    Args:
+        folder (:obj:`str`): The directory profiles are saved in.
+        limit (int, optional): The maximum number of profiles to read.
+
+    Returns:
+        list: The summary dictionary of each profile, newest first.
+    """
+    folder = Path(folder)
+    if not folder.is_dir():
+        return []
+    profiles = []
+    for item in sorted(folder.glob('*.json'), reverse=True)[:limit]:
+        try:
+            with open(item) as fh:
+                profiles.append(json.load(fh))
+        except (OSError, ValueError) as e:
+            logger.error("Can't read profile {} - {}".format(item, e))
+    return profiles
@@ -1,8 +1,10 @@
 """Reusable database queries.
 """
 import logging
+from itertools import islice
 
-from sqlalchemy import not_, and_, or_, func
+from sqlalchemy import not_, and_, or_, func, tuple_, any_, literal
+from sqlalchemy.dialects.postgresql import ARRAY
 
 from dashboard import db
 from .models import (Timepoint, Session, Scan, Study, Site, Metrictype,
@@ -14,6 +16,27 @@ import datman.scanid as scanid
 
 logger = logging.getLogger(__name__)
 
+# The maximum number of keys to send to the database in a single query
+CHUNK_SIZE = 1000
+
+
+def chunked(items, size=CHUNK_SIZE):
+    """Split an iterable into lists of at most 'size' items.
+
+    Args:
+        items (iterable): The items to split up.
+        size (int, optional): The maximum length of each list.
+
+    Yields:
+        list: The next group of items.
+    """
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
 
 def get_studies(name=None, tag=None, site=None, create=False):
     """Find a study or studies based on search terms.
@@ -93,6 +116,25 @@ def get_session(name, num):
     return Session.query.get((name, num))
 
 
+def get_sessions(keys):
+    """Get many sessions at once.
+
+    Args:
+        keys (:obj:`list` of :obj:`tuple`): A list of (name, num) tuples,
+            where name is a timepoint name and num is a session number.
+
+    Returns:
+        dict: A dictionary mapping each (name, num) tuple that was found to
+            its :obj:`dashboard.models.Session` record.
+    """
+    found = {}
+    for chunk in chunked(set(keys)):
+        query = Session.query.filter(
+            tuple_(Session.name, Session.num).in_(chunk))
+        found.update({(item.name, item.num): item for item in query})
+    return found
+
+
 def get_timepoint(name, bids_ses=None, study=None):
     """
     Used by datman. Return one timepoint or None
@@ -110,6 +152,24 @@ def get_timepoint(name, bids_ses=None, study=None):
     return query.first()
 
 
+def get_timepoints(names):
+    """Get many timepoints at once.
+
+    Args:
+        names (:obj:`list` of :obj:`str`): A list of timepoint names.
+
+    Returns:
+        dict: A dictionary mapping each timepoint name that was found to its
+            :obj:`dashboard.models.Timepoint` record.
+    """
+    found = {}
+    for chunk in chunked(set(names)):
+        query = Timepoint.query.filter(
+            Timepoint.name == any_(literal(chunk, ARRAY(db.String))))
+        found.update({item.name: item for item in query})
+    return found
+
+
 def get_study_timepoints(study, site=None, phantoms=False):
     """Obtains all timepoints from Studies model
 
@@ -193,6 +253,24 @@ def get_scan(scan_name, timepoint=None, session=None, bids=False):
     return query.all()
 
 
+def get_scans(names):
+    """Get many scans at once.
+
+    Args:
+        names (:obj:`list` of :obj:`str`): A list of scan names.
+
+    Returns:
+        dict: A dictionary mapping each scan name that was found to its
+            :obj:`dashboard.models.Scan` record.
+    """
+    found = {}
+    for chunk in chunked(set(names)):
+        query = Scan.query.filter(
+            Scan.name == any_(literal(chunk, ARRAY(db.String))))
+        found.update({item.name: item for item in query})
+    return found
+
+
 def find_scans(search_str):
     """
     Used by the dashboard's search bar and so must work around fuzzy user
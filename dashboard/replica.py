@@ -0,0 +1,77 @@
+"""Send queries from read-only views to a replica of the database.
+
+If a 'replica' bind is configured (see POSTGRES_REPLICA_SRVR) views marked
+with :py:func:`dashboard.utils.read_only` run their queries against it,
+reducing the load on the primary server. Everything else uses the primary
+server, which is also used:
+
+    * When no replica is configured.
+    * For any flush (i.e. writes), and for the rest of the database session
+      after one, so a view always sees its own changes.
+    * For REPLICA_RETRY seconds after the replica couldn't be reached. The
+      view that failed is run again against the primary server.
+
+Replicas may lag slightly behind the primary server, so a read-only view
+may not show a change made moments before by another request.
+"""
+import time
+import logging
+
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+
+logger = logging.getLogger(__name__)
+
+# The time (from time.monotonic) until which the replica shouldn't be used
+_replica_down_until = 0
+
+
+class RoutingSession(SignallingSession):
+    """A database session that can send its queries to the replica.
+
+    Queries go to the replica when the session's 'use_replica' info key is
+    set, a replica is configured and it hasn't recently failed.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing:
+            self.info.pop('use_replica', None)
+        elif self.info.get('use_replica') and replica_available(self.app):
+            return get_state(self.app).db.get_engine(self.app, bind='replica')
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Adds replica routing to flask-sqlalchemy's sessions.
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def replica_available(app):
+    """Check whether queries can be sent to the replica.
+
+    Args:
+        app (:obj:`flask.Flask`): The current app.
+
+    Returns:
+        bool: True if a replica is configured and hasn't recently failed.
+    """
+    if 'replica' not in (app.config.get('SQLALCHEMY_BINDS') or {}):
+        return False
+    return time.monotonic() >= _replica_down_until
+
+
+def mark_replica_down(app, reason=None):
+    """Stop using the replica for REPLICA_RETRY seconds.
+
+    Args:
+        app (:obj:`flask.Flask`): The current app.
+        reason (optional): The error raised by the replica.
+    """
+    global _replica_down_until
+    retry = app.config.get('REPLICA_RETRY', 60)
+    _replica_down_until = time.monotonic() + retry
+    logger.error("Database replica failed, using the primary server for the "
+                 "next {} seconds. Reason - {}".format(retry, reason))
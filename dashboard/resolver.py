@@ -0,0 +1,159 @@
+"""Resolve datman style subject IDs to dashboard records.
+
+Every data entry trigger, imported session, etc. starts with a subject ID
+that must be matched to a study (through its study code and site) and to any
+timepoint and session that already exist for it. Study codes rarely change, so
+rather than querying study_sites and alt_study_codes for every ID they're kept
+in an in-memory index. The index is rebuilt whenever either table is modified
+through this process's database session, and at least every ID_RESOLVER_TTL
+seconds to catch changes made by other processes.
+
+Resolving an ID with :py:func:`resolve` makes at most one database query (to
+find the timepoint and its sessions).
+"""
+import time
+import logging
+import threading
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SessionBase
+
+from datman import scanid
+from dashboard import db
+from .models import StudySite, AltStudyCode, Timepoint
+
+logger = logging.getLogger(__name__)
+
+Resolved = namedtuple('Resolved', 'studies site timepoint session')
+Resolved.__doc__ = """The dashboard records that match a subject ID.
+
+Attributes:
+    studies (:obj:`list` of :obj:`str`): The IDs of studies that use the
+        subject ID's study code at its site.
+    site (:obj:`str`): The subject ID's site.
+    timepoint (:obj:`dashboard.models.Timepoint`): The matching timepoint,
+        or None if it doesn't exist yet.
+    session (:obj:`dashboard.models.Session`): The matching session, or None
+        if it doesn't exist yet (or the ID has no session number).
+"""
+
+
+class IdResolver:
+    """An index of study codes to the studies that use them.
+
+    Args:
+        ttl (int, optional): The maximum number of seconds to use an index
+            before rebuilding it. If not given, ID_RESOLVER_TTL from the app
+            config is used.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._index = None
+        self._built = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Discard the index so it's rebuilt on next use.
+        """
+        self._index = None
+
+    def find_studies(self, code, site):
+        """Find the studies that use a study code at a given site.
+
+        Args:
+            code (:obj:`str`): A study code (e.g. SPN01) as found in the first
+                field of a datman style subject ID.
+            site (:obj:`str`): A site code (e.g. CMH).
+
+        Returns:
+            list: A sorted list of :obj:`str` study IDs. May be empty.
+        """
+        return list(self._get_index().get((code, site), []))
+
+    def resolve(self, ident):
+        """Find the dashboard records matching a parsed subject ID.
+
+        Args:
+            ident (:obj:`datman.scanid.Identifier`): A parsed subject ID.
+
+        Returns:
+            :obj:`Resolved`: The study IDs, site, and the timepoint and
+                session (if they exist).
+        """
+        studies = self.find_studies(ident.study, ident.site)
+        timepoint = Timepoint.query.get(
+            ident.get_full_subjectid_with_timepoint())
+
+        session = None
+        if timepoint:
+            try:
+                num = scanid.get_session_num(ident)
+            except scanid.ParseException:
+                num = None
+            session = timepoint.sessions.get(num)
+
+        return Resolved(studies, ident.site, timepoint, session)
+
+    def _get_index(self):
+        index = self._index
+        if index is None or time.monotonic() - self._built > self._get_ttl():
+            index = self._build_index()
+        return index
+
+    def _get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return current_app.config['ID_RESOLVER_TTL']
+
+    def _build_index(self):
+        codes = db.session.query(
+            StudySite.code, StudySite.site_id, StudySite.study_id
+        ).union_all(
+            db.session.query(
+                AltStudyCode.code, AltStudyCode.site_id, AltStudyCode.study_id
+            )
+        )
+
+        index = {}
+        for code, site, study in codes:
+            if code:
+                index.setdefault((code, site), set()).add(study)
+        index = {key: sorted(val) for key, val in index.items()}
+
+        with self._lock:
+            self._index = index
+            self._built = time.monotonic()
+        return index
+
+
+resolver = IdResolver()
+
+
+def resolve(ident):
+    """Find the dashboard records matching a parsed subject ID.
+
+    See :py:meth:`IdResolver.resolve` for details.
+    """
+    return resolver.resolve(ident)
+
+
+def _modifies_index(instances):
+    return any(isinstance(item, (StudySite, AltStudyCode))
+               for item in instances)
+
+
+@event.listens_for(SessionBase, 'after_flush')
+def _invalidate_after_flush(session, flush_context):
+    if _modifies_index(session.new) or _modifies_index(session.dirty) or \
+            _modifies_index(session.deleted):
+        resolver.invalidate()
+
+
+@event.listens_for(SessionBase, 'after_bulk_update')
+@event.listens_for(SessionBase, 'after_bulk_delete')
+def _invalidate_after_bulk_change(context):
+    if context.mapper.class_ in (StudySite, AltStudyCode):
+        resolver.invalidate()
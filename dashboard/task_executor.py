@@ -0,0 +1,47 @@
+"""A scheduler job executor that runs jobs inside the app context.
+
+This is kept apart from dashboard.task_scheduler so that only the scheduler
+server, which is the only one to run jobs, has to import APScheduler.
+"""
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.executors.base import run_job
+
+
+class ContextThreadExecutor(ThreadPoolExecutor):
+    """Runs all scheduler jobs within the app context.
+
+    By default ThreadPoolExecutor does not propagate the app context correctly
+    when it submits jobs to its pool to execute. This class fixes the problem
+    by replacing the 'run_job' function submitted to the thread pool with
+    the 'context_run' wrapper which ensures a context has been pushed before
+    'run_job' executes.
+    """
+
+    def _do_submit_job(self, job, run_times):
+        """Submits a job to the thread pool.
+
+        This function is almost identical to BasePoolExecutor._do_submit_job
+        from apscheduler.executors.pool as of version 3.6.3. The only change
+        (aside from fixing line lengths) is to the call to self._pool.submit,
+        where run_job has been replaced with context_run and the app has
+        been added as an argument.
+        """
+        def callback(f):
+            exc, tb = (
+                f.exception_info() if hasattr(f, 'exception_info') else
+                (f.exception(), getattr(f.exception(), '__traceback__', None))
+            )
+            if exc:
+                self._run_job_error(job.id, exc, tb)
+            else:
+                self._run_job_success(job.id, f.result())
+
+        f = self._pool.submit(
+            context_run, self._scheduler.app, job, job._jobstore_alias,
+            run_times, self._logger.name)
+        f.add_done_callback(callback)
+
+
+def context_run(app, job, jobstore_alias, run_times, logger_name):
+    with app.app_context():
+        return run_job(job, jobstore_alias, run_times, logger_name)
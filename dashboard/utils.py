@@ -7,10 +7,14 @@ from functools import wraps
 
 from urllib.parse import urlparse, urljoin
 from flask_login import current_user
-from flask import flash, url_for, request, redirect
+from flask import flash, url_for, request, redirect, current_app
 from werkzeug.routing import RequestRedirect
+from sqlalchemy.exc import OperationalError
+from psycopg2.extensions import QueryCanceledError
 
+from dashboard import db
 from .models import Timepoint, Scan
+from .replica import replica_available, mark_replica_down
 
 logger = logging.getLogger(__name__)
 
@@ -113,6 +117,45 @@ def study_admin_required(f):
     return decorated_function
 
 
+def read_only(f):
+    """
+    Sends a view's queries to the database replica, if one is configured.
+    Only use this for views that don't change the database (or call
+    use_primary() before reading anything they'll change). If the replica
+    can't be reached the view is run again using the primary server.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if (db.session.info.get('use_replica') or
+                not replica_available(current_app)):
+            # Already routed by an enclosing read_only view, or no replica
+            return f(*args, **kwargs)
+        db.session.info['use_replica'] = True
+        try:
+            return f(*args, **kwargs)
+        except OperationalError as e:
+            if (not db.session.info.get('use_replica') or
+                    isinstance(e.orig, QueryCanceledError)):
+                # Raised by the primary server, or a statement timed out
+                raise
+            db.session.rollback()
+            db.session.info.pop('use_replica', None)
+            mark_replica_down(current_app, e)
+            return f(*args, **kwargs)
+        finally:
+            db.session.info.pop('use_replica', None)
+
+    return decorated_function
+
+
+def use_primary():
+    """
+    Sends the rest of the current request's queries to the primary database
+    server, for read_only views that are about to change something.
+    """
+    db.session.info.pop('use_replica', None)
+
+
 def prev_url():
     """
     Returns the referring page if it is safe to do so, otherwise directs
@@ -0,0 +1,50 @@
+"""Add a table to track background data deletion jobs.
+
+Revision ID: 2c6a8e1f9d37
+Revises: 5b7e9f04c2d8
+Create Date: 2026-10-19 16:03:51.572904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '2c6a8e1f9d37'
+down_revision = '5b7e9f04c2d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'deletion_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('study', sa.String(length=32), nullable=False),
+        sa.Column('target', sa.String(length=256), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('plan', postgresql.JSONB(astext_type=sa.Text()),
+                  nullable=False),
+        sa.Column('records', postgresql.JSONB(astext_type=sa.Text()),
+                  nullable=True),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=True),
+        sa.Column('completed', sa.Integer(), nullable=False),
+        sa.Column('errors', postgresql.JSONB(astext_type=sa.Text()),
+                  nullable=False),
+        sa.Column('created', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('finished', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['study'], ['studies.id'],
+                                ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'],
+                                ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('deletion_jobs_study_idx', 'deletion_jobs',
+                    ['study', 'created'], unique=False)
+
+
+def downgrade():
+    op.drop_index('deletion_jobs_study_idx', table_name='deletion_jobs')
+    op.drop_table('deletion_jobs')
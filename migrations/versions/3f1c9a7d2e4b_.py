@@ -0,0 +1,43 @@
+"""Add a table to queue notifications for digest emails.
+
+Revision ID: 3f1c9a7d2e4b
+Revises: b265c18f529c
+Create Date: 2026-10-19 09:12:31.184202
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2e4b'
+down_revision = 'b265c18f529c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'notifications',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('recipient', sa.String(length=256), nullable=False),
+        sa.Column('category', sa.String(length=32), nullable=False),
+        sa.Column('study', sa.String(length=32), nullable=True),
+        sa.Column('subject', sa.String(length=128), nullable=False),
+        sa.Column('created', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('sent', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['study'], ['studies.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'notifications_pending_idx',
+        'notifications',
+        ['recipient'],
+        postgresql_where=sa.text('sent IS NULL')
+    )
+
+
+def downgrade():
+    op.drop_index('notifications_pending_idx', table_name='notifications')
+    op.drop_table('notifications')
@@ -0,0 +1,35 @@
+"""Add a table to index files in each study's nii, qc and resources folders.
+
+Revision ID: 5b7e9f04c2d8
+Revises: 8d5e20b6c7a1
+Create Date: 2026-10-19 14:12:38.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e9f04c2d8'
+down_revision = '8d5e20b6c7a1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'file_index',
+        sa.Column('study', sa.String(length=32), nullable=False),
+        sa.Column('folder', sa.String(length=32), nullable=False),
+        sa.Column('subdir', sa.String(length=256), nullable=False),
+        sa.Column('name', sa.String(length=1024), nullable=False),
+        sa.Column('path', sa.Text(), nullable=False),
+        sa.Column('mtime', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['study'], ['studies.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('study', 'folder', 'subdir', 'name')
+    )
+
+
+def downgrade():
+    op.drop_table('file_index')
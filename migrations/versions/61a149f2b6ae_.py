@@ -0,0 +1,65 @@
+"""Add indexes for the most frequently searched and joined columns.
+
+Plain indexes are added for foreign keys that are looked up from the 'many'
+side, functional indexes for case-insensitive name matches and trigram
+indexes for the substring searches run by the search bar. The trigram
+indexes need the pg_trgm extension, which is left installed on downgrade.
+
+scan_checklist.scan_id is already indexed by its unique constraint.
+
+Revision ID: 61a149f2b6ae
+Revises: 2c6a8e1f9d37
+Create Date: 2026-10-19 18:22:07.418730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '61a149f2b6ae'
+down_revision = '2c6a8e1f9d37'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('study_timepoints_timepoint_idx', 'study_timepoints', ['timepoint']),
+    ('timepoints_site_idx', 'timepoints', ['site']),
+    ('timepoints_bids_idx', 'timepoints', ['bids_name', 'bids_sess']),
+    ('scans_session_idx', 'scans', ['timepoint', 'session']),
+    ('scan_metrics_scan_idx', 'scan_metrics', ['scan_id']),
+    ('scan_metrics_metric_type_idx', 'scan_metrics', ['metric_type']),
+    ('gold_standards_expected_scan_idx', 'gold_standards',
+     ['study', 'site', 'scantype']),
+    ('sessions_name_upper_idx', 'sessions', [sa.text('upper(name)')]),
+    ('scans_timepoint_upper_idx', 'scans', [sa.text('upper(timepoint)')]),
+]
+
+TRIGRAM_INDEXES = [
+    ('timepoints_name_trgm_idx', 'timepoints', 'name'),
+    ('sessions_name_trgm_idx', 'sessions', 'name'),
+    ('scans_name_trgm_idx', 'scans', 'name'),
+    ('scans_timepoint_trgm_idx', 'scans', 'timepoint'),
+    ('scans_tag_trgm_idx', 'scans', 'tag'),
+    ('scans_description_trgm_idx', 'scans', 'description'),
+]
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+    for name, table, column in TRIGRAM_INDEXES:
+        op.create_index(
+            name,
+            table,
+            [sa.text('upper({}) gin_trgm_ops'.format(column))],
+            postgresql_using='gin'
+        )
+
+
+def downgrade():
+    for name, table, _ in reversed(TRIGRAM_INDEXES):
+        op.drop_index(name, table_name=table)
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
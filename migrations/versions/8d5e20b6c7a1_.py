@@ -0,0 +1,48 @@
+"""Add a table to queue incoming REDCap data entry triggers.
+
+Revision ID: 8d5e20b6c7a1
+Revises: 3f1c9a7d2e4b
+Create Date: 2026-10-19 10:41:07.551630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8d5e20b6c7a1'
+down_revision = '3f1c9a7d2e4b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'redcap_triggers',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('url', sa.String(length=1024), nullable=False),
+        sa.Column('project_id', sa.Integer(), nullable=False),
+        sa.Column('instrument', sa.String(length=1024), nullable=False),
+        sa.Column('record', sa.String(length=256), nullable=False),
+        sa.Column('event_name', sa.String(length=256), nullable=True),
+        sa.Column('contents', postgresql.JSONB(astext_type=sa.Text()),
+                  nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('received', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('processed', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'redcap_triggers_pending_idx',
+        'redcap_triggers',
+        ['received'],
+        postgresql_where=sa.text("status = 'pending'")
+    )
+
+
+def downgrade():
+    op.drop_index('redcap_triggers_pending_idx',
+                  table_name='redcap_triggers')
+    op.drop_table('redcap_triggers')
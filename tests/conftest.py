@@ -18,6 +18,8 @@ def dash_app(request):
     app.config["SQLALCHEMY_DATABASE_URI"] = app.config[
         "SQLALCHEMY_TEST_DATABASE_URI"
     ]
+    # Never read from a configured replica of the real database
+    app.config["SQLALCHEMY_BINDS"] = {}
 
     if not database_exists(app.config["SQLALCHEMY_DATABASE_URI"]):
         create_database(app.config["SQLALCHEMY_DATABASE_URI"])
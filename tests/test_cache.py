@@ -0,0 +1,234 @@
+import time
+
+import pytest
+from mock import Mock
+
+import dashboard
+from dashboard import cache as cache_module
+from dashboard.cache import FragmentCache, permission_key, get_tags
+
+
+class FakeBackend:
+    """Stands in for a redis server shared by several processes.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.versions = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value, ttl):
+        self.entries[key] = value
+
+    def get_versions(self, tags):
+        return {tag: self.versions.get(tag, 0) for tag in tags}
+
+    def bump(self, tags):
+        for tag in tags:
+            self.versions[tag] = self.versions.get(tag, 0) + 1
+
+
+class TestFragmentCache:
+
+    def test_value_is_built_once_and_then_reused(self):
+        cache = FragmentCache()
+        build = Mock(return_value="contents")
+
+        assert cache.get_or_set(("page", "STUDY1"), build) == "contents"
+        assert cache.get_or_set(("page", "STUDY1"), build) == "contents"
+        assert build.call_count == 1
+
+    def test_keys_are_kept_separate(self):
+        cache = FragmentCache()
+        cache.get_or_set(("page", "STUDY1"), lambda: "one")
+
+        assert cache.get_or_set(("page", "STUDY2"), lambda: "two") == "two"
+
+    def test_invalidating_a_tag_rebuilds_entries_that_use_it(self):
+        cache = FragmentCache()
+        cache.get_or_set(("a",), lambda: 1, tags=["Timepoint"])
+        cache.get_or_set(("b",), lambda: 1, tags=["Scantype"])
+
+        cache.invalidate(["Timepoint"])
+
+        assert cache.get_or_set(("a",), lambda: 2, tags=["Timepoint"]) == 2
+        assert cache.get_or_set(("b",), lambda: 2, tags=["Scantype"]) == 1
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = FragmentCache(max_size=2)
+        cache.get_or_set(("a",), lambda: 1)
+        cache.get_or_set(("b",), lambda: 1)
+        cache.get_or_set(("a",), lambda: 1)
+        cache.get_or_set(("c",), lambda: 1)
+
+        assert cache.get_or_set(("a",), lambda: 2) == 1
+        assert cache.get_or_set(("b",), lambda: 2) == 2
+        assert cache.get_stats()["evictions"] == 2
+
+    def test_expired_entries_are_rebuilt(self):
+        cache = FragmentCache(ttl=0)
+        cache.get_or_set(("a",), lambda: 1)
+        time.sleep(0.01)
+
+        assert cache.get_or_set(("a",), lambda: 2) == 2
+
+    def test_disabled_cache_always_builds(self):
+        cache = FragmentCache()
+        cache.enabled = False
+        cache.get_or_set(("a",), lambda: 1)
+
+        assert cache.get_or_set(("a",), lambda: 2) == 2
+
+    def test_stats_count_hits_and_misses(self):
+        cache = FragmentCache()
+        for _ in range(3):
+            cache.get_or_set(("a",), lambda: 1)
+
+        stats = cache.get_stats()
+        assert stats["hits"] == 2
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.667
+        assert stats["size"] == 1
+
+    def test_entries_are_shared_through_backend(self):
+        backend = FakeBackend()
+        first, second = FragmentCache(), FragmentCache()
+        first.backend = second.backend = backend
+
+        first.get_or_set(("a",), lambda: 1, tags=["Study"])
+
+        assert second.get_or_set(("a",), lambda: 2, tags=["Study"]) == 1
+        assert second.get_stats()["shared_hits"] == 1
+
+    def test_invalidation_reaches_other_processes_through_backend(self):
+        backend = FakeBackend()
+        first, second = FragmentCache(), FragmentCache()
+        first.backend = second.backend = backend
+        first.get_or_set(("a",), lambda: 1, tags=["Study"])
+        second.get_or_set(("a",), lambda: 1, tags=["Study"])
+
+        first.invalidate(["Study"])
+
+        assert second.get_or_set(("a",), lambda: 2, tags=["Study"]) == 2
+
+    def test_entry_ttl_can_be_shorter_than_cache_ttl(self):
+        cache = FragmentCache(ttl=300)
+        cache.get_or_set(("a",), lambda: 1, ttl=0)
+        cache.get_or_set(("b",), lambda: 1, ttl=600)
+        time.sleep(0.01)
+
+        assert cache.get_or_set(("a",), lambda: 2) == 2
+        assert cache.get_or_set(("b",), lambda: 2) == 1
+
+    def test_entries_built_from_replica_expire_sooner(self, monkeypatch):
+        monkeypatch.setattr(cache_module, "_reading_replica", lambda: True)
+        cache = FragmentCache(ttl=300, replica_ttl=0)
+        cache.get_or_set(("a",), lambda: 1)
+
+        assert cache.get_or_set(("a",), lambda: 2) == 2
+        assert cache.get_stats()["size"] == 0
+
+    def test_unreachable_backend_falls_back_to_memory(self):
+        backend = Mock()
+        backend.get_versions.side_effect = ConnectionError("down")
+        cache = FragmentCache()
+        cache.backend = backend
+
+        cache.get_or_set(("a",), lambda: 1, tags=["Study"])
+
+        assert cache.get_or_set(("a",), lambda: 2, tags=["Study"]) == 1
+        assert not backend.set.called
+        assert cache.get_stats()["errors"] == 2
+
+
+class TestPermissionKey:
+
+    def test_admins_share_a_key(self):
+        assert permission_key(Mock(dashboard_admin=True)) == "admin"
+
+    def test_users_with_same_permissions_share_a_key(self):
+        assert permission_key(self.make_user("CMH")) == \
+            permission_key(self.make_user("CMH"))
+
+    def test_users_with_different_sites_get_different_keys(self):
+        assert permission_key(self.make_user("CMH")) != \
+            permission_key(self.make_user("UTO"))
+
+    def test_other_studies_ignored_when_study_given(self):
+        user = self.make_user("CMH")
+        other = self.make_user("CMH")
+        other.get_permissions.return_value["STUDY2"] = (3, 3, {})
+
+        assert permission_key(user, "STUDY1") == \
+            permission_key(other, "STUDY1")
+        assert permission_key(user) != permission_key(other)
+
+    def make_user(self, site):
+        permissions = {"STUDY1": (33, 0, {site: 33})}
+        return Mock(dashboard_admin=False, is_authenticated=True,
+                    get_permissions=Mock(return_value=permissions))
+
+
+class TestModelInvalidation:
+
+    def test_get_tags_includes_study_for_study_records(self):
+        study_site = dashboard.models.StudySite("STUDY1", "CMH")
+        assert get_tags(study_site) == {"StudySite", "Study:STUDY1"}
+
+    def test_get_tags_includes_user_for_user_records(self):
+        study_user = dashboard.models.StudyUser("STUDY1", 3)
+        assert get_tags(study_user) == {"StudyUser", "Study:STUDY1",
+                                        "User:3"}
+
+    def test_commit_invalidates_changed_models(self, dash_db, fresh_cache):
+        fresh_cache.get_or_set(("a",), lambda: 1, tags=["Study"])
+        fresh_cache.get_or_set(("b",), lambda: 1, tags=["Scantype"])
+
+        dash_db.session.add(dashboard.models.Study("STUDY1"))
+        dash_db.session.commit()
+
+        assert fresh_cache.get_or_set(("a",), lambda: 2, tags=["Study"]) == 2
+        assert fresh_cache.get_or_set(
+            ("b",), lambda: 2, tags=["Scantype"]) == 1
+
+    def test_rollback_does_not_invalidate(self, dash_db, fresh_cache):
+        fresh_cache.get_or_set(("a",), lambda: 1, tags=["Study"])
+
+        dash_db.session.add(dashboard.models.Study("STUDY1"))
+        dash_db.session.flush()
+        dash_db.session.rollback()
+        dash_db.session.commit()
+
+        assert fresh_cache.get_or_set(("a",), lambda: 2, tags=["Study"]) == 1
+
+    def test_explicit_tags_invalidated_on_commit(self, dash_db,
+                                                 fresh_cache):
+        fresh_cache.get_or_set(("a",), lambda: 1, tags=["Study:STUDY1"])
+
+        cache_module.invalidate_on_commit(dash_db.session, ["Study:STUDY1"])
+        assert fresh_cache.get_or_set(
+            ("a",), lambda: 2, tags=["Study:STUDY1"]) == 1
+
+        dash_db.session.commit()
+        assert fresh_cache.get_or_set(
+            ("a",), lambda: 2, tags=["Study:STUDY1"]) == 2
+
+    def test_explicit_tags_dropped_on_rollback(self, dash_db, fresh_cache):
+        fresh_cache.get_or_set(("a",), lambda: 1, tags=["Study:STUDY1"])
+
+        dash_db.session.add(dashboard.models.Study("STUDY1"))
+        dash_db.session.flush()
+        cache_module.invalidate_on_commit(dash_db.session, ["Study:STUDY1"])
+        dash_db.session.rollback()
+        dash_db.session.commit()
+
+        assert fresh_cache.get_or_set(
+            ("a",), lambda: 2, tags=["Study:STUDY1"]) == 1
+
+    @pytest.fixture
+    def fresh_cache(self, monkeypatch):
+        fresh = FragmentCache()
+        monkeypatch.setattr(cache_module, "cache", fresh)
+        return fresh
@@ -1,4 +1,6 @@
 import os
+import json
+import glob
 import pytest
 from mock import patch, Mock
 from json import JSONDecodeError
@@ -10,6 +12,86 @@ import dashboard.datman_utils as dm_utils
 FIXTURES = "fixtures/test_datman_utils"
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    dm_utils.config_cache.clear()
+    dm_utils.manifest_cache.clear()
+    yield
+    dm_utils.config_cache.clear()
+    dm_utils.manifest_cache.clear()
+
+
+class TestConfigCache:
+
+    @patch("datman.config.config")
+    def test_config_reused_while_files_unchanged(self, mock_config,
+                                                 config_files):
+        mock_config.side_effect = lambda study=None: self.make_config(
+            config_files)
+
+        first = dm_utils.get_config("STUDY")
+        second = dm_utils.get_config("STUDY")
+
+        assert first is second
+        assert mock_config.call_count == 1
+        assert dm_utils.config_cache.saved >= 1
+
+    @patch("datman.config.config")
+    def test_config_reread_when_study_config_modified(self, mock_config,
+                                                      config_files):
+        mock_config.side_effect = lambda study=None: self.make_config(
+            config_files)
+
+        first = dm_utils.get_config("STUDY")
+        stat = os.stat(config_files[1])
+        os.utime(config_files[1], ns=(stat.st_atime_ns,
+                                      stat.st_mtime_ns + 1000000000))
+        second = dm_utils.get_config("STUDY")
+
+        assert first is not second
+        assert mock_config.call_count == 2
+
+    @patch("datman.config.config")
+    def test_configs_cached_per_study(self, mock_config, config_files):
+        mock_config.side_effect = lambda study=None: self.make_config(
+            config_files)
+
+        study1 = dm_utils.get_config("STUDY1")
+        study2 = dm_utils.get_config("STUDY2")
+
+        assert study1 is not study2
+        assert dm_utils.get_config("STUDY1") is study1
+        assert mock_config.call_count == 2
+
+    @patch("datman.config.config")
+    def test_study_path_does_not_switch_cached_config_study(
+            self, mock_config, config_files):
+        config = self.make_config(config_files)
+        mock_config.return_value = config
+
+        dm_utils.get_study_path("STUDY", "qc")
+        dm_utils.get_study_path("STUDY", "nii")
+
+        assert mock_config.call_count == 1
+        for call in config.get_path.call_args_list:
+            assert len(call[0]) == 1 and "study" not in call[1]
+
+    def make_config(self, files):
+        config = Mock(spec=datman.config.config)
+        config.site_config_path = files[0]
+        config.study_config_file = files[1]
+        return config
+
+    @pytest.fixture
+    def config_files(self, tmp_path):
+        files = []
+        for name in ["site_config.yml", "study_config.yml"]:
+            path = tmp_path / name
+            path.write_text("key: value\n")
+            files.append(str(path))
+        return files
+
+
 class TestGetManifests:
 
     qc_dir = os.path.join(
@@ -63,6 +145,59 @@ class TestGetManifests:
                 json_contents = manifests[session][scan]
                 assert "Error" in json_contents
 
+    @patch("json.load")
+    @patch("datman.config.config")
+    def test_unchanged_manifests_not_reparsed(
+            self, patch_config, mock_json, config, timepoint):
+        patch_config.return_value = config
+        mock_json.return_value = {"item": {"order": 1}}
+
+        first = dm_utils.get_manifests(timepoint)
+        parsed = mock_json.call_count
+        second = dm_utils.get_manifests(timepoint)
+
+        assert parsed == 3
+        assert mock_json.call_count == parsed
+        assert first == second
+
+    @patch("json.load")
+    def test_manifest_reparsed_when_mtime_changes(self, mock_json,
+                                                  timepoint):
+        mock_json.return_value = {"item": {"order": 1}}
+        manifests = {
+            path: os.stat(path).st_mtime
+            for path in glob.glob(os.path.join(
+                self.qc_dir, "STUDY_SITE_0001_01", "*_manifest.json"))
+        }
+
+        dm_utils.get_manifests(timepoint, manifests=manifests)
+        changed = {path: mtime + 1 for path, mtime in manifests.items()}
+        dm_utils.get_manifests(timepoint, manifests=changed)
+
+        assert mock_json.call_count == 2 * len(manifests)
+
+    def test_manifest_rewritten_in_place_is_reparsed(self, timepoint,
+                                                     tmp_path):
+        manifests = []
+        source = os.path.join(self.qc_dir, "STUDY_SITE_0001_01")
+        for path in glob.glob(os.path.join(source, "*_manifest.json")):
+            copy = tmp_path / os.path.basename(path)
+            copy.write_text(open(path).read())
+            manifests.append(str(copy))
+        dm_utils.get_manifests(timepoint, manifests=manifests)
+
+        rewritten = manifests[0]
+        with open(rewritten, "w") as fh:
+            json.dump({"updated": {"order": 1}}, fh)
+        stat = os.stat(rewritten)
+        os.utime(rewritten, ns=(stat.st_atime_ns,
+                                stat.st_mtime_ns + 1000000000))
+        found = dm_utils.get_manifests(timepoint, manifests=manifests)
+
+        contents = [list(item) for session in found.values()
+                    for item in session.values()]
+        assert ["updated"] in contents
+
     @pytest.fixture
     def config(self):
 
@@ -76,6 +211,151 @@ class TestGetManifests:
         return mock_conf
 
 
+class TestDeletionPlans:
+
+    def test_timepoint_plan_deletes_whole_folders(self, timepoint):
+        plan = dm_utils.plan_timepoint_deletion(timepoint)
+        targets = [(item["key"], item["folder"], item["files"])
+                   for item in plan["folders"]]
+        assert ("nii", "STUDY_SITE_0001_01", None) in targets
+        assert ("dicom", None, ["STUDY_SITE_0001_01_01.zip"]) in targets
+        assert ("resources", "STUDY_SITE_0001_01_02", None) in targets
+        assert plan["bids"] is None
+
+    def test_scan_plan_only_deletes_scan_files(self, timepoint):
+        scan = timepoint.sessions[1].scans[0]
+        plan = dm_utils.plan_scan_deletion(scan)
+        for target in plan["folders"]:
+            assert target["files"] == [scan.name]
+
+    def test_finds_paths_with_one_scan_per_folder(self, tmp_path):
+        nii = tmp_path / "nii" / "STUDY_SITE_0001_01"
+        nii.mkdir(parents=True)
+        for name in ["STUDY_SITE_0001_01_01_T1_2.nii.gz",
+                     "STUDY_SITE_0001_01_01_T1_2.json",
+                     "STUDY_SITE_0001_01_01_DTI60-1000_5.nii.gz"]:
+            (nii / name).write_text("")
+        plan = {"folders": [
+            {"key": "nii", "folder": "STUDY_SITE_0001_01",
+             "files": ["STUDY_SITE_0001_01_01_T1_2"]},
+            {"key": "mnc", "folder": "STUDY_SITE_0001_01", "files": None}
+        ], "bids": None}
+
+        with patch("os.scandir", wraps=os.scandir) as mock_scandir:
+            found = dm_utils.find_deletion_paths(
+                self.make_config(tmp_path), plan)
+
+        assert found["paths"] == [
+            str(nii / "STUDY_SITE_0001_01_01_T1_2.json"),
+            str(nii / "STUDY_SITE_0001_01_01_T1_2.nii.gz")]
+        assert found["folders"] == [str(nii)]
+        # The nii folder, its timepoint folder and the missing mnc folder
+        assert mock_scandir.call_count == 3
+
+    @patch("dashboard.datman_utils.get_config")
+    def test_delete_planned_reports_progress(self, mock_config, tmp_path):
+        mock_config.return_value = self.make_config(tmp_path)
+        nii = tmp_path / "nii" / "STUDY_SITE_0001_01"
+        nii.mkdir(parents=True)
+        (nii / "STUDY_SITE_0001_01_01_T1_2.nii.gz").write_text("")
+        plan = {"folders": [
+            {"key": "nii", "folder": "STUDY_SITE_0001_01",
+             "files": ["STUDY_SITE_0001_01_01_T1_2"]}
+        ], "bids": None}
+        progress = Mock()
+
+        errors = dm_utils.delete_planned("STUDY", plan, progress)
+
+        assert errors == []
+        assert progress.call_args_list[-1][0] == (1, 1, None)
+        # The timepoint folder was left empty, so it's removed too
+        assert not nii.exists()
+
+    def test_bids_plan_walks_session_once_for_all_scans(self, tmp_path):
+        session = tmp_path / "bids" / "sub-0001" / "ses-01"
+        for sub_dir, name in [("anat", "sub-0001_ses-01_T1w.nii.gz"),
+                              ("dwi", "sub-0001_ses-01_dwi.nii.gz"),
+                              ("func", "sub-0001_ses-01_bold.nii.gz")]:
+            (session / sub_dir).mkdir(parents=True)
+            (session / sub_dir / name).write_text("")
+
+        with patch("os.walk", wraps=os.walk) as mock_walk:
+            found = dm_utils.plan_bids_deletion(
+                self.make_config(tmp_path), "0001", "01",
+                ["sub-0001_ses-01_T1w", "sub-0001_ses-01_dwi",
+                 "sub-0001_ses-01_FLAIR"])
+
+        assert mock_walk.call_count == 1
+        assert sorted(found["paths"]) == [
+            str(session / "anat" / "sub-0001_ses-01_T1w.nii.gz"),
+            str(session / "dwi" / "sub-0001_ses-01_dwi.nii.gz")]
+        assert found["missing"] == ["sub-0001_ses-01_FLAIR"]
+        assert found["folders"][-2:] == [str(session), str(session.parent)]
+
+    def test_bids_plan_finds_all_of_a_scans_files(self, tmp_path):
+        dwi = tmp_path / "bids" / "sub-0001" / "ses-01" / "dwi"
+        dwi.mkdir(parents=True)
+        for ext in [".nii.gz", ".json", ".bval", ".bvec"]:
+            (dwi / ("sub-0001_ses-01_dwi" + ext)).write_text("")
+        (dwi / "sub-0001_ses-01_run-2_dwi.nii.gz").write_text("")
+
+        found = dm_utils.plan_bids_deletion(
+            self.make_config(tmp_path), "0001", "01", ["sub-0001_ses-01_dwi"])
+
+        assert len(found["paths"]) == 4
+        assert all("run-2" not in path for path in found["paths"])
+
+    def test_bids_plan_with_no_scans_deletes_nothing(self, tmp_path):
+        anat = tmp_path / "bids" / "sub-0001" / "ses-01" / "anat"
+        anat.mkdir(parents=True)
+        (anat / "sub-0001_ses-01_T1w.nii.gz").write_text("")
+
+        found = dm_utils.plan_bids_deletion(
+            self.make_config(tmp_path), "0001", "01", [])
+
+        assert found == {"paths": [], "folders": [], "missing": []}
+
+    def test_session_with_no_bids_scans_keeps_bids_folder(self, tmp_path):
+        session = tmp_path / "bids" / "sub-0001" / "ses-01"
+        session.mkdir(parents=True)
+        plan = {"folders": [],
+                "bids": {"subject": "0001", "session": "01", "files": []}}
+
+        found = dm_utils.find_deletion_paths(
+            self.make_config(tmp_path), plan)
+
+        assert str(session) not in found["paths"]
+
+    def test_bids_deletion_removes_empty_folders(self, tmp_path):
+        anat = tmp_path / "bids" / "sub-0001" / "ses-01" / "anat"
+        anat.mkdir(parents=True)
+        (anat / "sub-0001_ses-01_T1w.nii.gz").write_text("")
+
+        dm_utils.delete_bids(self.make_config(tmp_path), "0001", "01",
+                             bids_name="sub-0001_ses-01_T1w")
+
+        assert os.listdir(str(tmp_path / "bids")) == []
+
+    @patch("dashboard.datman_utils.get_config")
+    def test_preview_doesnt_delete_anything(self, mock_config, tmp_path):
+        mock_config.return_value = self.make_config(tmp_path)
+        nii = tmp_path / "nii" / "STUDY_SITE_0001_01"
+        nii.mkdir(parents=True)
+        plan = {"folders": [{"key": "nii", "folder": "STUDY_SITE_0001_01",
+                             "files": None}],
+                "bids": None}
+
+        found = dm_utils.preview_deletion("STUDY", plan)
+
+        assert found["paths"] == [str(nii)]
+        assert nii.exists()
+
+    def make_config(self, base):
+        mock_conf = Mock(spec=datman.config.config)
+        mock_conf.get_path = lambda key: str(base / key)
+        return mock_conf
+
+
 @pytest.fixture
 def timepoint(dash_db):
     """Populate the test database with some records for testing.
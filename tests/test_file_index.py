@@ -0,0 +1,125 @@
+"""Tests for dashboard.file_index
+"""
+import os
+
+import pytest
+from mock import patch
+
+from dashboard import file_index
+from tests.utils import add_studies, query_db
+
+
+class TestCrawl:
+
+    def test_indexes_files_by_study_folder_and_subdir(self, study_dirs):
+        file_index.crawl(["STUDY1"])
+
+        found = file_index.find_file(
+            "STUDY1", "nii", "STU01_CMH_0001_01",
+            ["STU01_CMH_0001_01_01_T1_02_T1.nii.gz"])
+        assert found == str(study_dirs["nii"] / "STU01_CMH_0001_01" /
+                            "STU01_CMH_0001_01_01_T1_02_T1.nii.gz")
+
+    def test_find_file_returns_first_preferred_name(self, study_dirs):
+        file_index.crawl(["STUDY1"])
+
+        found = file_index.find_file(
+            "STUDY1", "nii", "STU01_CMH_0001_01",
+            ["STU01_CMH_0001_01_01_RST_03_Rest.nii.gz",
+             "STU01_CMH_0001_01_01_RST_03_Rest.nii"])
+        assert found.endswith("STU01_CMH_0001_01_01_RST_03_Rest.nii")
+
+    def test_list_files_filters_by_suffix(self, study_dirs):
+        file_index.crawl(["STUDY1"])
+
+        found = file_index.list_files("STUDY1", "qc", "STU01_CMH_0001_01",
+                                      suffix="_manifest.json")
+        assert [os.path.basename(item) for item in found] == [
+            "STU01_CMH_0001_01_01_T1_02_T1_manifest.json"]
+
+    def test_resources_indexed_recursively_by_session(self, study_dirs):
+        file_index.crawl(["STUDY1"])
+
+        found = file_index.find_file("STUDY1", "resources",
+                                     "STU01_CMH_0001_01_01",
+                                     [os.path.join("notes", "tech.pdf")])
+        assert found is not None
+
+    def test_removed_files_are_dropped_from_index(self, study_dirs):
+        file_index.crawl(["STUDY1"])
+        os.remove(study_dirs["qc"] / "STU01_CMH_0001_01" / "index.html")
+
+        result = file_index.crawl(["STUDY1"])
+
+        assert result["removed"] == 1
+        assert file_index.find_file("STUDY1", "qc", "STU01_CMH_0001_01",
+                                    ["index.html"]) is None
+
+    def test_unchanged_files_are_not_rewritten(self, study_dirs):
+        file_index.crawl(["STUDY1"])
+
+        result = file_index.crawl(["STUDY1"])
+
+        assert result == {"added": 0, "removed": 0, "updated": 0}
+
+    def test_single_subdir_refresh_leaves_others_alone(self, study_dirs):
+        file_index.crawl(["STUDY1"])
+        new_dir = study_dirs["qc"] / "STU01_CMH_0002_01"
+        new_dir.mkdir()
+        (new_dir / "index.html").write_text("")
+
+        result = file_index.crawl(["STUDY1"], folders=["qc"],
+                                  subdir="STU01_CMH_0002_01")
+
+        assert result == {"added": 1, "removed": 0, "updated": 0}
+        total = query_db("SELECT count(*) FROM file_index")[0][0]
+        assert total == 7
+
+    def test_unchanged_folders_are_not_read_again(self, study_dirs):
+        file_index.crawl(["STUDY1"])
+
+        with patch("os.scandir", wraps=os.scandir) as mock_scandir:
+            result = file_index.crawl(["STUDY1"])
+
+        # Only the top level of the nii, qc and resources folders
+        assert mock_scandir.call_count == 3
+        assert result == {"added": 0, "removed": 0, "updated": 0}
+        assert file_index.find_file("STUDY1", "resources",
+                                    "STU01_CMH_0001_01_01",
+                                    [os.path.join("notes", "tech.pdf")])
+
+    def test_new_files_in_nested_folders_are_found(self, study_dirs):
+        file_index.crawl(["STUDY1"])
+        notes = study_dirs["resources"] / "STU01_CMH_0001_01_01" / "notes"
+        (notes / "extra.pdf").write_text("")
+
+        result = file_index.crawl(["STUDY1"])
+
+        assert result == {"added": 1, "removed": 0, "updated": 0}
+
+    @pytest.fixture
+    def study_dirs(self, dash_db, tmp_path):
+        add_studies({"STUDY1": {"CMH": []}})
+        files = {
+            "nii": ["STU01_CMH_0001_01/STU01_CMH_0001_01_01_T1_02_T1.nii.gz",
+                    "STU01_CMH_0001_01/STU01_CMH_0001_01_01_RST_03_Rest.nii"],
+            "qc": ["STU01_CMH_0001_01/index.html",
+                   "STU01_CMH_0001_01/STU01_CMH_0001_01_01_T1_02_T1_"
+                   "manifest.json",
+                   "STU01_CMH_0001_01/STU01_CMH_0001_01_01_T1_02_T1.png"],
+            "resources": ["STU01_CMH_0001_01_01/notes/tech.pdf"]
+        }
+        dirs = {}
+        for folder, paths in files.items():
+            dirs[folder] = tmp_path / folder
+            for item in paths:
+                path = dirs[folder] / item
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_text("")
+
+        with patch.object(file_index, "get_study_folders") as mock_folders, \
+                patch.dict(file_index._known, clear=True):
+            mock_folders.side_effect = lambda study, folders: {
+                key: str(dirs[key]) for key in folders
+            }
+            yield dirs
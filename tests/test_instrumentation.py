@@ -0,0 +1,98 @@
+import json
+import logging
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+import dashboard.instrumentation as instrumentation
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config.update(SQL_REPEAT_THRESHOLD=3, SQL_MAX_QUERIES=5,
+                      SQL_SLOW_REQUEST=10000, SQL_STATS_SAMPLE=1)
+    instrumentation.init_app(app)
+    engine = create_engine("sqlite://")
+
+    @app.route("/failed")
+    def failed():
+        with engine.connect() as conn:
+            try:
+                conn.execute("SELECT * FROM missing")
+            except OperationalError:
+                pass
+            conn.execute("SELECT 1").fetchall()
+            app.connection_info = dict(conn.info)
+        return "done"
+
+    @app.route("/queries/<int:num>")
+    def queries(num):
+        with engine.connect() as conn:
+            for idx in range(num):
+                conn.execute("SELECT {}".format(idx)).fetchall()
+        return "done"
+
+    return app
+
+
+class TestGetShape:
+
+    def test_parameters_and_literals_replaced(self):
+        first = instrumentation.get_shape(
+            "SELECT * FROM scans WHERE id = %(id_1)s AND name = 'abc'")
+        second = instrumentation.get_shape(
+            "SELECT *\n FROM scans WHERE id = 12 AND name = 'it''s'")
+        assert first == second
+
+    def test_in_lists_of_any_length_have_same_shape(self):
+        first = instrumentation.get_shape(
+            "SELECT * FROM scans WHERE id IN (%(id_1)s, %(id_2)s)")
+        second = instrumentation.get_shape(
+            "SELECT * FROM scans WHERE id IN (%(id_1)s)")
+        assert first == second
+
+
+class TestRequestInstrumentation:
+
+    def test_adds_server_timing_header(self, app):
+        response = app.test_client().get("/queries/2")
+        assert 'desc="2 queries"' in response.headers["Server-Timing"]
+
+    def test_server_timing_header_can_be_disabled(self, app):
+        app.config["SERVER_TIMING"] = False
+        response = app.test_client().get("/queries/2")
+        assert "Server-Timing" not in response.headers
+
+    def test_reports_repeated_statements(self, app, caplog):
+        with caplog.at_level(logging.WARNING, logger="dashboard"):
+            app.test_client().get("/queries/4")
+        messages = [record.getMessage() for record in caplog.records]
+        assert any("Possible N+1 query" in msg and "4 times" in msg
+                   for msg in messages)
+
+    def test_logs_requests_over_query_limit(self, app, caplog):
+        with caplog.at_level(logging.WARNING, logger="dashboard"):
+            app.test_client().get("/queries/6")
+        assert any("Slow request" in record.getMessage()
+                   for record in caplog.records)
+
+    def test_sampled_requests_logged_as_json(self, app, caplog):
+        with caplog.at_level(logging.INFO, logger="dashboard.sql_stats"):
+            app.test_client().get("/queries/1")
+        records = [record for record in caplog.records
+                   if record.name == "dashboard.sql_stats"]
+        assert json.loads(records[0].getMessage())["queries"] == 1
+
+    def test_failed_statement_does_not_affect_later_queries(self, app):
+        response = app.test_client().get("/failed")
+        assert 'desc="1 queries"' in response.headers["Server-Timing"]
+        assert app.connection_info == {}
+
+    def test_queries_outside_requests_ignored(self, app):
+        engine = create_engine("sqlite://")
+        with app.app_context():
+            engine.execute("SELECT 1")
+            assert instrumentation.get_stats() is None
@@ -1,3 +1,5 @@
+import os
+
 from mock import patch, Mock
 
 import dashboard.blueprints.main.utils as utils
@@ -79,3 +81,165 @@ class TestGetRunLog:
     def test_returns_correctly_formatted_dict_when_log_dir_not_set(self):
         result = utils.get_run_log("", "STUDY1", ": Done.", "- ERROR -")
         assert result == {"contents": "", "header": ""}
+
+    def test_reads_log_file_when_log_dir_set(self, tmp_path):
+        log_file = tmp_path / "STUDY1_latest.log"
+        log_file.write_text("Starting\n<b>ERROR</b>\n: Done.\n")
+        result = utils.get_run_log(
+            str(tmp_path), "STUDY1", ": Done.", "ERROR")
+        assert result["contents"] == utils.read_log(str(log_file))
+        assert result["header"] == "1 error reported"
+
+
+class TestRunLog:
+
+    done_regex = ": Done."
+    error_regex = "- ERROR -"
+
+    def write(self, log_file, text):
+        with open(log_file, "a") as fh:
+            fh.write(text)
+
+    def test_only_reads_new_bytes_after_first_update(self, tmp_path):
+        log_file = str(tmp_path / "STUDY1_latest.log")
+        self.write(log_file, "line 1\nline 2\n")
+        run_log = utils.RunLog(log_file, self.done_regex, self.error_regex)
+        run_log.update()
+
+        self.write(log_file, "line 3\n")
+        with patch.object(run_log, "_add_lines",
+                          wraps=run_log._add_lines) as mock_add:
+            assert run_log.update()
+        mock_add.assert_called_once_with(b"line 3\n")
+        assert run_log.offset == 21
+
+    def test_doesnt_reread_unchanged_file(self, tmp_path):
+        log_file = str(tmp_path / "STUDY1_latest.log")
+        self.write(log_file, "line 1\n")
+        run_log = utils.RunLog(log_file, self.done_regex, self.error_regex)
+        run_log.update()
+        assert not run_log.update()
+
+    def test_counts_errors_and_completion_incrementally(self, tmp_path):
+        log_file = str(tmp_path / "STUDY1_latest.log")
+        self.write(log_file, "a.py - STUDY1 - ERROR - Invalid session\n")
+        run_log = utils.RunLog(log_file, self.done_regex, self.error_regex)
+        run_log.update()
+        assert run_log.header() == "Running..."
+
+        self.write(log_file, "b.py - STUDY1 - ERROR - Bad scan\n")
+        self.write(log_file, "Sat 04 Jun 2022 03:41:40 AM EDT: Done.\n")
+        run_log.update()
+        assert run_log.errors == 2
+        assert run_log.header() == "2 errors reported"
+
+    def test_holds_back_unterminated_line_until_complete(self, tmp_path):
+        log_file = str(tmp_path / "STUDY1_latest.log")
+        self.write(log_file, "line 1\nline")
+        run_log = utils.RunLog(log_file, self.done_regex, self.error_regex)
+        run_log.update()
+        assert run_log.offset == 7
+        assert run_log.partial == "line"
+
+        self.write(log_file, " 2\n")
+        run_log.update()
+        assert run_log.partial == ""
+        assert [text for _, text in run_log.lines] == [
+            "line 1<br>", "line 2<br>"]
+
+    def test_rereads_replaced_log(self, tmp_path):
+        log_file = str(tmp_path / "STUDY1_latest.log")
+        self.write(log_file, "old run - ERROR - failed\n: Done.\n")
+        run_log = utils.RunLog(log_file, self.done_regex, self.error_regex)
+        run_log.update()
+
+        new_log = str(tmp_path / "new.log")
+        self.write(new_log, "new run\n")
+        os.replace(new_log, log_file)
+        run_log.update()
+        assert run_log.errors == 0
+        assert run_log.header() == "Running..."
+        assert run_log.contents() == "new run<br>"
+
+    def test_rereads_truncated_log(self, tmp_path):
+        log_file = str(tmp_path / "STUDY1_latest.log")
+        self.write(log_file, "a long first line\n")
+        run_log = utils.RunLog(log_file, self.done_regex, self.error_regex)
+        run_log.update()
+
+        with open(log_file, "w") as fh:
+            fh.write("short\n")
+        run_log.update()
+        assert run_log.contents() == "short<br>"
+
+    def test_tail_mode_keeps_last_lines_but_counts_all_errors(self,
+                                                              tmp_path):
+        log_file = str(tmp_path / "STUDY1_latest.log")
+        self.write(log_file, "x - ERROR - 1\nx - ERROR - 2\nline 3\n")
+        run_log = utils.RunLog(
+            log_file, self.done_regex, self.error_regex, tail=1)
+        run_log.update()
+        assert run_log.contents() == "line 3<br>"
+        assert run_log.skipped == 2
+        assert run_log.error_count() == 2
+
+    def test_since_returns_only_new_lines(self, tmp_path):
+        log_file = str(tmp_path / "STUDY1_latest.log")
+        self.write(log_file, "line 1\n")
+        run_log = utils.RunLog(log_file, self.done_regex, self.error_regex)
+        run_log.update()
+        offset = run_log.offset
+
+        self.write(log_file, "line 2\nline 3\nline")
+        run_log.update()
+        result = run_log.since(offset, run_log.inode)
+        assert not result["reset"]
+        assert result["lines"] == ["line 2<br>", "line 3<br>"]
+        assert result["partial"] == "line"
+        assert result["offset"] == 21
+
+    def test_since_resends_all_lines_for_unknown_offset(self, tmp_path):
+        log_file = str(tmp_path / "STUDY1_latest.log")
+        self.write(log_file, "line 1\nline 2\n")
+        run_log = utils.RunLog(log_file, self.done_regex, self.error_regex)
+        run_log.update()
+        result = run_log.since(3)
+        assert result["reset"]
+        assert result["lines"] == ["line 1<br>", "line 2<br>"]
+
+
+class TestGetRunOverview:
+
+    done_regex = ": Done."
+    error_regex = "- ERROR -"
+
+    def test_returns_empty_overview_when_log_dir_not_set(self):
+        result = utils.get_run_overview(
+            "", ["STUDY1"], self.done_regex, self.error_regex)
+        assert result["studies"] == []
+
+    def test_reports_status_of_each_requested_study(self, tmp_path):
+        (tmp_path / "STUDY1_latest.log").write_text(
+            "x - ERROR - bad\n: Done.\n")
+        (tmp_path / "STUDY2_latest.log").write_text("Get new scans...\n")
+        (tmp_path / "STUDY3_latest.log").write_text(": Done.\n")
+        (tmp_path / "STUDY1_20220604.log").write_text(": Done.\n")
+
+        result = utils.get_run_overview(
+            str(tmp_path), ["STUDY2", "STUDY1", "STUDY4"],
+            self.done_regex, self.error_regex)
+
+        assert [(item["study"], item["status"], item["errors"])
+                for item in result["studies"]] == [
+            ("STUDY1", "done", 1), ("STUDY2", "running", 0)]
+        assert result["totals"] == {
+            "done": 1, "running": 1, "unreadable": 0, "errors": 1}
+
+    def test_reuses_cached_readers(self, tmp_path):
+        log_file = tmp_path / "STUDY1_latest.log"
+        log_file.write_text("line 1\n")
+        utils.get_run_overview(
+            str(tmp_path), ["STUDY1"], self.done_regex, self.error_regex)
+        reader = utils.get_run_log_reader(
+            str(tmp_path), "STUDY1", self.done_regex, self.error_regex)
+        assert reader.offset == 7
@@ -2,6 +2,7 @@
 """
 
 import pytest
+from sqlalchemy import event
 
 from tests.utils import query_db, add_studies
 from dashboard import models
@@ -80,6 +81,72 @@ class TestUser:
         )
         assert result == expected
 
+    def test_has_study_access_respects_site_restrictions(self):
+        user = models.User.query.get(1)
+        assert user.has_study_access("STUDY1")
+        assert user.has_study_access("STUDY1", "CMH")
+        assert not user.has_study_access("STUDY1", "UTO")
+        assert user.has_study_access("STUDY2", "CMH")
+        assert not user.has_study_access("STUDY4")
+
+    def test_site_permissions_include_study_wide_permissions(self, dash_db):
+        user = models.User.query.get(1)
+        user.add_studies({"STUDY3": ["ABC"]})
+        for study_user in models.StudyUser.query.filter_by(user_id=1):
+            study_user.does_qc = study_user.site_id is None
+            study_user.is_admin = study_user.site_id == "ABC"
+        dash_db.session.commit()
+        user.reset_permissions()
+
+        assert user.does_qc("STUDY3", "ABC")
+        assert user.is_study_admin("STUDY3", "ABC")
+        assert not user.is_study_admin("STUDY1", "CMH")
+
+    def test_site_permission_doesnt_apply_to_whole_study(self, dash_db):
+        user = models.User.query.get(1)
+        user.add_studies({"STUDY3": ["ABC"]})
+        for study_user in models.StudyUser.query.filter_by(user_id=1):
+            study_user.is_admin = study_user.site_id == "ABC"
+        dash_db.session.commit()
+        user.reset_permissions()
+
+        assert user.has_study_access("STUDY3")
+        assert not user.is_study_admin("STUDY3")
+        assert user.is_study_admin("STUDY3", "ABC")
+
+    def test_permissions_are_only_read_once(self):
+        user = models.User.query.get(1)
+        assert user.get_permissions() is user.get_permissions()
+
+    def test_changing_study_access_resets_permissions(self):
+        user = models.User.query.get(1)
+        assert not user.has_study_access("STUDY1", "UTO")
+
+        user.add_studies({"STUDY1": ["UTO"]})
+        assert user.has_study_access("STUDY1", "UTO")
+
+        user.remove_studies({"STUDY1": []})
+        assert not user.has_study_access("STUDY1")
+
+    def test_user_restored_from_snapshot_without_querying(self, dash_db):
+        snapshot = models.User.query.get(1).get_snapshot()
+        dash_db.session.remove()
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(dash_db.engine, "before_cursor_execute", record)
+        try:
+            user = models.User.from_snapshot(snapshot)
+            assert user.first_name == "Donald"
+            assert user.has_study_access("STUDY1", "CMH")
+            assert not user.has_study_access("STUDY1", "UTO")
+        finally:
+            event.remove(dash_db.engine, "before_cursor_execute", record)
+        assert statements == []
+
     def get_result(self, sql_query):
         return [item[0] for item in query_db(sql_query)]
 
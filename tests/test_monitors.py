@@ -0,0 +1,80 @@
+"""Tests for the check functions in dashboard.monitors
+"""
+
+import pytest
+from mock import patch
+
+from tests.utils import add_studies
+from dashboard import models, monitors
+
+
+class TestSendDigests:
+
+    def test_new_timepoint_queues_event_for_each_qcer(self, records):
+        records.add_timepoint(models.Timepoint("STUDY1_CMH_0001_01", "CMH"))
+
+        events = models.Notification.query.all()
+        assert sorted(e.recipient for e in events) == [
+            "donald@example.com", "mickey@example.com"]
+        assert all(e.category == models.Notification.QC_NEEDED
+                   for e in events)
+        assert all(e.subject == "STUDY1_CMH_0001_01" for e in events)
+
+    def test_study_without_qcers_queues_nothing(self, records):
+        models.StudyUser.query.update({"does_qc": False})
+        records.add_timepoint(models.Timepoint("STUDY1_CMH_0001_01", "CMH"))
+
+        assert models.Notification.query.all() == []
+
+    @patch('dashboard.monitors.notification_digest')
+    def test_sends_one_email_per_recipient(self, mock_email, records):
+        for num in range(1, 4):
+            records.add_timepoint(
+                models.Timepoint(f"STUDY1_CMH_000{num}_01", "CMH"))
+
+        monitors.send_digests()
+
+        assert mock_email.call_count == 2
+        recipients = sorted(call[0][0] for call in mock_email.call_args_list)
+        assert recipients == ["donald@example.com", "mickey@example.com"]
+
+    @patch('dashboard.monitors.notification_digest')
+    def test_digest_groups_events_by_study_and_category(self, mock_email,
+                                                        records):
+        for num in range(1, 3):
+            records.add_timepoint(
+                models.Timepoint(f"STUDY1_CMH_000{num}_01", "CMH"))
+
+        monitors.send_digests()
+
+        events = mock_email.call_args_list[0][0][1]
+        assert events == [(models.Notification.QC_NEEDED, "STUDY1",
+                           ["STUDY1_CMH_0001_01", "STUDY1_CMH_0002_01"])]
+
+    @patch('dashboard.monitors.notification_digest')
+    def test_events_are_only_sent_once(self, mock_email, records):
+        records.add_timepoint(models.Timepoint("STUDY1_CMH_0001_01", "CMH"))
+
+        monitors.send_digests()
+        assert mock_email.call_count == 2
+
+        mock_email.reset_mock()
+        monitors.send_digests()
+        assert mock_email.call_count == 0
+        assert all(e.sent is not None
+                   for e in models.Notification.query.all())
+
+    @pytest.fixture
+    def records(self, dash_db):
+        study = add_studies({"STUDY1": {"CMH": []}})[0]
+        study.email_qc = True
+
+        for first, last in [("Donald", "Duck"), ("Mickey", "Mouse")]:
+            user = models.User(first, last,
+                               email=f"{first.lower()}@example.com")
+            dash_db.session.add(user)
+            dash_db.session.flush()
+            dash_db.session.add(
+                models.StudyUser("STUDY1", user.id, does_qc=True))
+        dash_db.session.commit()
+        return study
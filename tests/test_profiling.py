@@ -0,0 +1,99 @@
+import json
+import time
+from collections import Counter
+
+import pytest
+from flask import Flask
+
+import dashboard.profiling as profiling
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(PROFILE_SAMPLE=0, PROFILE_SLOW_REQUEST=50,
+                      PROFILE_INTERVAL=1, PROFILE_DIR=str(tmp_path),
+                      PROFILE_KEEP=100)
+    profiling.init_app(app)
+
+    @app.route("/sleep/<int:ms>")
+    def sleep(ms):
+        wait(ms)
+        return "done"
+
+    return app
+
+
+def wait(ms):
+    end = time.perf_counter() + ms / 1000
+    while time.perf_counter() < end:
+        pass
+
+
+class TestRequestProfiling:
+
+    def test_slow_request_stacks_are_saved(self, app, tmp_path):
+        app.test_client().get("/sleep/100")
+
+        found = profiling.get_profiles(tmp_path)
+        assert len(found) == 1
+        assert found[0]["trigger"] == "slow"
+        assert found[0]["endpoint"] == "sleep"
+        assert "_sleep_" in found[0]["name"]
+        assert found[0]["files"] == [found[0]["name"] + ".collapsed"]
+        collapsed = (tmp_path / found[0]["files"][0]).read_text()
+        assert "test_profiling:wait:" in collapsed
+
+    def test_fast_requests_are_not_saved(self, app, tmp_path):
+        app.test_client().get("/sleep/0")
+        assert profiling.get_profiles(tmp_path) == []
+
+    def test_sampled_requests_are_profiled_with_cprofile(self, app,
+                                                         tmp_path):
+        app.config.update(PROFILE_SAMPLE=1)
+        app.test_client().get("/sleep/20")
+
+        found = profiling.get_profiles(tmp_path)
+        assert found[0]["trigger"] == "sample"
+        assert found[0]["files"][0].endswith(".pstats")
+        assert any("wait" in item["function"] for item in found[0]["top"])
+
+    def test_disabled_when_not_configured(self, tmp_path):
+        app = Flask(__name__)
+        profiling.init_app(app)
+        assert not app.before_request_funcs
+
+    def test_oldest_profiles_are_pruned(self, app, tmp_path):
+        app.config.update(PROFILE_SAMPLE=1, PROFILE_KEEP=2)
+        client = app.test_client()
+        for _ in range(3):
+            client.get("/sleep/0")
+
+        assert len(profiling.get_profiles(tmp_path)) == 2
+        assert len(list(tmp_path.glob("*.pstats"))) == 2
+
+
+class TestGetTopFrames:
+
+    def test_self_and_total_time_estimated_from_samples(self):
+        stacks = Counter({"main;view;query": 3, "main;view": 1})
+        top = profiling.get_top_frames(stacks, interval=10)
+        assert top[0] == {"function": "query", "self_ms": 30,
+                          "total_ms": 30}
+        assert top[1] == {"function": "view", "self_ms": 10,
+                          "total_ms": 40}
+
+
+class TestGetProfiles:
+
+    def test_newest_first(self, tmp_path):
+        for name in ["20200101-000000_a_1", "20200102-000000_b_1"]:
+            (tmp_path / (name + ".json")).write_text(
+                json.dumps({"name": name}))
+
+        found = profiling.get_profiles(tmp_path)
+        assert [item["name"] for item in found] == ["20200102-000000_b_1",
+                                                    "20200101-000000_a_1"]
+
+    def test_missing_folder_has_no_profiles(self, tmp_path):
+        assert profiling.get_profiles(tmp_path / "missing") == []
@@ -1,4 +1,7 @@
+import json
+
 import pytest
+from sqlalchemy import event
 
 from tests.utils import (add_studies, add_scans, query_db, Session, Scan,
                          QcReview)
@@ -72,6 +75,59 @@ class TestGetStudies:
         return [study1, study2, study3]
 
 
+class TestBatchLookups:
+
+    def test_get_sessions_keys_results_by_name_and_num(self, records):
+        result = dashboard.queries.get_sessions([
+            ("STUDY1_CMH_0001_01", 1),
+            ("STUDY1_CMH_0002_01", 1),
+            ("STUDY1_CMH_0002_01", 2)
+        ])
+        assert sorted(result) == [("STUDY1_CMH_0001_01", 1),
+                                  ("STUDY1_CMH_0002_01", 1)]
+        assert all(str(session) == "{}_{:02d}".format(*key)
+                   for key, session in result.items())
+
+    def test_get_timepoints_keys_results_by_name(self, records):
+        result = dashboard.queries.get_timepoints(
+            ["STUDY1_CMH_0001_01", "STUDY1_CMH_9999_01"])
+        assert list(result) == ["STUDY1_CMH_0001_01"]
+        assert result["STUDY1_CMH_0001_01"].name == "STUDY1_CMH_0001_01"
+
+    def test_get_scans_keys_results_by_name(self, records):
+        names = ["STUDY1_CMH_0001_01_01_T1_02", "STUDY1_CMH_0002_01_01_T2_03"]
+        result = dashboard.queries.get_scans(names + ["NOT_A_SCAN"])
+        assert sorted(result) == names
+        assert all(scan.name == name for name, scan in result.items())
+
+    def test_empty_input_returns_empty_dict(self, records):
+        assert dashboard.queries.get_sessions([]) == {}
+        assert dashboard.queries.get_timepoints([]) == {}
+        assert dashboard.queries.get_scans([]) == {}
+
+    def test_large_inputs_are_split_into_chunks(self, records):
+        names = ["STUDY1_CMH_{:04d}_01".format(num) for num in range(2500)]
+        result = dashboard.queries.get_timepoints(names)
+        assert sorted(result) == ["STUDY1_CMH_0001_01", "STUDY1_CMH_0002_01"]
+
+    def test_chunked_splits_items(self):
+        chunks = list(dashboard.queries.chunked(range(7), size=3))
+        assert chunks == [[0, 1, 2], [3, 4, 5], [6]]
+
+    @pytest.fixture
+    def records(self, dash_db):
+        study = add_studies({"STUDY1": {"CMH": ["T1", "T2"]}})[0]
+        add_scans(study, {
+            Session("STUDY1_CMH_0001_01", "CMH", 1): [
+                Scan("STUDY1_CMH_0001_01_01_T1_02", 2, "T1")
+            ],
+            Session("STUDY1_CMH_0002_01", "CMH", 1): [
+                Scan("STUDY1_CMH_0002_01_01_T2_03", 3, "T2")
+            ]
+        })
+        return dash_db
+
+
 class TestGetScanQc:
 
     def test_finds_all_reviewed_human_scans_when_no_search_terms(self):
@@ -482,3 +538,133 @@ class TestGetScanQc:
         })
 
         return read_only_db
+
+
+class TestQueryPlans:
+    """Check that every query can find its records through an index.
+
+    Sequential scans, hash joins and merge joins are disabled while each
+    statement is explained, so the planner falls back to a sequential (or
+    unbounded index) scan only if no index can be used to look up the rows.
+    This keeps the result the same no matter how much data is in the test
+    database.
+    """
+
+    LARGE_TABLES = {"timepoints", "study_timepoints", "sessions", "scans",
+                    "scan_checklist", "scan_metrics", "gold_standards"}
+
+    @pytest.mark.parametrize("name, query", [
+        ("find_subjects",
+         lambda: dashboard.queries.find_subjects("CMH_000")),
+        ("get_session",
+         lambda: dashboard.queries.get_session("STUDY1_CMH_0001_01", 1)),
+        ("get_sessions",
+         lambda: dashboard.queries.get_sessions(
+             [("STUDY1_CMH_0001_01", 1), ("STUDY1_UTO_0002_01", 1)])),
+        ("get_timepoint",
+         lambda: dashboard.queries.get_timepoint("STUDY1_CMH_0001_01")),
+        ("get_timepoint_by_bids",
+         lambda: dashboard.queries.get_timepoint(
+             "CMH0001", bids_ses="01", study="STUDY1")),
+        ("get_timepoints",
+         lambda: dashboard.queries.get_timepoints(
+             ["STUDY1_CMH_0001_01", "STUDY1_UTO_0002_01"])),
+        ("get_study_timepoints",
+         lambda: dashboard.queries.get_study_timepoints("STUDY1")),
+        ("find_sessions_by_id",
+         lambda: dashboard.queries.find_sessions("STUDY1_CMH_0001_01")),
+        ("find_sessions_fuzzy",
+         lambda: dashboard.queries.find_sessions("CMH_000")),
+        ("get_scan",
+         lambda: dashboard.queries.get_scan("STUDY1_CMH_0001_01_01_T1_02")),
+        ("get_scans",
+         lambda: dashboard.queries.get_scans(
+             ["STUDY1_CMH_0001_01_01_T1_02", "STUDY1_UTO_0002_01_01_T2_03"])),
+        ("find_scans_by_file_name",
+         lambda: dashboard.queries.find_scans("STUDY1_CMH_0001_01_01_T1_02")),
+        ("find_scans_by_id",
+         lambda: dashboard.queries.find_scans("STUDY1_CMH_0001_01_01")),
+        ("find_scans_fuzzy",
+         lambda: dashboard.queries.find_scans("NOT_A_MATCH")),
+        ("get_scan_qc_by_study",
+         lambda: dashboard.queries.get_scan_qc(study="STUDY1",
+                                               include_new=True)),
+        ("get_scan_qc_by_user",
+         lambda: dashboard.queries.get_scan_qc(
+             user_id=dashboard.models.User.query.first().id, sort=True)),
+        ("query_metric_types",
+         lambda: dashboard.queries.query_metric_types(studies=["STUDY1"])),
+    ])
+    def test_query_does_not_scan_large_tables(self, name, query):
+        statements = self.capture(query)
+        assert statements
+        for statement, parameters in statements:
+            scans = self.find_full_scans(self.explain(statement, parameters))
+            assert not scans, "{} scans {} without an index:\n{}".format(
+                name, ", ".join(scans), statement)
+
+    def capture(self, query):
+        engine = dashboard.models.db.engine
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context,
+                   executemany):
+            if statement.lstrip().upper().startswith("SELECT"):
+                statements.append((statement, parameters))
+
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            query()
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+            dashboard.models.db.session.remove()
+        return statements
+
+    def explain(self, statement, parameters):
+        with dashboard.models.db.engine.connect() as conn:
+            with conn.begin() as trans:
+                for setting in ("enable_seqscan", "enable_hashjoin",
+                                "enable_mergejoin"):
+                    conn.execute("SET LOCAL {} = off".format(setting))
+                result = conn.execute("EXPLAIN (FORMAT JSON) " + statement,
+                                      parameters).scalar()
+                trans.rollback()
+        if isinstance(result, str):
+            result = json.loads(result)
+        return result[0]["Plan"]
+
+    def find_full_scans(self, plan):
+        found = []
+        relation = plan.get("Relation Name")
+        if relation in self.LARGE_TABLES and (
+                plan["Node Type"] == "Seq Scan" or
+                (plan["Node Type"] in ("Index Scan", "Index Only Scan") and
+                 "Index Cond" not in plan)):
+            found.append(relation)
+        for child in plan.get("Plans", []):
+            found.extend(self.find_full_scans(child))
+        return found
+
+    @pytest.fixture(autouse=True, scope="class")
+    def records(self, read_only_db):
+        user = dashboard.models.User("Jane", "Doe")
+        read_only_db.session.add(user)
+        read_only_db.session.commit()
+
+        studies = add_studies({
+            "STUDY1": {"CMH": ["T1", "T2"], "UTO": ["T1", "T2"]}
+        })
+        scans = add_scans(studies[0], {
+            Session("STUDY1_CMH_0001_01", "CMH", 1): [
+                Scan("STUDY1_CMH_0001_01_01_T1_02", 2, "T1",
+                     QcReview(user.id, True))
+            ],
+            Session("STUDY1_UTO_0002_01", "UTO", 1): [
+                Scan("STUDY1_UTO_0002_01_01_T2_03", 3, "T2")
+            ]
+        })
+        scans[0].session.timepoint.bids_name = "CMH0001"
+        scans[0].session.timepoint.bids_session = "01"
+        user.add_studies({"STUDY1": ["CMH"]})
+        read_only_db.session.commit()
+        return read_only_db
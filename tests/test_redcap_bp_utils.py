@@ -1,8 +1,11 @@
+from datetime import timedelta
+
 import pytest
 from mock import Mock, patch
 
 import dashboard
 import dashboard.blueprints.redcap.utils as rc_utils
+import dashboard.blueprints.redcap.monitors as rc_monitors
 import datman.scanid
 
 
@@ -100,6 +103,11 @@ class TestCreateFromRequest:
         session_field: session
     }]
 
+    @pytest.fixture(autouse=True)
+    def clear_clients(self):
+        # Cached clients would hide each test's mock REDCap server
+        rc_utils.clear_project_cache()
+
     @pytest.fixture
     def det(self):
         det_request = Mock()
@@ -329,3 +337,78 @@ class TestCreateFromRequest:
             dashboard.models.Session.query.all(),
             dashboard.models.RedcapConfig.query.all()
         ]
+
+
+class TestQueueDet:
+
+    det = {
+        "redcap_url": "https://fake.website.ca/redcap/",
+        "project_url": "https://fake.website.ca/redcap/redcap_v10.0.0/"
+                       "index.php?pid=9999",
+        "project_id": "9999",
+        "record": "100",
+        "instrument": "mri_scan_log"
+    }
+
+    def test_saves_trigger_without_contacting_redcap(self, dash_db):
+        with patch("redcap.Project") as mock_http:
+            rc_utils.queue_det(self.det)
+        assert mock_http.call_count == 0
+
+        triggers = dashboard.models.RedcapTrigger.query.all()
+        assert len(triggers) == 1
+        assert triggers[0].status == dashboard.models.RedcapTrigger.PENDING
+        assert triggers[0].contents == self.det
+
+    def test_raises_exception_when_malformed_trigger_received(self, dash_db):
+        det = self.det.copy()
+        del det["project_id"]
+        with pytest.raises(dashboard.exceptions.RedcapException):
+            rc_utils.queue_det(det)
+        assert dashboard.models.RedcapTrigger.query.count() == 0
+
+
+@patch("dashboard.blueprints.redcap.utils.create_from_det")
+class TestProcessDets:
+
+    def test_repeat_triggers_for_a_record_are_processed_once(
+            self, mock_create, dash_db):
+        for _ in range(3):
+            self.add_trigger("100")
+        self.add_trigger("200")
+
+        rc_monitors.process_dets()
+
+        assert mock_create.call_count == 2
+        statuses = sorted(t.status for t in
+                          dashboard.models.RedcapTrigger.query.all())
+        assert statuses == ["done", "done", "duplicate", "duplicate"]
+
+    def test_triggers_within_window_are_left_pending(
+            self, mock_create, dash_db):
+        self.add_trigger("100", age=0)
+
+        rc_monitors.process_dets()
+
+        assert mock_create.call_count == 0
+        trigger = dashboard.models.RedcapTrigger.query.first()
+        assert trigger.status == dashboard.models.RedcapTrigger.PENDING
+
+    def test_failed_triggers_record_the_error(self, mock_create, dash_db):
+        mock_create.side_effect = dashboard.exceptions.RedcapException(
+            "Record not found")
+        self.add_trigger("100")
+
+        rc_monitors.process_dets()
+
+        trigger = dashboard.models.RedcapTrigger.query.first()
+        assert trigger.status == dashboard.models.RedcapTrigger.FAILED
+        assert "Record not found" in trigger.error
+
+    def add_trigger(self, record, age=3600):
+        det = TestQueueDet.det.copy()
+        det["record"] = record
+        trigger = rc_utils.queue_det(det)
+        trigger.received = trigger.received - timedelta(seconds=age)
+        trigger.save()
+        return trigger
@@ -0,0 +1,138 @@
+"""Tests for reconciling REDCap records against a (fake) REDCap server.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+import dashboard
+import dashboard.blueprints.redcap.utils as rc_utils
+
+
+class FakeRedcapAPI(BaseHTTPRequestHandler):
+    """Answers the subset of the REDCap API used by the dashboard.
+    """
+
+    metadata = [
+        {"field_name": "record_id", "form_name": "mri_scan_log"},
+        {"field_name": "par_id", "form_name": "mri_scan_log"},
+        {"field_name": "date", "form_name": "mri_scan_log"},
+        {"field_name": "cmts", "form_name": "mri_scan_log"}
+    ]
+    records = []
+    requests = []
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        payload = {key: val[0] for key, val in parse_qs(
+            self.rfile.read(length).decode()).items()}
+        self.requests.append(payload)
+
+        if payload.get("content") == "metadata":
+            body = self.metadata
+        elif payload.get("content") == "record":
+            body = [item for item in self.records
+                    if item["mri_scan_log_complete"] == "2"]
+        else:
+            body = {"error": "Unsupported request"}
+
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestReconcileRecords:
+
+    def test_adds_records_for_sessions_missing_them(self, config, server):
+        self.set_server_records([
+            ("1", "STU01_CMH_0001_01_01"), ("2", "STU01_CMH_0002_01_01")])
+
+        added = rc_utils.reconcile_records(config)
+
+        assert added == 2
+        for subject in ["STU01_CMH_0001_01", "STU01_CMH_0002_01"]:
+            session = dashboard.models.Session.query.get((subject, 1))
+            assert session.redcap_record is not None
+            assert session.redcap_record.record.comment == "Scan went ok"
+
+    def test_exports_all_records_in_one_request(self, config, server):
+        self.set_server_records([
+            (str(num), f"STU01_CMH_000{num}_01_01") for num in range(1, 6)])
+
+        rc_utils.reconcile_records(config)
+
+        exports = [req for req in FakeRedcapAPI.requests
+                   if req["content"] == "record"]
+        assert len(exports) == 1
+        assert "filterLogic" in exports[0]
+
+    def test_incomplete_records_are_ignored(self, config, server):
+        self.set_server_records([("1", "STU01_CMH_0001_01_01")],
+                                complete="0")
+
+        assert rc_utils.reconcile_records(config) == 0
+        assert dashboard.models.RedcapRecord.query.count() == 0
+
+    def test_running_twice_does_not_duplicate_records(self, config, server):
+        self.set_server_records([("1", "STU01_CMH_0001_01_01")])
+
+        rc_utils.reconcile_records(config)
+        assert rc_utils.reconcile_records(config) == 0
+        assert dashboard.models.RedcapRecord.query.count() == 1
+
+    def test_reuses_client_metadata_between_runs(self, config, server):
+        self.set_server_records([("1", "STU01_CMH_0001_01_01")])
+
+        rc_utils.reconcile_records(config)
+        rc_utils.reconcile_records(config)
+
+        metadata = [req for req in FakeRedcapAPI.requests
+                    if req["content"] == "metadata"]
+        assert len(metadata) == 1
+
+    def set_server_records(self, records, complete="2"):
+        FakeRedcapAPI.records = [
+            {"record_id": record,
+             "par_id": session,
+             "date": "2022-02-10",
+             "cmts": "Scan went ok",
+             "mri_scan_log_complete": complete}
+            for record, session in records
+        ]
+
+    @pytest.fixture
+    def server(self):
+        FakeRedcapAPI.requests = []
+        httpd = HTTPServer(("127.0.0.1", 0), FakeRedcapAPI)
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        rc_utils.clear_project_cache()
+        yield "http://127.0.0.1:{}/redcap/".format(httpd.server_port)
+        httpd.shutdown()
+        httpd.server_close()
+        rc_utils.clear_project_cache()
+
+    @pytest.fixture
+    def config(self, dash_db, server):
+        study = dashboard.models.Study("STUDY")
+        dash_db.session.add(study)
+        study.update_site("CMH", code="STU01", create=True)
+
+        rc = dashboard.models.RedcapConfig(9999, "mri_scan_log", server)
+        rc.date_field = "date"
+        rc.comment_field = "cmts"
+        rc.session_id_field = "par_id"
+        rc.completed_field = "mri_scan_log_complete"
+        rc.completed_value = "2"
+        rc.token = "A" * 32
+        dash_db.session.add(rc)
+        dash_db.session.commit()
+        return rc
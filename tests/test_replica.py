@@ -0,0 +1,41 @@
+import pytest
+
+from dashboard import replica
+
+
+class TestRoutingSession:
+
+    def test_queries_use_primary_by_default(self, dash_db, replica_db):
+        assert dash_db.session.get_bind() is dash_db.engine
+
+    def test_flagged_session_uses_replica(self, dash_db, replica_db):
+        dash_db.session.info["use_replica"] = True
+        assert dash_db.session.get_bind() is replica_db
+
+    def test_primary_used_when_no_replica_configured(self, dash_db):
+        dash_db.session.info["use_replica"] = True
+        assert dash_db.session.get_bind() is dash_db.engine
+
+    def test_flush_switches_session_back_to_primary(self, dash_db,
+                                                    replica_db):
+        dash_db.session.info["use_replica"] = True
+        dash_db.session._flushing = True
+        try:
+            assert dash_db.session.get_bind() is dash_db.engine
+        finally:
+            dash_db.session._flushing = False
+        assert dash_db.session.get_bind() is dash_db.engine
+
+    def test_primary_used_after_replica_fails(self, dash_db, replica_db,
+                                              dash_app):
+        dash_db.session.info["use_replica"] = True
+        replica.mark_replica_down(dash_app, "Connection refused")
+        assert dash_db.session.get_bind() is dash_db.engine
+
+    @pytest.fixture
+    def replica_db(self, dash_app, dash_db, monkeypatch):
+        monkeypatch.setitem(
+            dash_app.config, "SQLALCHEMY_BINDS",
+            {"replica": dash_app.config["SQLALCHEMY_DATABASE_URI"]})
+        monkeypatch.setattr(replica, "_replica_down_until", 0)
+        return dash_db.get_engine(dash_app, bind="replica")
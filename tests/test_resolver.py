@@ -0,0 +1,80 @@
+"""Tests for dashboard.resolver
+"""
+import pytest
+from sqlalchemy import event
+
+import dashboard
+from dashboard.resolver import IdResolver
+from datman import scanid
+from tests.utils import add_studies
+
+
+class TestIdResolver:
+
+    def test_finds_studies_by_site_code(self, records):
+        resolver = IdResolver(ttl=300)
+        assert resolver.find_studies("STU01", "CMH") == ["STUDY1"]
+        assert resolver.find_studies("STU01", "UTO") == []
+
+    def test_finds_studies_by_alt_code(self, records):
+        resolver = IdResolver(ttl=300)
+        assert resolver.find_studies("ALT01", "CMH") == ["STUDY1"]
+
+    def test_index_updated_when_study_site_code_changes(self, records):
+        resolver = dashboard.resolver.resolver
+        assert resolver.find_studies("STU02", "CMH") == []
+
+        records.update_site("CMH", code="STU02")
+
+        assert resolver.find_studies("STU02", "CMH") == ["STUDY1"]
+
+    def test_resolves_existing_timepoint_and_session(self, records):
+        resolver = IdResolver(ttl=300)
+        resolver.find_studies("STU01", "CMH")
+        ident = scanid.parse("STU01_CMH_0001_01_01")
+
+        with QueryCounter(dashboard.db.engine) as counter:
+            found = resolver.resolve(ident)
+
+        assert counter.count <= 1
+        assert found.studies == ["STUDY1"]
+        assert found.timepoint.name == "STU01_CMH_0001_01"
+        assert found.session.num == 1
+
+    def test_missing_records_are_none(self, records):
+        resolver = IdResolver(ttl=300)
+        found = resolver.resolve(scanid.parse("STU01_CMH_0002_01_01"))
+        assert found.studies == ["STUDY1"]
+        assert found.timepoint is None
+        assert found.session is None
+
+    @pytest.fixture
+    def records(self, dash_db):
+        study = add_studies({"STUDY1": {"CMH": []}})[0]
+        study.update_site("CMH", code="STU01")
+        dash_db.session.add(dashboard.models.AltStudyCode(
+            study_id="STUDY1", site_id="CMH", code="ALT01"))
+        timepoint = dashboard.models.Timepoint("STU01_CMH_0001_01", "CMH")
+        study.add_timepoint(timepoint)
+        timepoint.add_session(1)
+        dash_db.session.commit()
+        dash_db.session.expire_all()
+        yield study
+        dashboard.resolver.resolver.invalidate()
+
+
+class QueryCounter:
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.engine, 'before_cursor_execute', self)
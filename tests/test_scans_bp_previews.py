@@ -0,0 +1,162 @@
+"""Tests for dashboard.blueprints.scans.previews
+"""
+
+import os
+
+import numpy as np
+import nibabel as nib
+import pytest
+from mock import patch
+
+import dashboard.blueprints.scans.previews as previews
+
+
+class TestMakePreview:
+
+    def test_4d_preview_keeps_first_middle_last_and_mean(self, series,
+                                                         tmp_path):
+        dest = str(tmp_path / "preview.nii.gz")
+        previews.make_preview(series, dest, max_size=64)
+
+        result = nib.load(dest)
+        assert result.shape == (64, 32, 10, 4)
+        assert result.get_data_dtype() == np.int16
+
+        data = result.get_fdata()
+        orig = nib.load(series).get_fdata()
+        expected = [orig[..., 0], orig[..., 10], orig[..., 19],
+                    orig.mean(axis=3)]
+        for idx, vol in enumerate(expected):
+            assert np.allclose(data[..., idx], previews.downsample(vol, 2),
+                               atol=0.5)
+
+    def test_3d_image_is_only_downsampled(self, tmp_path):
+        source = str(tmp_path / "anat.nii")
+        nib.save(nib.Nifti1Image(np.ones((256, 256, 8), dtype=np.float32),
+                                 np.eye(4)), source)
+        dest = str(tmp_path / "preview.nii.gz")
+
+        previews.make_preview(source, dest, max_size=128)
+
+        assert nib.load(dest).shape == (128, 128, 8)
+
+    def test_preview_stays_aligned_with_source(self, series, tmp_path):
+        dest = str(tmp_path / "preview.nii.gz")
+        previews.make_preview(series, dest, max_size=64)
+
+        orig = nib.load(series).affine
+        result = nib.load(dest).affine
+        # The first preview voxel is centred between the first two originals
+        assert np.allclose(result.dot([0, 0, 0, 1]),
+                           orig.dot([0.5, 0.5, 0, 1]))
+        assert np.allclose(result[:3, :3], orig[:3, :3].dot(
+            np.diag([2, 2, 1])))
+
+    def test_older_previews_of_same_scan_are_removed(self, series, tmp_path):
+        old = str(tmp_path / "abc_1.nii.gz")
+        new = str(tmp_path / "abc_2.nii.gz")
+        other = str(tmp_path / "def_1.nii.gz")
+        for path in [old, other]:
+            open(path, "w").close()
+
+        previews.make_preview(series, new, max_size=64)
+
+        assert sorted(os.listdir(tmp_path)) == [
+            "abc_2.nii.gz", "def_1.nii.gz", "func.nii"]
+
+    def test_compressed_series_is_memory_mapped(self, series, tmp_path):
+        compressed = str(tmp_path / "func.nii.gz")
+        nib.save(nib.load(series), compressed)
+        scratch = str(tmp_path / "scratch.nii")
+
+        with previews.open_image(compressed, scratch) as image:
+            assert isinstance(image.dataobj, nib.arrayproxy.ArrayProxy)
+            assert image.dataobj.file_like == scratch
+        assert not os.path.exists(scratch)
+
+    def test_compressed_series_is_never_fully_loaded(self, series,
+                                                     tmp_path):
+        compressed = str(tmp_path / "func.nii.gz")
+        nib.save(nib.load(series), compressed)
+
+        previews.make_preview(series, str(tmp_path / "a.nii.gz"),
+                              max_size=64)
+        with patch.object(nib.Nifti1Image, "get_fdata") as mock_fdata:
+            previews.make_preview(compressed, str(tmp_path / "b.nii.gz"),
+                                  max_size=64)
+        assert mock_fdata.call_count == 0
+        assert np.allclose(nib.load(str(tmp_path / "a.nii.gz")).get_fdata(),
+                           nib.load(str(tmp_path / "b.nii.gz")).get_fdata())
+        assert not [name for name in os.listdir(tmp_path) if ".tmp." in name]
+
+    @pytest.fixture
+    def series(self, tmp_path):
+        path = str(tmp_path / "func.nii")
+        data = np.arange(128 * 64 * 10 * 20, dtype=np.float32).reshape(
+            (128, 64, 10, 20)) % 1000
+        affine = np.diag([2.0, 2.0, 3.0, 1.0])
+        affine[:3, 3] = [-100, -60, -20]
+        nib.save(nib.Nifti1Image(data, affine), path)
+        return path
+
+
+class TestQuantise:
+
+    def test_values_restored_by_slope_and_intercept(self):
+        data = np.linspace(-50.5, 3000.25, 1000).reshape((10, 10, 10))
+
+        result, slope, inter = previews.quantise(data, np.int16)
+
+        assert result.dtype == np.int16
+        assert np.allclose(result * slope + inter, data, atol=slope)
+
+    def test_constant_data_does_not_divide_by_zero(self):
+        data = np.full((4, 4, 4), 7.0)
+
+        result, slope, inter = previews.quantise(data, np.uint8)
+
+        assert np.allclose(result * slope + inter, data)
+
+
+class TestRequestPreview:
+
+    def test_returns_cached_preview_without_regenerating(self, dash_app,
+                                                         tmp_path):
+        source = tmp_path / "scan.nii"
+        source.write_bytes(b"")
+        with dash_app.app_context():
+            dash_app.config["SCAN_CACHE_DIR"] = str(tmp_path / "cache")
+            preview = previews.get_preview_path(str(source))
+            open(preview, "w").close()
+
+            with patch.object(previews, "_get_pool") as mock_pool:
+                assert previews.request_preview(str(source)) == preview
+                assert mock_pool.call_count == 0
+
+    def test_missing_preview_submitted_once(self, dash_app, tmp_path):
+        source = tmp_path / "scan.nii"
+        source.write_bytes(b"")
+        with dash_app.app_context():
+            dash_app.config["SCAN_CACHE_DIR"] = str(tmp_path / "cache")
+            with patch.object(previews, "_get_pool") as mock_pool:
+                assert previews.request_preview(str(source)) is None
+                assert previews.request_preview(str(source)) is None
+                assert mock_pool.return_value.submit.call_count == 1
+            previews._pending.clear()
+
+    def test_failed_preview_not_resubmitted(self, dash_app, tmp_path):
+        source = tmp_path / "scan.nii"
+        source.write_bytes(b"")
+        with dash_app.app_context():
+            dash_app.config["SCAN_CACHE_DIR"] = str(tmp_path / "cache")
+            with patch.object(previews, "_get_pool") as mock_pool:
+                previews.request_preview(str(source))
+                future = mock_pool.return_value.submit.return_value
+                future.exception.return_value = ValueError("Corrupt file")
+                previews._finish(previews.get_preview_path(str(source)),
+                                 future)
+
+                with pytest.raises(OSError):
+                    previews.request_preview(str(source))
+                assert mock_pool.return_value.submit.call_count == 1
+            previews._failed.clear()
@@ -0,0 +1,170 @@
+"""Tests for dashboard.blueprints.scans.thumbnails
+"""
+
+import os
+import zlib
+import struct
+
+import numpy as np
+import nibabel as nib
+import pytest
+from mock import patch
+
+import dashboard.blueprints.scans.thumbnails as thumbnails
+import dashboard.blueprints.scans.monitors as monitors
+
+
+class TestMakeThumbnail:
+
+    def test_axial_slice_shows_right_anterior_at_top_right(self, lps_image):
+        result = thumbnails.make_thumbnail(lps_image, "axial", max_size=50)
+
+        # Rows run anterior to posterior, columns subject's left to right
+        assert result.shape == (50, 40)
+        assert result[0, -1] == 255
+        assert result[-1, 0] == 0
+
+    def test_non_isotropic_voxels_are_scaled(self, lps_image):
+        coronal = thumbnails.make_thumbnail(lps_image, "coronal", max_size=60)
+        sagittal = thumbnails.make_thumbnail(lps_image, "sagittal",
+                                             max_size=60)
+
+        # 30 slices at 2mm are taller than 40 or 50 voxels at 1mm
+        assert coronal.shape == (60, 40)
+        assert sagittal.shape == (60, 50)
+
+    def test_time_index_selects_volume(self, tmp_path):
+        path = str(tmp_path / "func.nii")
+        data = np.zeros((10, 10, 10, 3), dtype=np.float32)
+        data[:5, ..., 2] = 1
+        nib.save(nib.Nifti1Image(data, np.eye(4)), path)
+
+        assert thumbnails.make_thumbnail(path, "axial", 0, 10).max() == 0
+        assert thumbnails.make_thumbnail(path, "axial", 2, 10).max() == 255
+
+    def test_time_index_out_of_range_raises_value_error(self, tmp_path):
+        path = str(tmp_path / "func.nii")
+        nib.save(nib.Nifti1Image(np.zeros((4, 4, 4, 2), dtype=np.float32),
+                                 np.eye(4)), path)
+
+        with pytest.raises(ValueError):
+            thumbnails.make_thumbnail(path, "axial", 5)
+
+    @pytest.fixture
+    def lps_image(self, tmp_path):
+        path = str(tmp_path / "anat.nii")
+        data = np.zeros((40, 50, 30), dtype=np.float32)
+        # Array axes run left, posterior, superior. Mark the right-anterior
+        # edge of the volume.
+        data[:5, :5, :] = 100
+        nib.save(nib.Nifti1Image(data, np.diag([-1.0, -1.0, 2.0, 1.0])), path)
+        return path
+
+
+class TestEncodePng:
+
+    def test_png_round_trips(self):
+        data = np.arange(12, dtype=np.uint8).reshape((3, 4)) * 20
+
+        result = thumbnails.encode_png(data)
+
+        assert result.startswith(b"\x89PNG\r\n\x1a\n")
+        width, height, depth, colour = struct.unpack(">IIBB", result[16:26])
+        assert (width, height, depth, colour) == (4, 3, 8, 0)
+        start = result.index(b"IDAT") + 4
+        length = struct.unpack(">I", result[start - 8:start - 4])[0]
+        rows = np.frombuffer(zlib.decompress(result[start:start + length]),
+                             dtype=np.uint8).reshape((3, 5))
+        assert np.array_equal(rows[:, 1:], data)
+
+
+class TestGetThumbnails:
+
+    def test_thumbnails_are_cached(self, dash_app, anat):
+        with dash_app.app_context():
+            first = thumbnails.get_thumbnails(anat)
+            modified = os.stat(first["sagittal"]).st_mtime_ns
+            second = thumbnails.get_thumbnails(anat)
+
+        assert first == second
+        assert sorted(first) == sorted(thumbnails.VIEWS)
+        assert os.stat(second["sagittal"]).st_mtime_ns == modified
+
+    def test_compressed_scan_matches_uncompressed(self, dash_app, anat,
+                                                  tmp_path):
+        compressed = str(tmp_path / "anat.nii.gz")
+        nib.save(nib.load(anat), compressed)
+
+        with dash_app.app_context():
+            plain = thumbnails.get_thumbnails(anat)
+            packed = thumbnails.get_thumbnails(compressed)
+
+        for view in thumbnails.VIEWS:
+            with open(plain[view], "rb") as fh1, \
+                    open(packed[view], "rb") as fh2:
+                assert fh1.read() == fh2.read()
+
+    @pytest.fixture
+    def anat(self, dash_app, tmp_path):
+        path = str(tmp_path / "anat.nii")
+        data = np.arange(8 * 8 * 8, dtype=np.float32).reshape((8, 8, 8))
+        nib.save(nib.Nifti1Image(data, np.eye(4)), path)
+        dash_app.config["SCAN_CACHE_DIR"] = str(tmp_path / "cache")
+        return path
+
+
+class TestRequestThumbnail:
+
+    def test_missing_thumbnails_are_queued_not_made(self, dash_app,
+                                                    tmp_path):
+        path = self.make_scan(tmp_path)
+        with dash_app.app_context():
+            dash_app.config["SCAN_CACHE_DIR"] = str(tmp_path / "cache")
+            with patch.object(thumbnails, "submit") as mock_submit:
+                assert thumbnails.request_thumbnail(path, "axial") is None
+
+        key, _, _, targets = mock_submit.call_args[0][:4]
+        assert sorted(targets) == sorted(thumbnails.VIEWS)
+        assert key == targets["axial"]
+        assert not any(os.path.exists(dest) for dest in targets.values())
+
+    def test_cached_thumbnail_returned(self, dash_app, tmp_path):
+        path = self.make_scan(tmp_path)
+        with dash_app.app_context():
+            dash_app.config["SCAN_CACHE_DIR"] = str(tmp_path / "cache")
+            made = thumbnails.get_thumbnails(path)
+            with patch.object(thumbnails, "submit") as mock_submit:
+                assert thumbnails.request_thumbnail(path, "axial") == \
+                    made["axial"]
+        assert not mock_submit.called
+
+    def test_unknown_view_raises_value_error(self, dash_app, tmp_path):
+        with dash_app.app_context():
+            with pytest.raises(ValueError):
+                thumbnails.request_thumbnail(str(tmp_path / "anat.nii"),
+                                             "oblique")
+
+    def make_scan(self, tmp_path):
+        path = str(tmp_path / "anat.nii")
+        nib.save(nib.Nifti1Image(np.ones((8, 8, 8), dtype=np.float32),
+                                 np.eye(4)), path)
+        return path
+
+
+class TestMakeThumbnails:
+
+    def test_unreadable_scans_are_skipped_next_time(self, dash_app,
+                                                    tmp_path):
+        path = str(tmp_path / "anat.nii")
+        open(path, "w").close()
+        dash_app.config["SCAN_CACHE_DIR"] = str(tmp_path / "cache")
+
+        with dash_app.app_context(), \
+                patch.object(monitors, "get_nifti_path", return_value=path), \
+                patch.object(monitors, "get_thumbnails") as mock_make:
+            mock_make.side_effect = OSError("Corrupt file")
+            assert monitors.make_thumbnails(["scan"]) == 0
+            assert monitors.make_thumbnails(["scan"]) == 0
+
+        assert mock_make.call_count == 1
+        monitors._failed.clear()
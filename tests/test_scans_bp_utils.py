@@ -0,0 +1,110 @@
+"""Tests for dashboard.blueprints.scans.utils
+"""
+
+import os
+
+import pytest
+from mock import patch
+
+import dashboard.blueprints.scans.utils as utils
+
+
+class TestSendScan:
+
+    def test_response_has_strong_etag_and_last_modified(self, dash_app,
+                                                        nifti):
+        with dash_app.test_request_context('/'):
+            response = utils.send_scan(nifti, "scan.nii.gz")
+
+        stat = os.stat(nifti)
+        etag, weak = response.get_etag()
+        assert response.status_code == 200
+        assert not weak
+        assert etag == "{:x}-{:x}".format(stat.st_size, stat.st_mtime_ns)
+        assert response.last_modified is not None
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+
+    def test_matching_etag_gets_not_modified(self, dash_app, nifti):
+        with dash_app.test_request_context('/'):
+            etag = utils.send_scan(nifti, "scan.nii.gz").headers['ETag']
+
+        with dash_app.test_request_context(
+                '/', headers={'If-None-Match': etag}):
+            response = utils.send_scan(nifti, "scan.nii.gz")
+
+        assert response.status_code == 304
+
+    def test_modified_file_is_resent(self, dash_app, nifti):
+        with dash_app.test_request_context('/'):
+            etag = utils.send_scan(nifti, "scan.nii.gz").headers['ETag']
+
+        with open(nifti, "ab") as fh:
+            fh.write(b"more data")
+
+        with dash_app.test_request_context(
+                '/', headers={'If-None-Match': etag}):
+            response = utils.send_scan(nifti, "scan.nii.gz")
+
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_range_request_gets_partial_content(self, dash_app, nifti):
+        with dash_app.test_request_context(
+                '/', headers={'Range': 'bytes=0-99'}):
+            response = utils.send_scan(nifti, "scan.nii.gz")
+            response.direct_passthrough = False
+            body = response.get_data()
+
+        assert response.status_code == 206
+        assert response.headers['Content-Range'] == 'bytes 0-99/1024'
+        assert body == b"\x1f" * 100
+
+    def test_x_accel_redirect_used_when_configured(self, dash_app, nifti):
+        root = os.path.dirname(nifti)
+        with dash_app.test_request_context('/'):
+            with patch.dict(dash_app.config, {'SCAN_ACCEL_PREFIX': '/scans/',
+                                              'SCAN_ACCEL_ROOT': root}):
+                response = utils.send_scan(nifti, "scan.nii.gz")
+
+        assert response.headers['X-Accel-Redirect'] == '/scans/scan.nii.gz'
+        assert response.get_data() == b""
+
+    def test_offloaded_matching_etag_is_not_redirected(self, dash_app,
+                                                       nifti):
+        root = os.path.dirname(nifti)
+        with patch.dict(dash_app.config, {'SCAN_ACCEL_PREFIX': '/scans/',
+                                          'SCAN_ACCEL_ROOT': root}):
+            with dash_app.test_request_context('/'):
+                etag = utils.send_scan(nifti, "scan.nii.gz").headers['ETag']
+
+            with dash_app.test_request_context(
+                    '/', headers={'If-None-Match': etag}):
+                response = utils.send_scan(nifti, "scan.nii.gz")
+
+        assert response.status_code == 304
+        assert 'X-Accel-Redirect' not in response.headers
+
+    def test_x_sendfile_dropped_when_not_modified(self, dash_app, nifti):
+        with patch.dict(dash_app.config, {'USE_X_SENDFILE': True}):
+            with dash_app.test_request_context('/'):
+                first = utils.send_scan(nifti, "scan.nii.gz")
+
+            with dash_app.test_request_context(
+                    '/', headers={'If-None-Match': first.headers['ETag']}):
+                response = utils.send_scan(nifti, "scan.nii.gz")
+
+        assert 'X-Sendfile' in first.headers
+        assert response.status_code == 304
+        assert 'X-Sendfile' not in response.headers
+
+    def test_missing_file_raises_os_error(self, dash_app, tmp_path):
+        with dash_app.test_request_context('/'):
+            with pytest.raises(OSError):
+                utils.send_scan(str(tmp_path / "missing.nii.gz"),
+                                "missing.nii.gz")
+
+    @pytest.fixture
+    def nifti(self, tmp_path):
+        path = tmp_path / "scan.nii.gz"
+        path.write_bytes(b"\x1f" * 1024)
+        return str(path)